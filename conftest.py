@@ -32,3 +32,12 @@ def tmp_book_path(tmp_path):
     shutil.copytree('tests/example_book/_build/html',
                     test_env, dirs_exist_ok=True)
     return test_env
+
+
+@pytest.fixture
+def example_book(tmp_path, monkeypatch: pytest.MonkeyPatch):
+    """ a copy of the example book, with the cwd set for our target """
+    test_env = tmp_path / 'tmp'
+    shutil.copytree('tests/example_book', test_env)
+    monkeypatch.chdir(tmp_path)
+    return test_env
@@ -1,9 +1,14 @@
 import json
-import logging
+import sys
 from pathlib import Path
+from typing import Optional
+from .context import ConversionContext
 
 
-def update_atlas(atlas: Path, processed_files: list, modify_file: bool = True):
+def update_atlas(atlas: Path,
+                 processed_files: list,
+                 modify_file: bool = True,
+                 ctx: Optional[ConversionContext] = None):
     """
     If there is an atlas.json file present in the source directory,
     update it with the new files processed by the script.
@@ -14,6 +19,7 @@ def update_atlas(atlas: Path, processed_files: list, modify_file: bool = True):
     Processed files should go between boilerplate/expected front matter
     and backmatter.
     """
+    ctx = ctx or ConversionContext()
     ordered_frontmatter = [
         'cover.html',
         'praise.html',
@@ -51,16 +57,17 @@ def update_atlas(atlas: Path, processed_files: list, modify_file: bool = True):
 
         if modify_file:  # write back to atlas.json
             atlas.write_text(json.dumps(atlas_json, sort_keys=True, indent=4))
-            logging.info('Updated atlas.json')
+            ctx.log.info('Updated atlas.json')
             return
         else:  # or, save a bunch of opens during testing
             return atlas_json
 
     except FileNotFoundError:
-        logging.error("Unable to find the provided atlas.json file.")
-        print(", ".join(processed_files))
+        ctx.log.error("Unable to find the provided atlas.json file.")
+        # (on stderr, so as not to mix with any events on stdout)
+        print(", ".join(processed_files), file=sys.stderr)
 
     except KeyError:
-        logging.error("Couldn't find the 'files' element in the provided " +
+        ctx.log.error("Couldn't find the 'files' element in the provided " +
                       "atlas.json file. Ensure it is not malformed.")
-        print(", ".join(processed_files))
+        print(", ".join(processed_files), file=sys.stderr)
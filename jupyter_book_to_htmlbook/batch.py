@@ -0,0 +1,250 @@
+import json
+import logging
+import os
+import time
+import typer
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+from yaml import load  # type: ignore
+from .cache import ConversionCache
+from .conversion import ConversionOptions, convert_book
+from .toc_processing import SafeLoader
+
+
+app = typer.Typer()
+
+# options a manifest entry may set, mapped to their ConversionOptions field
+MANIFEST_OPTIONS = {
+    "skip_jb_build": "skip_jb_build",
+    "auto_jb_build": "auto_jb_build",
+    "split_jb_build": "split_jb_build",
+    "jb_fail_fast": "jb_fail_fast",
+    "jb_timeout": "jb_timeout",
+    "jb_in_process": "jb_in_process",
+    "build_cache": "build_cache",
+    "build_cache_size": "build_cache_size",
+    "pre_execute": "pre_execute",
+    "notebook_timeout": "notebook_timeout",
+    "skip_numbering": "skip_cell_numbering",
+    "include_root": "include_root",
+    "keep_highlighting": "keep_highlighting",
+    "keep_going": "keep_going",
+    "only": "only",
+    "disable_passes": "disable_passes",
+}
+
+# books all log through this logger, each with its own handler (and log
+# file) that only takes the book's messages, so books converted at the same
+# time don't end up in each other's logs
+logger = logging.getLogger("jb2htmlbook.batch")
+logger.propagate = False
+logger.setLevel(logging.DEBUG)
+
+
+# each worker process keeps one cache for all of the books it converts
+_worker_cache: Optional[ConversionCache] = None
+
+
+def _init_worker():
+    global _worker_cache
+    _worker_cache = ConversionCache()
+
+
+def _convert_in_worker(entry: dict) -> dict:
+    """ converts an entry in a worker process, using the worker's cache """
+    return convert_entry(entry, _worker_cache)
+
+
+class _TargetFilter(logging.Filter):
+    """ passes only the messages logged for a given target """
+
+    def __init__(self, target: str):
+        super().__init__()
+        self.target = target
+
+    def filter(self, record):
+        return getattr(record, "target", None) == self.target
+
+
+def load_manifest(manifest: Path) -> list:
+    """
+    Reads a batch manifest (YAML or JSON) and returns a list of book entries.
+
+    The manifest is either a list of entries or a mapping with a "books" list;
+    each entry needs a "source" and a "target", and can optionally provide an
+    "atlas_json" path and a mapping of "options".
+    """
+    with open(manifest) as f:
+        data = load(f.read(), SafeLoader)
+
+    if isinstance(data, dict):
+        data = data.get("books")
+
+    if not isinstance(data, list):
+        raise ValueError(f"Malformed batch manifest: {manifest}. Expected " +
+                         "a list of books or a 'books' list.")
+
+    return [parse_entry(entry) for entry in data]
+
+
+def parse_entry(entry) -> dict:
+    """
+    Validates and normalizes a single book entry (as found in a manifest or
+    sent to the conversion server)
+    """
+    if (
+            not isinstance(entry, dict) or
+            "source" not in entry or
+            "target" not in entry
+       ):
+        raise ValueError("Each book requires a " +
+                         f"'source' and a 'target': {entry}")
+    options = entry.get("options") or {}
+    if not isinstance(options, dict):
+        raise ValueError(f"Malformed options for {entry['source']}")
+    unknown = [key for key in options if key not in MANIFEST_OPTIONS]
+    if unknown:
+        raise ValueError(f"Unknown option(s) {', '.join(unknown)} " +
+                         f"for {entry['source']}")
+    return {
+        "source": str(entry["source"]),
+        "target": str(entry["target"]),
+        "atlas_json": entry.get("atlas_json"),
+        "options": options,
+    }
+
+
+def convert_entry(entry: dict,
+                  cache: Optional[ConversionCache] = None) -> dict:
+    """
+    Converts a single manifest entry, logging to the target's own
+    jb2htmlbook.log file, and returns a status report for the book.
+
+    Failures are reported rather than raised so one bad book doesn't
+    take the rest of the batch down with it.
+    """
+    start = time.perf_counter()
+    output_dir = Path.cwd() / entry["target"]
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    book_logger = logging.LoggerAdapter(logger, {"target": str(output_dir)})
+    handler = logging.FileHandler(output_dir / 'jb2htmlbook.log',
+                                  encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
+    handler.addFilter(_TargetFilter(str(output_dir)))
+    logger.addHandler(handler)
+
+    report = {
+        "source": entry["source"],
+        "target": entry["target"],
+        "status": "ok",
+        "files": [],
+        "warnings": [],
+        "failures": [],
+        "error": None,
+    }
+
+    try:
+        options = ConversionOptions(
+            atlas_json=entry["atlas_json"],
+            **{MANIFEST_OPTIONS[key]: value
+               for key, value in entry["options"].items()})
+        result = convert_book(entry["source"], entry["target"], options,
+                              book_logger, cache)
+        report["files"] = result.files
+        report["warnings"] = result.warnings
+        report["failures"] = result.failures
+        if result.failures:
+            report["status"] = "failed"
+            report["error"] = f"{len(result.failures)} chapter(s) failed"
+    except Exception as error:
+        book_logger.error(f"Failed to convert {entry['source']}: {error}")
+        report["status"] = "failed"
+        report["error"] = str(error) or type(error).__name__
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    return report
+
+
+def convert_books(entries: list, jobs: Optional[int] = None) -> list:
+    """
+    Converts all manifest entries using a shared pool of worker processes,
+    returning the reports in manifest order. Each worker keeps a
+    ConversionCache for all of the books it converts, so e.g. books that
+    share sources don't each start cold.
+    """
+    if jobs == 1:  # no need for the pool overhead
+        cache = ConversionCache()
+        return [convert_entry(entry, cache) for entry in entries]
+
+    with ProcessPoolExecutor(max_workers=jobs,
+                             initializer=_init_worker) as pool:
+        return list(pool.map(_convert_in_worker, entries))
+
+
+def format_report(reports: list) -> str:
+    """ a simple per-book status and timing table """
+    lines = []
+    for report in reports:
+        line = (f"{report['status']:<6} {report['seconds']:>9.2f}s  " +
+                f"{report['source']} -> {report['target']}")
+        if report["error"]:
+            line += f" ({report['error']})"
+        lines.append(line)
+    total = sum(report["seconds"] for report in reports)
+    failed = len([r for r in reports if r["status"] != "ok"])
+    lines.append(f"{len(reports)} books, {failed} failed, " +
+                 f"{total:.2f}s total conversion time")
+    return "\n".join(lines)
+
+
+@app.command()  # note that docstring serves as help text
+def batch(
+        manifest: str,
+        jobs: Optional[int] = typer.Option(
+            None,
+            "--jobs",
+            "-j",
+            help="Number of worker processes (defaults to the CPU count)"
+            ),
+        report: Optional[str] = typer.Option(
+            None,
+            "--report",
+            help="Path to write the per-book status report as JSON"
+            )
+        ):
+    """
+    Converts many Jupyter Book projects into HTMLBook in one invocation.
+
+    Takes a MANIFEST (YAML or JSON) listing books, each with a `source`,
+    a `target`, and optionally an `atlas_json` path and `options` (most of
+    jb2htmlbook's own options, in snake case, e.g., skip_jb_build; see the
+    README for the full list), and converts them using a shared pool of
+    worker processes.
+
+    Each book's run information is saved to the jb2htmlbook.log file in its
+    target directory. A status and timing report is printed at the end.
+    """
+    try:
+        entries = load_manifest(Path(manifest))
+    except (FileNotFoundError, ValueError) as error:
+        print(error)
+        raise typer.Exit(1)
+
+    reports = convert_books(entries, jobs or os.cpu_count())
+
+    if report:
+        Path(report).write_text(json.dumps(reports, indent=4))
+
+    print(format_report(reports))
+
+    if any(r["status"] != "ok" for r in reports):
+        raise typer.Exit(1)
+
+
+def main():
+    app()
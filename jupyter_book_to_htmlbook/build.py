@@ -0,0 +1,523 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from collections import Counter
+from importlib import metadata
+from pathlib import Path
+from typing import Optional, Union
+from yaml import load  # type: ignore
+from .context import ConversionContext
+from .toc_processing import SafeLoader
+
+# written to the jupyter book's _build directory after a successful build
+BUILD_FINGERPRINT_FILE = 'jb2htmlbook-build.json'
+SOURCE_EXTENSIONS = ['.ipynb', '.md', '.rst']
+# what the converter itself writes, and so never a build input
+CONVERTER_FILES = ['jb2htmlbook.log', 'jb2htmlbook-failures.json']
+# how much of a file to hash at a time
+HASH_CHUNK_BYTES = 1024 * 1024
+# default size limit of a shared build cache
+BUILD_CACHE_BYTES = 2 * 1024 * 1024 * 1024
+# what to look out for in `jupyter-book build` output
+NOTEBOOK_FAILED = re.compile(r'Executing notebook failed|Execution Failed')
+NOTEBOOK_TIMING = re.compile(r'\bExecut(ed|ing)\b')
+# (Sphinx messages are "LEVEL: ..." or "location: LEVEL: ...", where the
+# location is a file, maybe with a line number)
+SPHINX_ERROR = re.compile(r'^(.*: )?(ERROR|SEVERE|CRITICAL):')
+SPHINX_WARNING = re.compile(r'^(.*: )?WARNING:')
+
+
+def _toc_file_stubs(toc) -> list:
+    """ every `file` (and the `root`) named anywhere in a parsed _toc.yml """
+    stubs = []
+    if isinstance(toc, dict):
+        for key, value in toc.items():
+            if key in ["root", "file"] and isinstance(value, str):
+                stubs.append(value)
+            else:
+                stubs.extend(_toc_file_stubs(value))
+    elif isinstance(toc, list):
+        for item in toc:
+            stubs.extend(_toc_file_stubs(item))
+    return stubs
+
+
+def build_inputs(source: Path) -> list:
+    """
+    The files a `jupyter-book build` of the source depends on (as far as we
+    track them): _toc.yml, _config.yml, its bibliography file(s), and every
+    source file named in the table of contents. Paths are relative to the
+    source directory; some may not exist.
+    """
+    source = Path(source)
+    inputs = ['_toc.yml', '_config.yml']
+
+    try:
+        with open(source / '_config.yml') as f:
+            config = load(f.read(), SafeLoader) or {}
+    except FileNotFoundError:
+        config = {}
+    inputs.extend(config.get('bibtex_bibfiles') or ['references.bib'])
+
+    try:
+        with open(source / '_toc.yml') as f:
+            toc = load(f.read(), SafeLoader)
+    except FileNotFoundError:
+        toc = {}
+    for stub in _toc_file_stubs(toc):
+        path = Path(stub)
+        if path.suffix in SOURCE_EXTENSIONS:
+            inputs.append(stub)
+        else:  # i.e., any of the extensions jupyter book looks for
+            inputs.extend(str(path.with_name(path.name + extension))
+                          for extension in SOURCE_EXTENSIONS)
+
+    return list(dict.fromkeys(inputs))  # i.e., without duplicates
+
+
+def source_tree_files(source: Path, exclude: tuple = ()) -> list:
+    """
+    Every file in the source directory that a build might read besides its
+    tracked inputs (images, data files, and so on): everything but the
+    _build directory, hidden files and directories (e.g., .git), the
+    converter's own files, and the `exclude`d paths (e.g., the output
+    directory), as paths relative to the source directory
+    """
+    source = Path(source)
+    excluded = {Path(path).resolve() for path in exclude}
+    files: list = []
+    for directory, subdirectories, filenames in os.walk(source):
+        relative = Path(directory).relative_to(source)
+        subdirectories[:] = sorted(
+                name for name in subdirectories if not name.startswith('.')
+                and not (relative == Path('.') and name == '_build')
+                and (Path(directory) / name).resolve() not in excluded)
+        files.extend(str(relative / name) for name in sorted(filenames)
+                     if not name.startswith('.')
+                     and name not in CONVERTER_FILES
+                     and (Path(directory) / name).resolve() not in excluded)
+    return files
+
+
+def _file_digest(path: Path) -> str:
+    """ sha256 of a file's contents, read a chunk at a time """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_fingerprint(source: Path, exclude: tuple = ()) -> dict:
+    """
+    sha256 digests of the build's inputs (None for missing files) and of
+    the rest of the source tree, apart from the `exclude`d paths
+    """
+    source = Path(source)
+    fingerprint: dict = {}
+    inputs = build_inputs(source)
+    tracked = set(inputs)
+    for relative in inputs + [path for path in
+                              source_tree_files(source, exclude)
+                              if path not in tracked]:
+        try:
+            fingerprint[relative] = _file_digest(source / relative)
+        except (FileNotFoundError, IsADirectoryError):
+            fingerprint[relative] = None
+    return fingerprint
+
+
+def changed_build_inputs(source: Path,
+                         fingerprint: Optional[dict] = None) -> Optional[list]:
+    """
+    Compares the build's inputs with the fingerprint saved after the last
+    successful build, returning the files that changed since (or None if
+    there's no build to compare with)
+    """
+    source = Path(source)
+    try:
+        with open(source / '_build' / BUILD_FINGERPRINT_FILE) as f:
+            saved = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if not (source / '_build/html').is_dir():
+        return None
+
+    fingerprint = fingerprint or build_fingerprint(source)
+    return sorted(path for path in set(saved) | set(fingerprint)
+                  if saved.get(path) != fingerprint.get(path))
+
+
+def save_build_fingerprint(source: Path, fingerprint: dict):
+    """ records the inputs of a successful build """
+    build_dir = Path(source) / '_build'
+    build_dir.mkdir(exist_ok=True)
+    with open(build_dir / BUILD_FINGERPRINT_FILE, 'wt') as f:
+        json.dump(fingerprint, f, indent=2, sort_keys=True)
+
+
+def needs_build(source: Path,
+                fingerprint: Optional[dict] = None,
+                ctx: Optional[ConversionContext] = None) -> bool:
+    """
+    Whether `jupyter-book build` needs to run, i.e., whether anything it
+    reads has changed since the last successful build (logging what did)
+    """
+    ctx = ctx or ConversionContext()
+    changed = changed_build_inputs(Path(source), fingerprint)
+    if changed is None:
+        ctx.log.info("No record of a previous jupyter-book build; building")
+        return True
+    if changed:
+        ctx.log.info("Changed since the last jupyter-book build: " +
+                     ", ".join(changed))
+        return True
+    ctx.log.info("Nothing changed since the last jupyter-book build; " +
+                 "skipping it")
+    return False
+
+
+def jupyter_book_version() -> str:
+    try:
+        return metadata.version("jupyter-book")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def build_cache_key(fingerprint: dict) -> str:
+    """
+    The build cache key for a book: a hash of its build inputs' contents
+    (but not their paths on disk) and the jupyter-book version
+    """
+    digest = hashlib.sha256(jupyter_book_version().encode())
+    digest.update(json.dumps(fingerprint, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def _tree_size(path: Path) -> int:
+    return sum(file.stat().st_size for file in path.rglob('*')
+               if file.is_file())
+
+
+class BuildCache:
+    """
+    A content-addressed cache of built books' _build/html directories,
+    shareable between checkouts (and machines, e.g., on an NFS mount) much
+    like ccache: entries are keyed by build_cache_key, and the least
+    recently used are removed once the cache grows past `max_bytes`.
+
+    Entries are only ever added or removed by renaming them into (or out
+    of) place, so a build being restored from an entry that's evicted
+    meanwhile fails (and counts as a miss) rather than restoring part of it.
+
+    Hits and misses are counted in `stats` for the run, and added to the
+    running totals kept in the cache directory's stats.json by save_stats.
+    """
+
+    def __init__(self,
+                 directory: Union[str, Path],
+                 max_bytes: int = BUILD_CACHE_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.stats: Counter = Counter()
+        self._saved: Counter = Counter()
+
+    def _entry(self, key: str) -> Path:
+        return self.directory / key[:2] / key
+
+    def restore(self, key: str, source: Path) -> bool:
+        """
+        Puts the cached build for the key (if there is one) in place as the
+        book's _build/html, returning whether there was one
+        """
+        entry = self._entry(key)
+        if not (entry / 'entry.json').exists():
+            self.stats["misses"] += 1
+            return False
+
+        # copy to a temporary directory first, so the book's current build
+        # is only replaced by a complete copy of the entry
+        build_dir = Path(source) / '_build'
+        build_dir.mkdir(exist_ok=True)
+        staging = Path(tempfile.mkdtemp(dir=build_dir))
+        try:
+            # (marking it recently used first makes eviction less likely)
+            os.utime(entry / 'entry.json')
+            shutil.copytree(entry / 'html', staging / 'html')
+        except OSError:  # i.e., evicted before or as we were copying it
+            shutil.rmtree(staging, ignore_errors=True)
+            self.stats["misses"] += 1
+            return False
+
+        html_dir = build_dir / 'html'
+        if html_dir.exists():
+            shutil.rmtree(html_dir)
+        os.rename(staging / 'html', html_dir)
+        staging.rmdir()
+        self.stats["hits"] += 1
+        return True
+
+    def store(self, key: str, source: Path):
+        """ adds the book's _build/html to the cache, then trims the cache """
+        entry = self._entry(key)
+        if (entry / 'entry.json').exists():
+            return
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        # copy to a temporary directory first so that other processes never
+        # see a partial entry
+        staging = Path(tempfile.mkdtemp(dir=entry.parent, prefix='.'))
+        try:
+            shutil.copytree(Path(source) / '_build/html', staging / 'html')
+            with open(staging / 'entry.json', 'wt') as f:
+                json.dump({"size": _tree_size(staging / 'html'),
+                           "jupyter_book": jupyter_book_version()}, f)
+            os.rename(staging, entry)
+        except OSError:  # e.g., another process stored it first
+            shutil.rmtree(staging, ignore_errors=True)
+            return
+        self.stats["stores"] += 1
+        self.evict()
+
+    def entries(self) -> list:
+        """ (last used, size, path) of every cache entry, oldest first """
+        entries = []
+        for info in self.directory.glob('*/*/entry.json'):
+            if info.parent.name.startswith('.'):  # i.e., not in place
+                continue
+            try:
+                with open(info) as f:
+                    size = json.load(f)["size"]
+                entries.append((info.stat().st_mtime, size, info.parent))
+            except (OSError, ValueError, KeyError):
+                continue  # i.e., removed (or being written) elsewhere
+        return sorted(entries)
+
+    def evict(self):
+        """ removes the least recently used entries until we're in budget """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            # move it out of place before removing it, so it's never seen
+            # half removed
+            doomed = path.with_name(f".evicted-{path.name}-{os.getpid()}")
+            try:
+                os.rename(path, doomed)
+            except OSError:  # i.e., evicted elsewhere first
+                continue
+            shutil.rmtree(doomed, ignore_errors=True)
+            total -= size
+            self.stats["evictions"] += 1
+
+    def save_stats(self):
+        """
+        Adds the run's counts (since they were last saved) to the running
+        totals in stats.json; these are best effort, as concurrent runs may
+        lose counts
+        """
+        unsaved = self.stats - self._saved
+        if not unsaved:
+            return
+        stats_file = self.directory / 'stats.json'
+        try:
+            with open(stats_file) as f:
+                totals = Counter(json.load(f))
+        except (OSError, ValueError):
+            totals = Counter()
+        totals.update(unsaved)
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with open(stats_file, 'wt') as f:
+                json.dump(dict(totals), f)
+        except OSError:
+            return
+        self._saved.update(unsaved)
+
+
+def split_toc(toc: dict, groups: int) -> list:
+    """
+    Splits a parsed _toc.yml into (at most) `groups` tables of contents for
+    separate builds, each with the book's root and a run of consecutive
+    parts (or chapters, for books without parts) of roughly the same number
+    of files
+    """
+    key = "parts" if "parts" in toc else "chapters"
+    units = toc.get(key) or []
+    groups = max(min(groups, len(units)), 1)
+    weights = [max(len(_toc_file_stubs(unit)), 1) for unit in units]
+    total = sum(weights)
+
+    split: list = [[] for _ in range(groups)]
+    done = 0
+    for unit, weight in zip(units, weights):
+        # i.e., the group the middle of the unit falls in
+        split[(2 * done + weight) * groups // (2 * total)].append(unit)
+        done += weight
+    return [dict(toc, **{key: group}) for group in split if group]
+
+
+def _absolute_paths(value, source: Path):
+    """
+    the value (a string, or a list or dict of them) with any relative paths
+    of files in the source directory made absolute; anything else is left
+    as it is
+    """
+    if isinstance(value, list):
+        return [_absolute_paths(item, source) for item in value]
+    if isinstance(value, dict):
+        return {key: _absolute_paths(item, source)
+                for key, item in value.items()}
+    if (isinstance(value, str) and value and
+            not os.path.isabs(value) and (source / value).exists()):
+        return str((source / value).resolve())
+    return value
+
+
+# the _config.yml settings that may name files relative to the book
+CONFIG_PATH_SETTINGS = ["bibtex_bibfiles", "html"]
+SPHINX_PATH_SETTINGS = ["html_static_path", "html_extra_path",
+                        "templates_path"]
+
+
+def split_build_config(source: Path, cache: str) -> dict:
+    """
+    The book's _config.yml for a split build: only the files in the split's
+    table of contents are built, notebooks use the split's own jupyter-cache
+    (`cache`), and the paths of the book's files (its bibliography, logo,
+    static files, etc.) are made absolute, since the config is read from
+    the split's build directory
+    """
+    source = Path(source)
+    try:
+        with open(source / '_config.yml') as f:
+            config = load(f.read(), SafeLoader) or {}
+    except FileNotFoundError:
+        config = {}
+    for setting in CONFIG_PATH_SETTINGS:
+        if setting in config:
+            config[setting] = _absolute_paths(config[setting], source)
+    sphinx = config.get("sphinx") or {}
+    if sphinx.get("local_extensions"):
+        sphinx["local_extensions"] = _absolute_paths(
+                sphinx["local_extensions"], source)
+    sphinx_config = sphinx.get("config") or {}
+    for setting in SPHINX_PATH_SETTINGS:
+        if setting in sphinx_config:
+            sphinx_config[setting] = _absolute_paths(sphinx_config[setting],
+                                                     source)
+    config["only_build_toc_files"] = True
+    config["execute"] = dict(config.get("execute") or {},
+                             cache=str(Path(cache).resolve()))
+    return config
+
+
+def jupyter_book_command(source: Union[str, Path], *options: str) -> list:
+    """ the `jupyter-book build` command for the source directory """
+    return ['jupyter-book', 'build', str(source), *options]
+
+
+class JupyterBookRun:
+    """
+    A running `jupyter-book build`, whose output is read line by line as it
+    comes and forwarded to the run's log: notebook execution failures as
+    errors (stopping the build, with the `jb_fail_fast` option), Sphinx
+    errors and warnings as such, notebook execution timings as info, and
+    everything else as debug messages.
+    """
+
+    def __init__(self,
+                 command: list,
+                 ctx: Optional[ConversionContext] = None,
+                 name: str = "jupyter-book"):
+        self.ctx = ctx or ConversionContext()
+        self.name = name
+        self.stopped: Optional[str] = None
+        self._start(command)
+        self.reader = threading.Thread(target=self._read, daemon=True)
+        self.reader.start()
+
+    def _start(self, command: list):
+        self.process = subprocess.Popen(command,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT,
+                                        text=True,
+                                        errors='replace')
+
+    def _read(self):
+        for line in self.process.stdout:  # type: ignore
+            line = line.rstrip()
+            if line:
+                self._forward(line)
+
+    def _forward(self, line: str):
+        ctx = self.ctx
+        message = f"{self.name}: {line}"
+        if NOTEBOOK_FAILED.search(line):
+            ctx.log.error(message)
+            ctx.metrics["jb_notebook_failures"] += 1
+            if ctx.options.jb_fail_fast:
+                self.stop("a notebook failed to execute")
+        elif SPHINX_ERROR.search(line):
+            ctx.log.error(message)
+            ctx.metrics["jb_errors"] += 1
+        elif SPHINX_WARNING.search(line):
+            ctx.log.warning(message)
+            ctx.metrics["jb_warnings"] += 1
+        elif NOTEBOOK_TIMING.search(line):
+            ctx.log.info(message)
+        else:
+            ctx.log.debug(message)
+
+    def poll(self) -> Optional[int]:
+        return self.process.poll()
+
+    def stop(self, reason: str):
+        """ stops the build (if it's still running) """
+        if self.stopped is None and self.process.poll() is None:
+            self.stopped = reason
+            self.process.terminate()
+
+    def finish(self) -> int:
+        """ waits for the build (and its output) and returns its exit code """
+        returncode = self.process.wait()
+        self.reader.join()
+        return returncode
+
+
+def wait_for_builds(runs: list,
+                    timeout: Optional[float] = None,
+                    ctx: Optional[ConversionContext] = None) -> list:
+    """
+    Waits for jupyter-book runs to finish, returning their exit codes. If
+    any is stopped (e.g., on a failed notebook) or they're still running
+    after `timeout` seconds, the rest are stopped too and a RuntimeError is
+    raised, as the build can't be used.
+    """
+    ctx = ctx or ConversionContext()
+    deadline = time.monotonic() + timeout if timeout else None
+    reason = None
+    while any(run.poll() is None for run in runs):
+        reason = next((run.stopped for run in runs if run.stopped), None)
+        if deadline and time.monotonic() > deadline:
+            reason = f"still running after {timeout} seconds"
+        if reason:
+            for run in runs:
+                run.stop(reason)
+            break
+        time.sleep(0.1)
+    returncodes = [run.finish() for run in runs]
+
+    reason = reason or next((run.stopped for run in runs if run.stopped),
+                            None)
+    if reason:
+        message = f"Stopped jupyter-book build: {reason}"
+        ctx.log.error(message)
+        raise RuntimeError(message)
+    return returncodes
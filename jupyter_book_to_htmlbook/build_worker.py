@@ -0,0 +1,186 @@
+import io
+import multiprocessing
+import os
+import sys
+import traceback
+from multiprocessing.connection import Connection
+from typing import Optional
+from .build import JupyterBookRun
+
+# build workers waiting for their next build
+_idle: list = []
+# how build workers are started
+_context = multiprocessing.get_context()
+
+
+def run_build(args: list) -> int:
+    """
+    Runs `jupyter-book build` with the given arguments in this process,
+    returning its exit code
+    """
+    from jupyter_book.cli.main import build  # type: ignore
+    try:
+        build.main(args=args, prog_name="jupyter-book build",
+                   standalone_mode=False)
+    except SystemExit as exit:
+        if exit.code is None or isinstance(exit.code, int):
+            return exit.code or 0
+        print(exit.code, file=sys.stderr)
+        return 1
+    return 0
+
+
+class _ConnectionWriter(io.TextIOBase):
+    """ sends whatever's written to it down a connection """
+
+    def __init__(self, conn: Connection):
+        self.conn = conn
+
+    def write(self, text: str) -> int:
+        if text:
+            self.conn.send(("output", text))
+        return len(text)
+
+
+def _book_modules(directories: list, modules: set) -> list:
+    """
+    the modules imported since `modules` from any of the directories (i.e.,
+    the book's own, such as its local Sphinx extensions)
+    """
+    directories = [os.path.join(os.path.abspath(directory), '')
+                   for directory in directories]
+    book_modules = []
+    for name, module in list(sys.modules.items()):
+        file = getattr(module, '__file__', None)
+        if name not in modules and file and any(
+                os.path.abspath(file).startswith(directory)
+                for directory in directories):
+            book_modules.append(name)
+    return book_modules
+
+
+def _serve(conn: Connection):
+    """
+    A build worker's loop: runs each build it's sent, sending back its
+    output as it's written and then its exit code. The working directory,
+    sys.path and environment variables are put back after each build, and
+    modules imported from the book (or from directories the build added to
+    sys.path) are dropped, so one build's changes don't leak into the next;
+    other modules (jupyter-book, Sphinx and their extensions) are kept, as
+    that's what the worker is for.
+    """
+    sys.stdout = sys.stderr = _ConnectionWriter(conn)  # type: ignore
+    cwd = os.getcwd()
+    while True:
+        try:
+            args = conn.recv()
+        except EOFError:
+            break
+        if args is None:
+            break
+        source = os.path.abspath(args[0])
+        path, environ, modules = list(sys.path), dict(os.environ), \
+            set(sys.modules)
+        try:
+            returncode = run_build(args)
+        except Exception:
+            traceback.print_exc()
+            returncode = 1
+        added = [directory for directory in sys.path
+                 if directory and directory not in path]
+        for name in _book_modules([source, *added], modules):
+            del sys.modules[name]
+        os.chdir(cwd)  # i.e., in case the build didn't
+        sys.path[:] = path
+        os.environ.clear()
+        os.environ.update(environ)
+        conn.send(("finished", returncode))
+
+
+class BuildWorker:
+    """
+    A process that runs jupyter-book builds itself, so jupyter-book, Sphinx
+    and their extensions are only imported once rather than for every build
+    """
+
+    def __init__(self):
+        self.conn, child_conn = _context.Pipe()
+        self.process = _context.Process(target=_serve,
+                                        args=(child_conn,),
+                                        daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.conn.close()
+
+
+def _acquire() -> BuildWorker:
+    """ an idle build worker, or a new one if none are left """
+    while _idle:
+        worker = _idle.pop()
+        if worker.process.is_alive():
+            return worker
+        worker.stop()
+    return BuildWorker()
+
+
+def stop_build_workers():
+    """ stops the idle build workers """
+    while _idle:
+        _idle.pop().stop()
+
+
+class WarmJupyterBookRun(JupyterBookRun):
+    """
+    A `jupyter-book build` run on a warm build worker rather than in a new
+    interpreter (the worker is kept for later builds, unless it's stopped)
+    """
+
+    def _start(self, command: list):
+        self.returncode: Optional[int] = None
+        self.worker = _acquire()
+        # i.e., the arguments to `jupyter-book build`
+        self.worker.conn.send(command[2:])
+
+    def _read(self):
+        pending = ""
+        try:
+            while True:
+                kind, value = self.worker.conn.recv()
+                if kind == "finished":
+                    self.returncode = value
+                    break
+                *lines, pending = (pending + value).split("\n")
+                for line in lines:
+                    if line.strip():
+                        self._forward(line.rstrip())
+        except (EOFError, OSError):  # i.e., the worker died, or was stopped
+            self.worker.process.join()
+            self.returncode = self.worker.process.exitcode or 1
+        if pending.strip():
+            self._forward(pending.rstrip())
+
+    def poll(self) -> Optional[int]:
+        return None if self.reader.is_alive() else self.returncode
+
+    def stop(self, reason: str):
+        if self.stopped is None and self.reader.is_alive():
+            self.stopped = reason
+            self.worker.process.terminate()
+
+    def finish(self) -> int:
+        self.reader.join()
+        if self.worker.process.is_alive():
+            _idle.append(self.worker)
+        else:
+            self.worker.stop()
+        return self.returncode  # type: ignore
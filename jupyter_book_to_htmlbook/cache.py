@@ -0,0 +1,108 @@
+import hashlib
+from collections import Counter
+from pathlib import Path
+from typing import Optional, Union
+from .toc_processing import get_book_toc
+
+
+def file_digest(paths: list) -> str:
+    """ sha256 digest of the contents of the given files, in order """
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(str(path).encode())
+        digest.update(Path(path).read_bytes())
+    return digest.hexdigest()
+
+
+def _toc_element_files(toc_element: Union[Path, list]) -> list:
+    """ the html file(s) making up a toc element """
+    if isinstance(toc_element, list):
+        return toc_element
+    return [toc_element]
+
+
+class ConversionCache:
+    """
+    Caches kept warm between conversions in a long-running process (e.g.,
+    `jb2htmlbook-serve`): parsed tables of contents, keyed on the _toc.yml
+    file's modification time and size, and chapter fingerprints, which let
+    unchanged chapters skip reprocessing when their output is still in place.
+
+    Hits and misses are counted in `stats`.
+    """
+
+    def __init__(self):
+        self.tocs: dict = {}
+        self.chapters: dict = {}
+        self.stats: Counter = Counter()
+
+    def book_toc(self, src_dir: Path, ctx=None) -> list:
+        """ a cached get_book_toc """
+        toc_file = Path(src_dir) / "_toc.yml"
+        try:
+            stat = toc_file.stat()
+        except FileNotFoundError:  # let get_book_toc report it
+            return get_book_toc(Path(src_dir), ctx)
+
+        key = (str(toc_file.resolve()), stat.st_mtime_ns, stat.st_size)
+        if key in self.tocs:
+            self.stats["toc_hits"] += 1
+        else:
+            self.stats["toc_misses"] += 1
+            self.tocs[key] = get_book_toc(Path(src_dir), ctx)
+
+        # hand out a copy so callers can slice and modify it as they like
+        return [list(element) if isinstance(element, list) else element
+                for element in self.tocs[key]]
+
+    def chapter_fingerprint(self,
+                            toc_element: Union[Path, list],
+                            book_ids: list,
+                            *settings) -> str:
+        """
+        A fingerprint of everything that goes into a chapter's output: its
+        html file(s), the IDs already used in the book (which affect our
+        duplicate ID handling) and any conversion settings.
+        """
+        digest = hashlib.sha256(
+                file_digest(_toc_element_files(toc_element)).encode())
+        digest.update(repr(settings).encode())
+        digest.update("\n".join(sorted(book_ids)).encode())
+        return digest.hexdigest()
+
+    def cached_chapter(self,
+                       output_dir: Path,
+                       toc_element: Union[Path, list],
+                       fingerprint: str) -> Optional[tuple]:
+        """
+        Returns the (relative output file, chapter IDs) of a previous
+        conversion if the fingerprint is unchanged and the output file we
+        wrote is still there, untouched
+        """
+        key = (str(output_dir), str(toc_element))
+        cached = self.chapters.get(key)
+        if cached and cached["fingerprint"] == fingerprint:
+            try:
+                stat = (output_dir / cached["file"]).stat()
+                if (stat.st_mtime_ns, stat.st_size) == cached["stat"]:
+                    self.stats["chapter_hits"] += 1
+                    return cached["file"], list(cached["ids"])
+            except FileNotFoundError:
+                pass  # i.e., the output has been removed; convert again
+        self.stats["chapter_misses"] += 1
+        return None
+
+    def store_chapter(self,
+                      output_dir: Path,
+                      toc_element: Union[Path, list],
+                      fingerprint: str,
+                      file: str,
+                      chapter_ids: list):
+        """ remember a chapter's conversion for next time """
+        stat = (output_dir / file).stat()
+        self.chapters[(str(output_dir), str(toc_element))] = {
+            "fingerprint": fingerprint,
+            "file": file,
+            "ids": list(chapter_ids),
+            "stat": (stat.st_mtime_ns, stat.st_size),
+        }
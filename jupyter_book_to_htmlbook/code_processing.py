@@ -1,14 +1,98 @@
 import re
-import logging
-from typing import Union
+from typing import Optional, Union
 from bs4 import NavigableString  # type: ignore
-from .helpers import base_soup
+from .context import ConversionContext
+from .helpers import base_soup, replace_strings
 
 
-def process_code(chapter, skip_numbering: Union[bool, None] = False):
+class CodeBlock:
+    """
+    A <pre> block's spans, gathered once so that its language and any example
+    header can be read, and its spans cleaned up, without searching it again
+    """
+
+    def __init__(self, pre):
+        self.pre = pre
+        self.spans = pre.find_all('span')
+
+    @classmethod
+    def of(cls, pre, ctx: ConversionContext) -> "CodeBlock":
+        """
+        The block process_code_examples already gathered for the <pre> (in
+        the run's code_blocks), if any, otherwise a new one
+        """
+        block = ctx.code_blocks.pop(id(pre), None)
+        if block is not None and block.pre is pre:
+            return block
+        return cls(pre)
+
+    def forget(self, spans: list):
+        """ drops spans that have been removed from the block """
+        self.spans = [span for span in self.spans
+                      if not any(span is removed for removed in spans)]
+
+    @staticmethod
+    def _is_token(span, token_class: str, string: str) -> bool:
+        """ whether the span is a highlighted token of the class and text """
+        return (token_class in (span.get('class') or []) and
+                span.string == string)
+
+    def starts_with_r_magic(self) -> bool:
+        """
+        Whether the block starts with rpy2's `%%R` (after the empty span the
+        highlighter starts blocks with)
+        """
+        return (len(self.spans) > 2 and
+                self._is_token(self.spans[1], "o", "%%") and
+                self._is_token(self.spans[2], "k", "R"))
+
+    def header_comments(self) -> Optional[list]:
+        """
+        The block's first two line comments, if they're both among its first
+        three spans (i.e., an example's id and title), else None
+        """
+        comments = [span for span in self.spans
+                    if "c1" in (span.get('class') or [])][:2]
+        if (
+                len(comments) == 2 and
+                all(any(comment is span for span in self.spans[:3])
+                    for comment in comments)
+           ):
+            return comments
+        return None
+
+    def strip_spans(self, ctx: Optional[ConversionContext] = None) -> dict:
+        """
+        Removes the spans' highlighting classes, and any empty spans, in one
+        walk over them, returning the first `%%` and `R` spans found (i.e.,
+        rpy2's flags) by their text
+        """
+        ctx = ctx or ConversionContext()
+        r_flags: dict = {}
+        for span in self.spans:
+            del span['class']
+            # clean up empty strings
+            if not span.string:
+                # Log message in advance of any unanticipated edge case
+                ctx.log.info(f"Removing empty span {span} in process_code")
+                span.decompose()
+            elif span.string in ["%%", "R"]:
+                r_flags.setdefault(str(span.string), span)
+        return r_flags
+
+    def spans_to_code(self):
+        """ turns the spans into <code>s, keeping their highlighting """
+        for span in self.spans:
+            span.name = "code"
+
+
+def process_code(chapter,
+                 skip_numbering: Union[bool, None] = False,
+                 ctx: Optional[ConversionContext] = None):
     """
     Turn rendered <pre> blocks into appropriately marked-up HTMLBook
     """
+    ctx = ctx or ConversionContext()
 
     cell_number = 0
     highlight_divs = chapter.find_all(class_="highlight")
@@ -21,27 +105,17 @@ def process_code(chapter, skip_numbering: Union[bool, None] = False):
             pre_tag = div.pre
             pre_tag["data-type"] = "programlisting"
 
-            # remove existing span classes
-            for span in pre_tag.find_all('span'):
-                del span['class']
-                # clean up empty strings
-                if not span.string:
-                    # Log message in advance of any unanticipated edge case
-                    logging.info(f"Removing empty span {span} in process_code")
-                    span.decompose()
+            # remove existing span classes (and empty spans)
+            r_flags = CodeBlock.of(pre_tag, ctx).strip_spans(ctx)
 
             # add language info if available
-            if (  # handle R, use `find` for `%%` since we only want it if it's
-                  # the very first span tag
-                    pre_tag.find('span', string="%%") and
-                    pre_tag.find_all('span', string="R")
-               ):
+            if len(r_flags) == 2:  # handle R
                 pre_tag["data-code-language"] = "r"
                 # remove possibly confusing parent classes
                 del div.parent['class']
-                # remove extraneous rpy2 flags on first element (thus "find")
-                pre_tag.find('span', string="%%").decompose()
-                pre_tag.find('span', string="R").decompose()
+                # remove extraneous rpy2 flags on first element
+                r_flags["%%"].decompose()
+                r_flags["R"].decompose()
                 # remove left space/extra newline on first child element
                 if pre_tag.contents:
                     start_code = pre_tag.contents[0]
@@ -56,7 +130,7 @@ def process_code(chapter, skip_numbering: Union[bool, None] = False):
                 cell_number = number_codeblock(pre_tag, cell_number)
 
         except TypeError:
-            logging.warning(f"Unable to apply cell numbering to {div}")
+            ctx.log.warning(f"Unable to apply cell numbering to {div}")
 
     return chapter
 
@@ -68,8 +142,8 @@ def process_inline_code(chapter):
     target version of Jupyter Book doesn't put <code> inside <pre> tags, so our
     "dumb" inline searcher should work. There is a test to confirm this.
 
-    NOTE: This is a temporary fix; we should really clean out all classes
-    except those we explicitly want from the chapter files
+    NOTE: Classes are cleaned out along with the rest of the chapter's by
+    sanitize_chapter; this only unwraps the spans
     """
     inline_codes = chapter.find_all("code")
 
@@ -93,7 +167,6 @@ def number_codeblock(pre_block, cell_number):
     grandparent = pre_block.parent.parent.parent
 
     if "cell_input" in str(grandparent.get("class")):
-        in_block = True
         cell_number += 1
         marker = f"In [{cell_number}]: "
     elif (
@@ -101,7 +174,6 @@ def number_codeblock(pre_block, cell_number):
             # ensure we're not in a hidden-input cell
             "tag_hide-input" not in grandparent.parent.get("class")
          ):
-        in_block = False
         marker = f"Out[{cell_number}]: "
     else:
         return cell_number
@@ -112,58 +184,51 @@ def number_codeblock(pre_block, cell_number):
     # calculate additional indent
     indent = ' ' * len(marker)
 
-    # update tab alignment
-    for index, element in enumerate(pre_block.contents):
-        if type(element) == NavigableString:
-            if re.search(r'\n\s*', element):
-                indented_code = element.replace('\n', f'\n{indent}')
-                # remove unneeded blank space b/t two newlines for
-                # cleanliness (and to keep old tests passing)
-                indented_code = indented_code.replace(f'\n{indent}\n', '\n\n')
-                # the index-replace contortions are required by the
-                # vagaries of modifying NavigableString.
-                pre_block.contents[index].replace_with(indented_code)
-            elif not in_block:
-                # out blocks won't have spans put into them willy-nilly
-                # so a "brute force" approach to indentation works fine
-                element.replace_with(element.replace('\n', f'\n{indent}'))
+    def align(code):
+        """ update tab alignment """
+        if '\n' not in code:
+            return code
+        indented_code = code.replace('\n', f'\n{indent}')
+        # remove unneeded blank space b/t two newlines for
+        # cleanliness (and to keep old tests passing)
+        return indented_code.replace(f'\n{indent}\n', '\n\n')
+
+    replace_strings(pre_block, align)
 
     return cell_number
 
 
-def process_code_examples(chapter):
+def process_code_examples(chapter, ctx: Optional[ConversionContext] = None):
     """
     Applies appropriate data types and adds titles for formal code
     "Examples" in the text
     """
+    ctx = ctx or ConversionContext()
     examples = chapter.find_all("div", class_="tag_example")
+    # (only this chapter's blocks are kept for the passes that follow)
+    ctx.code_blocks = {}
 
     for example_cell in examples:
         pre_block = example_cell.find("pre")
-        comments = pre_block.find_all("span", class_="c1")
+        block = CodeBlock(pre_block)
+        ctx.code_blocks[id(pre_block)] = block
+        comments = block.header_comments()
 
-        if (  # it's an R block
-                (pre_block.find("span", class_="o", string="%%") ==
-                    pre_block.find_all("span")[1]) and
-                (pre_block.find("span", class_="k", string="R") ==
-                    pre_block.find_all("span")[2])
-           ):
+        if block.starts_with_r_magic():  # it's an R block
             example_name, example_title = example_get_name_and_title_r(
-                                                                 pre_block)
+                                                            block, ctx)
 
-        elif len(comments) < 2 or not (  # it's malformed
-                comments[0] in pre_block.find_all("span")[0:3] and
-                comments[1] in pre_block.find_all("span")[0:3]
-               ):
-            logging.warning(
+        elif comments is None:  # it's malformed
+            ctx.log.warning(
                 "Missing first two line comments for uuid and title." +
                 f"Unable to apply example formatting to {example_cell}.")
-            return chapter
+            continue
 
         # ensure comments are within the first three spans (since we
         # expect an empty span to start based on their highlighter)
         else:  # we're getting what we expect
             example_name, example_title = example_get_name_and_title(comments)
+            block.forget(comments)
             # remove empty space left by decomposed spans
             # assuming they add the empty span at the beginning of block
             for element in pre_block.contents[0:3]:
@@ -173,7 +238,7 @@ def process_code_examples(chapter):
                    ):
                     element.replace_with('')
 
-            logging.info("Applying example formatting to and removing" +
+            ctx.log.info("Applying example formatting to and removing" +
                          f" first comments from: {example_cell}")
 
         if example_name is not None and example_title is not None:
@@ -209,40 +274,45 @@ def example_get_name_and_title(comments):
     return example_name, example_title
 
 
-def example_get_name_and_title_r(pre_block):
+def example_get_name_and_title_r(block: CodeBlock,
+                                 ctx: Optional[ConversionContext] = None):
     """
-    Pulls and removes name and title information from R blocks.
+    Pulls and removes name and title information from R blocks (given as a
+    CodeBlock starting with rpy2's `%%R`).
     """
-    # first three elements will be spans letting us know it's an R block
-    r_code = pre_block.contents[3]
+    ctx = ctx or ConversionContext()
+    # the code follows the `R` span
+    r_code = block.spans[2].next_sibling
     expected_comments = r'# (.*?)\n# (.*?)\n## R'
-    id_and_title = re.search(expected_comments, r_code)
     try:
-        example_name = id_and_title.group(1)
-        example_title = id_and_title.group(2)
+        if type(r_code) is not NavigableString:
+            raise AttributeError("no code after %%R")
+        id_and_title = re.search(expected_comments, r_code)
+        example_name = id_and_title.group(1)  # type: ignore
+        example_title = id_and_title.group(2)  # type: ignore
         new_r_code = re.sub(expected_comments, "## R", r_code)
-        pre_block.contents[3].replace_with(new_r_code)
+        r_code.replace_with(new_r_code)
         return example_name, example_title
     except (IndexError, AttributeError) as error:
-        logging.warning(
+        ctx.log.warning(
             "Missing first two line comments for uuid and title." +
             f"Unable to apply example formatting: {error}.")
         return None, None
 
 
-def pre_spans_to_code_tags(chapter):
+def pre_spans_to_code_tags(chapter,
+                           ctx: Optional[ConversionContext] = None):
     """
     If we are preserving highlighting provided by Jupyter Book but want those
     styles to show up correctly in Atlas, we need to turn the <span> tags
     inside the Jupyter <pre> tags into <code> tags
     """
+    ctx = ctx or ConversionContext()
     highlight_divs = chapter.find_all(class_="highlight")
 
     for div in highlight_divs:
         pre_tag = div.pre
         if pre_tag:
-            spans = pre_tag.find_all("span")
-            for span in spans:
-                span.name = "code"
+            CodeBlock.of(pre_tag, ctx).spans_to_code()
 
     return chapter
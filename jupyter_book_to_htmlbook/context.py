@@ -0,0 +1,95 @@
+import logging
+from collections import Counter
+from dataclasses import dataclass, field
+from random import Random
+from .events import make_event
+from typing import Callable, Optional, Union, TYPE_CHECKING
+if TYPE_CHECKING:
+    from .cache import ConversionCache
+
+
+@dataclass
+class ConversionOptions:
+    """ options for a single book conversion (mirroring the CLI flags) """
+    atlas_json: Optional[str] = None
+    skip_jb_build: bool = False
+    auto_jb_build: bool = False
+    split_jb_build: Optional[int] = None
+    jb_fail_fast: bool = False
+    jb_timeout: Optional[int] = None  # in seconds
+    jb_in_process: bool = False
+    build_cache: Optional[str] = None
+    build_cache_size: Optional[int] = None  # in MB
+    pre_execute: bool = False
+    execute_jobs: Optional[int] = None
+    notebook_timeout: Optional[int] = None  # in seconds
+    skip_cell_numbering: bool = False
+    include_root: bool = False
+    keep_highlighting: bool = False
+    keep_going: bool = False
+    retry_failed: bool = False
+    only: list = field(default_factory=list)
+    disable_passes: list = field(default_factory=list)
+    jobs: int = 1
+    worker_max_chapters: Optional[int] = None
+    worker_max_rss: Optional[int] = None  # in MB
+    chapter_memory_budget: Optional[int] = None  # in MB
+
+
+class _RunLogger(logging.LoggerAdapter):
+    """
+    passes messages on to the run's logger, keeping any warnings (and
+    reporting them as events)
+    """
+
+    def __init__(self,
+                 logger: Union[logging.Logger, logging.LoggerAdapter],
+                 warnings: list,
+                 emit: Optional[Callable] = None):
+        super().__init__(logger, {})
+        self.warnings = warnings
+        self.emit = emit
+
+    def log(self, level, msg, *args, **kwargs):
+        if level >= logging.WARNING:
+            message = msg % args if args else msg
+            self.warnings.append(message)
+            if self.emit:
+                self.emit("warning", level=logging.getLevelName(level),
+                          message=str(message))
+        super().log(level, msg, *args, **kwargs)
+
+
+@dataclass
+class ConversionContext:
+    """
+    Everything belonging to a single conversion run: its options, the IDs
+    used so far in the book, where its messages go (and the warnings among
+    them), its own random number generator, any caches, run metrics, and
+    where to send progress events (if anywhere).
+
+    It's passed through the processing functions in place of process-wide
+    state, so several conversions can run at once in the same interpreter.
+    Functions given no context use a fresh default one, logging to the root
+    logger.
+    """
+    options: ConversionOptions = field(default_factory=ConversionOptions)
+    logger: Union[logging.Logger, logging.LoggerAdapter] = field(
+            default_factory=logging.getLogger)
+    book_ids: list = field(default_factory=list)
+    random: Random = field(default_factory=Random)
+    cache: Optional["ConversionCache"] = None
+    metrics: Counter = field(default_factory=Counter)
+    warnings: list = field(default_factory=list)
+    events: Optional[Callable[[dict], None]] = None
+    # the current chapter's example code blocks (by id of their <pre>), as
+    # read by process_code_examples, for the code passes that follow it
+    code_blocks: dict = field(default_factory=dict)
+
+    def __post_init__(self):
+        self.log = _RunLogger(self.logger, self.warnings, self.emit)
+
+    def emit(self, name: str, **fields):
+        """ sends a progress event to the run's event stream, if any """
+        if self.events:
+            self.events(make_event(name, **fields))
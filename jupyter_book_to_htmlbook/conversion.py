@@ -0,0 +1,644 @@
+import json
+import logging
+import shutil
+import subprocess
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field, replace
+from importlib import metadata
+from pathlib import Path
+from typing import Callable, Generator, Optional, Union
+from yaml import dump, load  # type: ignore
+from .toc_processing import (
+        SafeDumper,
+        SafeLoader,
+        TocError,
+        get_book_toc,
+        select_toc_elements
+    )
+from .file_processing import (
+        MERGED_PASSES,
+        chapter_output_ids,
+        chapter_output_path,
+        chapter_passes,
+        part_output_file,
+        process_chapter,
+        process_part
+    )
+from .atlas import update_atlas
+from .build import (
+        BUILD_CACHE_BYTES,
+        BuildCache,
+        JupyterBookRun,
+        build_cache_key,
+        build_fingerprint,
+        jupyter_book_command,
+        needs_build,
+        save_build_fingerprint,
+        split_build_config,
+        split_toc,
+        wait_for_builds
+    )
+from .build_worker import WarmJupyterBookRun
+from .cache import ConversionCache, _toc_element_files
+from .context import ConversionContext, ConversionOptions
+from .events import output_digest
+from .execution import execution_config, pre_execute_notebooks
+from .preflight import check_toc, make_output_dirs, missing_pages
+from .reference_processing import process_ids
+from .workers import (
+        MB,
+        chapter_pool,
+        parse_built_chapter,
+        peak_rss,
+        reset_peak_rss,
+        write_chapter
+    )
+
+
+__version__ = metadata.version(__package__)
+
+# written to the target directory by --keep-going and --retry-failed runs
+FAILURES_FILE = 'jb2htmlbook-failures.json'
+
+
+@dataclass
+class ConversionResult:
+    """
+    What a conversion produced: the processed files (as listed in
+    atlas.json), the IDs in each of those files, any warnings logged along
+    the way, timings (in seconds) per phase and per file, peak memory use
+    (in bytes) per converted chapter, run metrics, the chapters that failed
+    (when keeping going past failures), how each notebook fared (when
+    pre-executing them), and the options it ended up using (i.e., with any
+    passes the book's _config.yml turns off).
+    """
+    files: list = field(default_factory=list)
+    ids: dict = field(default_factory=dict)
+    warnings: list = field(default_factory=list)
+    timings: dict = field(default_factory=dict)
+    chapter_timings: dict = field(default_factory=dict)
+    chapter_memory: dict = field(default_factory=dict)
+    metrics: dict = field(default_factory=dict)
+    failures: list = field(default_factory=list)
+    notebooks: list = field(default_factory=list)
+    options: Optional[ConversionOptions] = None
+
+
+def book_disabled_passes(source: Union[str, Path]) -> list:
+    """
+    The chapter passes the book's _config.yml turns off, as a list (or a
+    comma-separated string) under `jb2htmlbook: disable_passes:`
+    """
+    try:
+        with open(Path(source) / '_config.yml') as f:
+            config = load(f.read(), SafeLoader) or {}
+    except FileNotFoundError:
+        return []
+    names = (config.get("jb2htmlbook") or {}).get("disable_passes") or []
+    if isinstance(names, str):
+        names = names.split(',')
+    return [str(name).strip() for name in names if str(name).strip()]
+
+
+def run_jupyter_book(source: Union[str, Path],
+                     ctx: Optional[ConversionContext] = None):
+    """
+    Runs `jupyter-book build` on the source directory, forwarding its output
+    to the run's log as it goes, and returns the completed process; raises
+    a RuntimeError if the build is stopped early (with the `jb_fail_fast`
+    and `jb_timeout` options)
+    """
+    ctx = ctx or ConversionContext()
+    # NOTE: that we run it as a subprocess by default because it doesn't
+    # seem like they've designed it to be importable (so the in-process
+    # option still runs it on a separate, if long-lived, worker process).
+    # Bonus is that it keeps the command similar to what an author will be
+    # using locally.
+    # Its output (including warnings, which would otherwise error out inside
+    # Atlas) only goes to our log.
+    command = jupyter_book_command(source)
+    run = _start_build(command, ctx)
+    returncode, = wait_for_builds([run], ctx.options.jb_timeout, ctx)
+    ctx.log.info(f"jupyter-book exited with code {returncode}")
+    return subprocess.CompletedProcess(command, returncode)
+
+
+def _start_build(command: list,
+                 ctx: ConversionContext,
+                 name: str = "jupyter-book") -> JupyterBookRun:
+    """
+    starts a jupyter-book run, in a new interpreter or (with the
+    `jb_in_process` option) on a warm build worker
+    """
+    if ctx.options.jb_in_process:
+        return WarmJupyterBookRun(command, ctx, name)
+    return JupyterBookRun(command, ctx, name)
+
+
+def _start_jupyter_book(source: Path,
+                        build_dir: Path,
+                        ctx: ConversionContext) -> JupyterBookRun:
+    """ starts a split build using build_dir's _toc.yml and _config.yml """
+    return _start_build(
+            jupyter_book_command(source,
+                                 '--toc', str(build_dir / '_toc.yml'),
+                                 '--config', str(build_dir / '_config.yml'),
+                                 '--path-output', str(build_dir)),
+            ctx,
+            name=f"jupyter-book ({build_dir.name})")
+
+
+def run_split_jupyter_book(source: Union[str, Path],
+                           builds: int,
+                           ctx: Optional[ConversionContext] = None):
+    """
+    Runs `jupyter-book build` on the source directory as (up to) `builds`
+    concurrent builds of consecutive runs of its parts, and merges their
+    HTML into the book's _build/html, returning a completed process (which
+    failed if any of the builds did); if one is stopped early, they all are,
+    and unless they all succeed the book's previous _build/html is kept
+
+    References between the splits are left unresolved by Sphinx, and are
+    handled along with any other remaining cross references in conversion.
+    """
+    ctx = ctx or ConversionContext()
+    source = Path(source)
+    with open(source / '_toc.yml') as f:
+        toc = load(f.read(), SafeLoader)
+    tocs = split_toc(toc, builds)
+    if len(tocs) < 2:
+        ctx.log.info("Only one part to build; not splitting the build")
+        return run_jupyter_book(source, ctx)
+
+    execution = execution_config(source)
+    book_cache = Path(execution["cache"])
+    html_dir = source / '_build/html'
+    html_dir.parent.mkdir(exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix='jb2htmlbook-split-',
+                                     dir=html_dir.parent) as tmp:
+        build_dirs = []
+        for number, split in enumerate(tocs, 1):
+            build_dir = Path(tmp) / f'split-{number}'
+            build_dir.mkdir()
+            # each build writes to its own copy of the book's jupyter-cache
+            # (which isn't safe to write to from several builds at once)
+            cache = build_dir / '.jupyter_cache'
+            if execution["execute_notebooks"] == "cache" and \
+                    book_cache.is_dir():
+                shutil.copytree(book_cache, cache)
+            with open(build_dir / '_toc.yml', 'wt') as f:
+                dump(split, f, SafeDumper, sort_keys=False)
+            with open(build_dir / '_config.yml', 'wt') as f:
+                dump(split_build_config(source, str(cache)), f, SafeDumper,
+                     sort_keys=False)
+            build_dirs.append(build_dir)
+        ctx.log.info(f"Running {len(build_dirs)} jupyter-book builds")
+        runs = [_start_jupyter_book(source, build_dir, ctx)
+                for build_dir in build_dirs]
+        returncodes = wait_for_builds(runs, ctx.options.jb_timeout, ctx)
+
+        failed = [number for number, returncode in
+                  enumerate(returncodes, 1) if returncode != 0]
+        for number in failed:
+            ctx.log.warning(f"jupyter-book build {number} of " +
+                            f"{len(build_dirs)} failed (exit code " +
+                            f"{returncodes[number - 1]})")
+        if failed:
+            ctx.log.warning("Keeping the book's previous build")
+        else:
+            merged_dir = Path(tmp) / 'html'
+            merged_dir.mkdir()
+            for build_dir in build_dirs:
+                # files every build writes (the root, static files) are
+                # taken from the first
+                for path in (build_dir / '_build/html').rglob('*'):
+                    merged = merged_dir / path.relative_to(
+                            build_dir / '_build/html')
+                    if path.is_dir():
+                        merged.mkdir(exist_ok=True)
+                    elif not merged.exists():
+                        shutil.copy2(path, merged)
+            if html_dir.exists():
+                shutil.rmtree(html_dir)
+            merged_dir.rename(html_dir)
+
+    returncode = next((code for code in returncodes if code != 0), 0)
+    return subprocess.CompletedProcess(jupyter_book_command(source),
+                                       returncode)
+
+
+def convert_book(source: Union[str, Path],
+                 target: Union[str, Path],
+                 options: Optional[ConversionOptions] = None,
+                 logger: Union[logging.Logger, logging.LoggerAdapter,
+                               None] = None,
+                 cache: Optional[ConversionCache] = None,
+                 events: Optional[Callable[[dict], None]] = None
+                 ) -> ConversionResult:
+    """
+    Converts the Jupyter Book project in `source` into HTMLBook files in
+    `target` (relative to the current working directory), returning a
+    ConversionResult.
+
+    Doesn't configure logging, print, or exit, and keeps all of its state in
+    its own ConversionContext, so it can be called many times (or from
+    several threads at once) in the same process; problems with the book's
+    table of contents (checked before any expensive work, along with its
+    source files and, once built, pages) raise a TocError, and malformed
+    chapters a RuntimeError (unless the `keep_going` option is set, in which
+    case failed chapters are listed in the result and in the target's
+    jb2htmlbook-failures.json file instead). Run information is sent to
+    `logger` (the root logger by default).
+
+    With the `only` option, just the selected chapters and parts are
+    converted; the rest of the book's existing output is kept as it is (its
+    IDs still count when checking for duplicates).
+
+    Long-running processes can pass a ConversionCache to reuse parsed tables
+    of contents and skip chapters that haven't changed since the last call.
+
+    Progress events (see the README for the list) are passed, as dicts, to
+    the `events` callable as they happen, e.g., a JsonLinesEvents stream.
+    """
+    ctx = ConversionContext(options=options or ConversionOptions(),
+                            logger=logger or logging.getLogger(),
+                            cache=cache,
+                            events=events)
+    result = ConversionResult(warnings=ctx.warnings)
+    start = time.perf_counter()
+    ctx.emit("run_started", version=__version__, source=str(source),
+             target=str(target), options=asdict(ctx.options))
+
+    error = None
+    try:
+        _convert(Path(source), str(target), ctx, result)
+    except Exception as raised:
+        error = f"{type(raised).__name__}: {raised}"
+        raise
+    finally:
+        result.timings["total"] = time.perf_counter() - start
+        result.metrics = dict(ctx.metrics)
+        if error:
+            status = "failed"
+        else:
+            status = "partial" if result.failures else "ok"
+        ctx.emit("run_finished", status=status, error=error,
+                 files=result.files, failures=len(result.failures),
+                 seconds=round(result.timings["total"], 3))
+
+    return result
+
+
+def _convert(source: Path,
+             target: str,
+             ctx: ConversionContext,
+             result: ConversionResult):
+    """ the conversion itself, filling in the result as it goes """
+    options = ctx.options
+    cache = ctx.cache
+    # use paths
+    source_dir = source / '_build/html'
+    output_dir = Path.cwd() / target
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    ctx.log.info(f'App version: {__version__}')
+    ctx.log.info(f'Source: {source}, Target: {target}')
+
+    # passes the book's own _config.yml turns off are added to any disabled
+    # for this run
+    book_disabled = [name for name in book_disabled_passes(source)
+                     if name not in options.disable_passes]
+    if book_disabled:
+        ctx.log.info("Passes disabled by the book's _config.yml: " +
+                     ", ".join(book_disabled))
+        options = ctx.options = replace(
+                options,
+                disable_passes=list(options.disable_passes) + book_disabled)
+    for name in options.disable_passes:
+        if name in MERGED_PASSES:
+            ctx.log.warning(f"{name} is now part of {MERGED_PASSES[name]} " +
+                            "and can't be disabled on its own")
+    # i.e., so unknown (or misdeclared) passes are caught up front
+    chapter_passes(tuple(options.disable_passes))
+    result.options = options
+
+    # get table of contents
+    if cache:
+        toc = cache.book_toc(source, ctx)
+    else:
+        toc = get_book_toc(source, ctx)
+    if not options.include_root:
+        toc = toc[1:]  # i.e., don't include the root
+
+    # convert all of the book's files (or just the selected ones, if asked)
+    selected = None
+    previous_failures = read_failures(output_dir)
+    if options.only:
+        selected = select_toc_elements(toc, options.only, source, ctx)
+    if options.retry_failed:
+        if not (output_dir / FAILURES_FILE).exists():
+            ctx.log.warning(f"No {FAILURES_FILE} in {output_dir}; only " +
+                            "chapters without output will be converted")
+        failed = {failure["file"] for failure in previous_failures}
+        selected = [element for element in
+                    (toc if selected is None else selected)
+                    if '/_jb_part' not in str(element) and
+                    str(chapter_output_path(element, source_dir, output_dir)
+                        .relative_to(output_dir)) in failed]
+    # unselected files are kept as they are, as long as they're there
+    kept = []
+    if selected is not None:
+        kept = [element for element in toc if element not in selected and
+                _output_file(element, source_dir, output_dir).exists()]
+
+    # catch problems with the table of contents before any expensive work
+    check_toc(source, toc, output_dir,
+              check_sources=not options.skip_jb_build, ctx=ctx)
+
+    # run `jupyter-book` (or log that we didn't)
+    phase_start = time.perf_counter()
+    fingerprint = None
+    build_cache = None
+    if not options.skip_jb_build:
+        # (the output may be in the source directory, but isn't an input)
+        fingerprint = build_fingerprint(
+                source, (output_dir,) + ((options.atlas_json,)
+                                         if options.atlas_json else ()))
+    if options.build_cache and fingerprint is not None:
+        build_cache = BuildCache(options.build_cache,
+                                 (options.build_cache_size or 0) * MB or
+                                 BUILD_CACHE_BYTES)
+        cache_key = build_cache_key(fingerprint)
+    if options.skip_jb_build:
+        ctx.log.info("Skipping jupyter-book run...")
+        ctx.emit("jb_build_skipped")
+    elif options.auto_jb_build and not needs_build(source, fingerprint, ctx):
+        ctx.emit("jb_build_skipped", reason="up to date")
+    elif build_cache and build_cache.restore(cache_key, source):
+        ctx.log.info("Restored the jupyter-book build from " +
+                     str(build_cache.directory))
+        save_build_fingerprint(source, fingerprint)  # type: ignore
+        ctx.emit("jb_build_skipped", reason="restored from build cache")
+    else:
+        if options.pre_execute:
+            notebooks_start = time.perf_counter()
+            result.notebooks = pre_execute_notebooks(
+                    source, options.execute_jobs, options.notebook_timeout,
+                    ctx)
+            result.timings["notebooks"] = \
+                time.perf_counter() - notebooks_start
+        ctx.emit("jb_build_started")
+        if options.split_jb_build and options.split_jb_build > 1:
+            jb_info = run_split_jupyter_book(source, options.split_jb_build,
+                                             ctx)
+        else:
+            jb_info = run_jupyter_book(source, ctx)
+        if jb_info.returncode == 0:
+            # so the next automatic check knows what this build was of
+            save_build_fingerprint(source, fingerprint)  # type: ignore
+            if build_cache:
+                build_cache.store(cache_key, source)
+        ctx.emit("jb_build_finished", returncode=jb_info.returncode,
+                 seconds=round(time.perf_counter() - phase_start, 3))
+    if build_cache:
+        build_cache.save_stats()
+        ctx.log.info(f"Build cache: {dict(build_cache.stats)}")
+        ctx.metrics.update({f"build_cache_{stat}": count
+                            for stat, count in build_cache.stats.items()})
+    result.timings["jupyter_book"] = time.perf_counter() - phase_start
+
+    missing = missing_pages([element for element in toc
+                             if element not in kept])
+    if missing:
+        message = ("Missing jupyter-book output: " +
+                   ", ".join(str(page) for page in missing))
+        if not (options.keep_going or options.retry_failed):
+            ctx.log.error(message)
+            raise TocError(message)
+        ctx.log.warning(message)
+    # i.e., only for what's being converted, now that it's been built
+    make_output_dirs(source, [element for element in toc
+                              if element not in kept and
+                              element not in missing], output_dir)
+
+    # setup images directory
+    phase_start = time.perf_counter()
+    if Path(f'{source_dir}/_images').exists():
+        image_dir = output_dir / '_images'
+        image_dir.mkdir(parents=True, exist_ok=True)
+        shutil.copytree(f'{source_dir}/_images/', image_dir,
+                        dirs_exist_ok=True)
+        ctx.emit("images_copied", directory=f'{target}/_images',
+                 count=sum(1 for path in image_dir.rglob('*')
+                           if path.is_file()))
+    else:
+        ctx.log.info("No images in the source book")
+    result.timings["images"] = time.perf_counter() - phase_start
+
+    # with more than one job, chapters are built ahead on worker processes
+    built = None
+    pool = chapter_pool(ctx)
+    if pool:
+        built = pool.run([element for element in toc
+                          if '/_jb_part' not in str(element) and
+                          element not in kept])
+    try:
+        _convert_elements(toc, source_dir, output_dir, target, kept, built,
+                          previous_failures, ctx, result)
+    finally:
+        if built:
+            built.close()  # i.e., stop any workers left running
+
+    if options.atlas_json:
+        update_atlas(Path(options.atlas_json), result.files, ctx=ctx)
+
+
+def _convert_elements(toc: list,
+                      source_dir: Path,
+                      output_dir: Path,
+                      target: str,
+                      kept: list,
+                      built: Optional[Generator],
+                      previous_failures: list,
+                      ctx: ConversionContext,
+                      result: ConversionResult):
+    """ writes the book's parts and chapters, in order """
+    options = ctx.options
+    attempted = set()
+    phase_start = time.perf_counter()
+    for element in toc:
+        file_start = time.perf_counter()
+        if '/_jb_part' in str(element):  # process part paths
+            if element in kept:
+                file = part_output_file(element)
+            else:
+                file = process_part(element, output_dir, ctx)
+                _emit_finished(ctx, "part_finished", target, output_dir,
+                               file, file_start)
+            chapter_ids = []
+        else:  # process chapter paths
+            output_file = chapter_output_path(element, source_dir, output_dir)
+            file = str(output_file.relative_to(output_dir))
+            if element in kept:
+                # keep what's there, but its IDs still count for the book
+                chapter_ids = chapter_output_ids(output_file)
+                ctx.log.info(f"Keeping existing output for {file}")
+            else:
+                attempted.add(file)
+                ctx.emit("chapter_started", file=f'{target}/{file}',
+                         source=[str(path) for path in
+                                 _toc_element_files(element)])
+                built_chapter = next(built) if built else None
+                try:
+                    file, chapter_ids = _convert_chapter(element, source_dir,
+                                                         output_dir, ctx,
+                                                         built_chapter)
+                except Exception as error:
+                    ctx.emit("chapter_failed", file=f'{target}/{file}',
+                             error=type(error).__name__, message=str(error))
+                    if not (options.keep_going or options.retry_failed):
+                        raise
+                    ctx.log.error(f"Failed to convert {file}: {error}")
+                    result.failures.append({
+                        "file": file,
+                        "source": [str(path) for path in
+                                   _toc_element_files(element)],
+                        "error": type(error).__name__,
+                        "message": str(error),
+                    })
+                    continue
+                if built_chapter:
+                    memory = built_chapter["peak_rss"]
+                    flags = built_chapter["flags"]
+                else:
+                    memory, flags = peak_rss(), []
+                result.chapter_memory[f'{target}/{file}'] = memory
+                _emit_finished(ctx, "chapter_finished", target, output_dir,
+                               file, file_start, ids=len(chapter_ids),
+                               peak_rss=memory, flags=flags)
+            ctx.book_ids.extend(chapter_ids)
+        processed = f'{target}/{file}'
+        result.files.append(processed)
+        result.ids[processed] = chapter_ids
+        result.chapter_timings[processed] = time.perf_counter() - file_start
+    result.timings["chapters"] = time.perf_counter() - phase_start
+
+    if options.keep_going or options.retry_failed:
+        # failures in chapters we didn't get to this time still stand
+        write_failures(output_dir,
+                       [failure for failure in previous_failures
+                        if failure["file"] not in attempted] +
+                       result.failures)
+
+
+def _output_file(element: Union[Path, list],
+                 source_dir: Path,
+                 output_dir: Path) -> Path:
+    """ where a part or chapter is written """
+    if '/_jb_part' in str(element):
+        return output_dir / str(part_output_file(element))  # type: ignore
+    return chapter_output_path(element, source_dir, output_dir)
+
+
+def _emit_finished(ctx: ConversionContext,
+                   name: str,
+                   target: str,
+                   output_dir: Path,
+                   file: str,
+                   file_start: float,
+                   **fields):
+    """ reports a written file, with its hash and how long it took """
+    if ctx.events:
+        ctx.emit(name, file=f'{target}/{file}',
+                 sha256=output_digest(output_dir / file),
+                 seconds=round(time.perf_counter() - file_start, 3),
+                 **fields)
+
+
+def _convert_chapter(element: Union[Path, list],
+                     source_dir: Path,
+                     output_dir: Path,
+                     ctx: ConversionContext,
+                     built: Optional[dict] = None) -> tuple:
+    """
+    Converts a single chapter (or reuses the cached output of an unchanged
+    one), returning its relative output path and its IDs; chapters already
+    built by a chapter worker only need their IDs checked and writing out
+    """
+    options = ctx.options
+    cache = ctx.cache
+    if cache:
+        fingerprint = cache.chapter_fingerprint(
+                element, ctx.book_ids, options.skip_cell_numbering,
+                options.keep_highlighting, sorted(options.disable_passes))
+        cached = cache.cached_chapter(output_dir, element, fingerprint)
+        if cached:
+            ctx.log.info(f"Reusing unchanged output for {cached[0]}")
+            return cached
+
+    if built:
+        file, chapter_ids = _write_built_chapter(element, source_dir,
+                                                 output_dir, ctx, built)
+    else:
+        reset_peak_rss()
+        file, chapter_ids = process_chapter(element, source_dir, output_dir,
+                                            ctx=ctx)
+    if cache:
+        cache.store_chapter(output_dir, element, fingerprint, file,
+                            chapter_ids)
+    return file, chapter_ids
+
+
+def _write_built_chapter(element: Union[Path, list],
+                         source_dir: Path,
+                         output_dir: Path,
+                         ctx: ConversionContext,
+                         built: dict) -> tuple:
+    """
+    Finishes off a chapter built by a chapter worker: it's written as is,
+    unless it has IDs already used earlier in the book, in which case
+    process_ids renames them (in the worker's HTML, parsed back here) just
+    as it would in a serial run
+    """
+    # pass on what the worker had to say
+    for level, message in built["records"]:
+        ctx.log.log(level, message)
+    ctx.metrics.update(built["metrics"])
+    if "error" in built:
+        raise built["error"]
+
+    html, chapter_ids = built["html"], built["ids"]
+    if not set(chapter_ids).isdisjoint(ctx.book_ids):
+        chapter, chapter_ids = process_ids(parse_built_chapter(html),
+                                           ctx.book_ids, ctx)
+        html = str(chapter)
+    file = write_chapter(html, element, source_dir, output_dir)
+    ctx.metrics["chapters"] += 1
+    return file, chapter_ids
+
+
+def read_failures(output_dir: Path) -> list:
+    """
+    The chapters that failed in earlier runs that kept going past failures
+    (as recorded in the target's failures file)
+    """
+    try:
+        with open(output_dir / FAILURES_FILE) as f:
+            return json.load(f)["failures"]
+    except FileNotFoundError:
+        return []
+
+
+def write_failures(output_dir: Path, failures: list):
+    """
+    Records failed chapters in the target's failures file for a later
+    --retry-failed run, removing the file once there's nothing left to retry
+    """
+    failures_file = output_dir / FAILURES_FILE
+    if failures:
+        with open(failures_file, 'wt') as f:
+            json.dump({"version": __version__, "failures": failures}, f,
+                      indent=2)
+    else:
+        failures_file.unlink(missing_ok=True)
@@ -0,0 +1,42 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import IO, Optional
+
+
+class JsonLinesEvents:
+    """
+    Writes conversion events as JSON lines (one object per event, with its
+    "event" name and a "time" stamp) to a stream, flushing after each one
+    so that consumers can act on them while the conversion is still running.
+    """
+
+    def __init__(self, stream: IO[str]):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def __call__(self, event: dict):
+        line = json.dumps(event, default=str)
+        with self.lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+
+def open_events(fd: Optional[int] = None) -> JsonLinesEvents:
+    """ a JSON lines event stream on a file descriptor (stdout by default) """
+    if fd is None or fd == sys.stdout.fileno():
+        return JsonLinesEvents(sys.stdout)
+    return JsonLinesEvents(os.fdopen(fd, 'w', closefd=False))
+
+
+def make_event(name: str, **fields) -> dict:
+    return {"event": name, "time": round(time.time(), 3), **fields}
+
+
+def output_digest(path: Path) -> str:
+    """ sha256 of an output file, so consumers can tell if it changed """
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
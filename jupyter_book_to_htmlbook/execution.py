@@ -0,0 +1,226 @@
+import multiprocessing
+import os
+import time
+from collections import deque
+from fnmatch import fnmatch
+from multiprocessing.connection import Connection, wait
+from pathlib import Path
+from typing import Optional, Union
+from yaml import load  # type: ignore
+from .build import build_inputs
+from .context import ConversionContext
+from .toc_processing import SafeLoader
+
+
+def execution_config(source: Path) -> dict:
+    """
+    The book's notebook execution settings (the `execute` section of its
+    _config.yml), with jupyter-book's defaults filled in
+    """
+    source = Path(source)
+    try:
+        with open(source / '_config.yml') as f:
+            config = load(f.read(), SafeLoader) or {}
+    except FileNotFoundError:
+        config = {}
+    execute = config.get('execute') or {}
+    cache = execute.get('cache') or '_build/.jupyter_cache'
+    return {
+        "execute_notebooks": execute.get('execute_notebooks', 'auto'),
+        "cache": str(source / cache),
+        "timeout": execute.get('timeout', 30),
+        "allow_errors": bool(execute.get('allow_errors', False)),
+        "exclude_patterns": execute.get('exclude_patterns') or [],
+    }
+
+
+def toc_notebooks(source: Path, config: Optional[dict] = None) -> list:
+    """
+    The notebooks in the book's table of contents that jupyter-book would
+    execute (i.e., that aren't excluded), relative to the source directory
+    """
+    source = Path(source)
+    config = config or execution_config(source)
+    return [relative for relative in build_inputs(source)
+            if relative.endswith('.ipynb') and
+            (source / relative).is_file() and
+            not any(fnmatch(relative, pattern)
+                    for pattern in config["exclude_patterns"])]
+
+
+def execute_notebook(path: Path,
+                     cell_timeout: Optional[int] = None,
+                     allow_errors: bool = False) -> str:
+    """
+    Runs the notebook (from its own directory, as jupyter-book does),
+    returning the executed notebook as JSON
+    """
+    import nbformat  # type: ignore
+    from nbclient import NotebookClient  # type: ignore
+    notebook = nbformat.read(path, as_version=4)
+    client = NotebookClient(
+            notebook,
+            # jupyter-book uses -1 for "no timeout"
+            timeout=None if cell_timeout == -1 else cell_timeout,
+            allow_errors=allow_errors,
+            resources={"metadata": {"path": str(Path(path).parent)}})
+    client.execute()
+    return nbformat.writes(notebook)
+
+
+def _execute(conn: Connection,
+             path: Path,
+             cell_timeout: Optional[int],
+             allow_errors: bool):
+    """ a notebook worker: executes one notebook and sends back the result """
+    try:
+        conn.send({"notebook": execute_notebook(path, cell_timeout,
+                                                allow_errors)})
+    except Exception as error:
+        conn.send({"error": f"{type(error).__name__}: {error}"})
+
+
+class NotebookCache:
+    """
+    The jupyter-cache that jupyter-book reads executed notebooks from when
+    a book's `execute_notebooks` setting is "cache"
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        try:
+            from jupyter_cache import get_cache  # type: ignore
+        except ImportError:
+            raise RuntimeError("Pre-executing notebooks requires " +
+                               "jupyter-cache (installed with jupyter-book)")
+        self.cache = get_cache(str(path))
+
+    def is_cached(self, path: Path) -> bool:
+        """
+        Whether the cache has outputs for the notebook's current code cells
+        (the same check jupyter-book makes)
+        """
+        import nbformat  # type: ignore
+        try:
+            self.cache.match_cache_notebook(nbformat.read(path, as_version=4))
+        except KeyError:
+            return False
+        return True
+
+    def store(self, path: Path, executed: str, seconds: float):
+        """ adds an executed notebook to the cache """
+        import nbformat  # type: ignore
+        from jupyter_cache.base import NbBundleIn  # type: ignore
+        self.cache.cache_notebook_bundle(
+                NbBundleIn(nbformat.reads(executed, as_version=4),
+                           uri=str(path),
+                           data={"execution_seconds": seconds}),
+                check_validity=False,
+                overwrite=True)
+
+
+def pre_execute_notebooks(source: Path,
+                          jobs: Optional[int] = None,
+                          timeout: Optional[float] = None,
+                          ctx: Optional[ConversionContext] = None) -> list:
+    """
+    Executes the book's notebooks ahead of `jupyter-book build`, on up to
+    `jobs` processes at once (the CPU count by default), and stores their
+    outputs in the book's jupyter-cache, so that jupyter-book only has to
+    render them. Notebooks whose code cells haven't changed since they were
+    cached aren't run again, and any still running after `timeout` seconds
+    are stopped (and left for jupyter-book to run).
+
+    Returns a report for each notebook, in table of contents order: its
+    "file", "status" (cached, executed, failed or timed_out), "seconds" and
+    any "error".
+    """
+    ctx = ctx or ConversionContext()
+    source = Path(source)
+    config = execution_config(source)
+    if config["execute_notebooks"] != "cache":
+        ctx.log.warning("Not pre-executing notebooks: jupyter-book only " +
+                        "reads executed notebooks from its cache when " +
+                        "_config.yml sets `execute_notebooks: cache`")
+        return []
+
+    cache = NotebookCache(config["cache"])
+    notebooks = toc_notebooks(source, config)
+    reports: dict = {}
+    pending: deque = deque()
+    for notebook in notebooks:
+        if cache.is_cached(source / notebook):
+            reports[notebook] = {"file": notebook, "status": "cached",
+                                 "seconds": 0, "error": None}
+            ctx.emit("notebook_finished", **reports[notebook])
+        else:
+            pending.append(notebook)
+    ctx.log.info(f"Pre-executing {len(pending)} of {len(notebooks)} " +
+                 "notebook(s)")
+
+    def finish(notebook: str, started: float, status: str,
+               error: Optional[str] = None):
+        seconds = round(time.perf_counter() - started, 3)
+        reports[notebook] = {"file": notebook, "status": status,
+                             "seconds": seconds, "error": error}
+        if error:
+            ctx.log.warning(f"Unable to pre-execute {notebook} " +
+                            f"({status.replace('_', ' ')}): {error}")
+        else:
+            ctx.log.info(f"Executed {notebook} in {seconds} seconds")
+        ctx.emit("notebook_finished", **reports[notebook])
+
+    jobs = max(jobs or os.cpu_count() or 1, 1)
+    running: dict = {}  # i.e., connection: (process, notebook, start)
+    try:
+        while pending or running:
+            while pending and len(running) < jobs:
+                notebook = pending.popleft()
+                conn, child_conn = multiprocessing.Pipe(duplex=False)
+                process = multiprocessing.Process(
+                        target=_execute,
+                        args=(child_conn, source / notebook,
+                              config["timeout"], config["allow_errors"]),
+                        daemon=True)
+                process.start()
+                child_conn.close()
+                running[conn] = (process, notebook, time.perf_counter())
+
+            wait_for = None
+            if timeout:
+                first_deadline = min(started + timeout for _, _, started
+                                     in running.values())
+                wait_for = max(first_deadline - time.perf_counter(), 0)
+            for ready in wait(list(running), wait_for):
+                process, notebook, started = running.pop(ready)
+                try:
+                    outcome: dict = ready.recv()  # type: ignore
+                except EOFError:
+                    outcome = {}
+                ready.close()  # type: ignore
+                process.join()
+                if not outcome:
+                    outcome["error"] = ("Notebook worker exited " +
+                                        "unexpectedly (exit code " +
+                                        f"{process.exitcode})")
+                if "error" in outcome:
+                    finish(notebook, started, "failed", outcome["error"])
+                    continue
+                seconds = time.perf_counter() - started
+                cache.store(source / notebook, outcome["notebook"], seconds)
+                finish(notebook, started, "executed")
+
+            for conn, (process, notebook, started) in list(running.items()):
+                if timeout and time.perf_counter() - started >= timeout:
+                    process.terminate()
+                    process.join()
+                    conn.close()
+                    del running[conn]
+                    finish(notebook, started, "timed_out",
+                           f"Still running after {timeout} seconds")
+    finally:
+        for process, _, _ in running.values():  # e.g., on KeyboardInterrupt
+            process.terminate()
+
+    for report in reports.values():
+        ctx.metrics[f"notebooks_{report['status']}"] += 1
+    return [reports[notebook] for notebook in notebooks]
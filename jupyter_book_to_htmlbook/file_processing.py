@@ -1,12 +1,16 @@
-import logging
 import re
+from functools import lru_cache
 from pathlib import Path
 from typing import Union, Optional, Tuple
 from bs4 import BeautifulSoup  # type: ignore
+from .context import ConversionContext, ConversionOptions
+from .passes import Pass, PassRegistry, chapter_features
+from .helpers import move_nodes
 from .admonition_processing import process_admonitions
 from .figure_processing import process_figures, process_informal_figs
 from .footnote_processing import process_footnotes
 from .math_processing import process_math
+from .sanitize_processing import sanitize_chapter
 from .reference_processing import (
         process_internal_refs,
         process_remaining_refs,
@@ -22,17 +26,32 @@ from .code_processing import (
     )
 from .text_processing import (
         clean_chapter,
-        move_span_ids_to_sections,
+        move_span_id_to_section,
         process_sidebars
     )
 
 
-def process_part(part_path: Path, output_dir: Path):
+# the heading levels sections are typed by
+HEADING_LEVELS = {'h1': 1, 'h2': 2, 'h3': 3, 'h4': 4, 'h5': 5}
+
+
+def part_output_file(part_path: Path) -> Optional[str]:
+    """ the file process_part writes for a part placeholder path """
+    info = re.search(r'_jb_part-([0-9]+)-', str(part_path))
+    if info:
+        return f'part-{info.group(1)}.html'
+    return None
+
+
+def process_part(part_path: Path,
+                 output_dir: Path,
+                 ctx: Optional[ConversionContext] = None):
     """
     create a file based on the placeholder path
     with the name designated in the placeholder path
     and the correct part numbering
     """
+    ctx = ctx or ConversionContext()
     info = re.search(r'_jb_part-([0-9]+)-(.+?).html', str(part_path))
     if info:
         part_number = info.group(1)
@@ -48,27 +67,42 @@ def process_part(part_path: Path, output_dir: Path):
 </div>""".lstrip())
         return f'part-{part_number}.html'
     else:
-        logging.error("Unable to parse part information from " +
+        ctx.log.error("Unable to parse part information from " +
                       str(part_path))
         return
 
 
 def process_subsections(chapter):
-    """ add appropriate secX markers to subsections """
-    # deal with subsections
+    """
+    Adds appropriate secX markers to subsections (i.e., for the highest
+    heading directly under them or under any section inside them), and moves
+    the ids of spans marking their headings up to them, in one walk over the
+    sections and their children
+    """
+    if chapter.name == 'section':
+        for child in list(chapter.contents):
+            move_span_id_to_section(child)
+
     subsections = chapter.find_all('section')  # type: ignore
+    levels = {}
     for sub in subsections:
-        if sub.select('section > h1'):
-            sub['data-type'] = 'sect1'
-        elif sub.select('section > h2'):
-            sub['data-type'] = 'sect2'
-            # parsing subsections within seems like the best strategy
-        elif sub.select('section > h3'):
-            sub['data-type'] = 'sect3'
-        elif sub.select('section > h4'):
-            sub['data-type'] = 'sect4'
-        elif sub.select('section > h5'):
-            sub['data-type'] = 'sect5'
+        level = None
+        for child in list(sub.contents):
+            if child.name in HEADING_LEVELS:
+                level = min(level or 5, HEADING_LEVELS[child.name])
+            else:
+                move_span_id_to_section(child)
+        levels[id(sub)] = level
+
+    # subsections are found after the sections they're in, so going backwards
+    # passes their levels up before those sections' levels are used
+    for sub in reversed(subsections):
+        level = levels[id(sub)]
+        parent = sub.find_parent('section')
+        if level and parent is not None and id(parent) in levels:
+            levels[id(parent)] = min(levels[id(parent)] or 5, level)
+        if level:
+            sub['data-type'] = f'sect{level}'
     return chapter
 
 
@@ -78,21 +112,8 @@ def promote_headings(chapter):
     in a single-file chapter, but we need to promote all the headings
     up on level for htmlbook to process them correctly
     """
-    h2s = chapter.find_all('h2')
-    for heading in h2s:
-        heading.name = 'h1'
-    h3s = chapter.find_all('h3')
-    for heading in h3s:
-        heading.name = 'h2'
-    h4s = chapter.find_all('h4')
-    for heading in h4s:
-        heading.name = 'h3'
-    h5s = chapter.find_all('h5')
-    for heading in h5s:
-        heading.name = 'h4'
-    h6s = chapter.find_all('h6')
-    for heading in h6s:
-        heading.name = 'h5'
+    for heading in chapter.find_all(['h2', 'h3', 'h4', 'h5', 'h6']):
+        heading.name = f'h{int(heading.name[1]) - 1}'
 
     return chapter
 
@@ -135,11 +156,12 @@ def apply_datatype(chapter, ch_name):
     return chapter
 
 
-def get_top_level_sections(soup):
+def get_top_level_sections(soup, ctx: Optional[ConversionContext] = None):
     """
     Helper utility to grab top-level sections in main <article>. Returns
     all but bibliography sections
     """
+    ctx = ctx or ConversionContext()
     section_wrappers = soup.find_all("article", attrs={"role": "main"})
     top_level_sections = []
 
@@ -156,8 +178,8 @@ def get_top_level_sections(soup):
             main_title = article.find('h1').get_text()
         except AttributeError:
             main_title = soup.find("h1")
-        print("Warning: " +
-              f"The chapter with title '{main_title}' is malformed.")
+        ctx.log.warning(
+            f"The chapter with title '{main_title}' is malformed.")
         return None, None
     else:
         main = section_wrappers[0]
@@ -172,13 +194,14 @@ def get_top_level_sections(soup):
     return top_level_sections
 
 
-def get_main_section(soup):
+def get_main_section(soup, ctx: Optional[ConversionContext] = None):
     """
     Gets the main "section," or the main chapter text, and additionally
     checks to see if there is a separate bibliography section, returning
     that if it exists to be dealt with later.
     """
-    sections = get_top_level_sections(soup)
+    ctx = ctx or ConversionContext()
+    sections = get_top_level_sections(soup, ctx)
 
     try:
         main = sections[0]
@@ -195,15 +218,18 @@ def get_main_section(soup):
                   "has extra sections " + \
                   "that will not be processed. Please check the " + \
                   "notebook source files."
-        logging.warning(err_msg)
+        ctx.log.warning(err_msg)
     bibliography = soup.find('section', id="bibliography")
 
     return main, bibliography
 
 
 def process_chapter_soup(
-        toc_element: Union[Path, list[Path]]) -> Tuple[BeautifulSoup, str]:
+        toc_element: Union[Path, list[Path]],
+        ctx: Optional[ConversionContext] = None
+        ) -> Tuple[BeautifulSoup, str]:
     """ unified file chapter processing """
+    ctx = ctx or ConversionContext()
 
     if isinstance(toc_element, list):  # i.e., an ordered list of chapter parts
         chapter_file = toc_element[0]
@@ -218,13 +244,13 @@ def process_chapter_soup(
         base_soup = BeautifulSoup(f, 'lxml')
 
     # perform initial swapping and namespace designation
-    chapter, bib = get_main_section(base_soup)
+    chapter, bib = get_main_section(base_soup, ctx)
     if bib and not chapter or bib == chapter:  # bibs can be their own chapters
         chapter = bib
         bib = None
 
     if not chapter:  # guard against malformed files
-        logging.warning(f"Failed to process {toc_element}.")
+        ctx.log.warning(f"Failed to process {toc_element}.")
         raise RuntimeError(
             f"Failed to process {toc_element}. Please check for errors in " +
             "your source file(s). Contact the Tools team for additional " +
@@ -239,13 +265,13 @@ def process_chapter_soup(
 
         if chapter_parts:
             for subfile in chapter_parts:
-                subsections, sub_bib = process_chapter_subparts(subfile)
+                subsections, sub_bib = process_chapter_subparts(subfile,
+                                                                ctx)
                 if subsections:
-                    for subsection in subsections:
-                        chapter.append(subsection)  # type: ignore
+                    move_nodes(subsections, chapter)
                 if bib and sub_bib:
                     entries = sub_bib.find_all("dd")  # type: ignore
-                    bib.dl.extend(entries)  # type: ignore
+                    move_nodes(entries, bib.dl)  # type: ignore
                     # throw away the sub-bib section
                     _ = sub_bib.extract()
                 elif sub_bib:
@@ -261,89 +287,193 @@ def process_chapter_soup(
         return chapter, ch_name
 
 
-def process_chapter_subparts(subfile):
+def process_chapter_subparts(subfile,
+                             ctx: Optional[ConversionContext] = None):
     """ processing for chapters with "sections" """
     with open(subfile, 'r') as f:
         soup = BeautifulSoup(f, 'lxml')
-        top_level_sections = get_top_level_sections(soup)
-
-        for section in top_level_sections:
-            section['data-type'] = 'sect1'  # type: ignore
-            del section['class']  # type: ignore
-            # move id from empty span to section
-            try:
-                section['id'] = section.select_one(  # type: ignore
-                                    'span')['id']
-            except TypeError:
-                # this happens when there's not numbering on the toc
-                pass  # like before, if it's not there that's OK.
-            except KeyError:
-                # fun fact, this happens when there is numbering on the toc
-                pass  # like before, if it's not there that's OK.
-        bibliography = soup.find('section', id="bibliography")
+    top_level_sections = get_top_level_sections(soup, ctx)
+
+    for section in top_level_sections:
+        section['data-type'] = 'sect1'  # type: ignore
+        del section['class']  # type: ignore
+        # move id from empty span to section
+        try:
+            section['id'] = section.select_one(  # type: ignore
+                                'span')['id']
+        except TypeError:
+            # this happens when there's not numbering on the toc
+            pass  # like before, if it's not there that's OK.
+        except KeyError:
+            # fun fact, this happens when there is numbering on the toc
+            pass  # like before, if it's not there that's OK.
+    bibliography = soup.find('section', id="bibliography")
 
     return top_level_sections, bibliography
 
 
+def chapter_output_path(toc_element: Union[Path, list[Path]],
+                        source_dir: Path,
+                        build_dir: Path = Path('.')) -> Path:
+    """
+    Where process_chapter writes a toc element's chapter, preserving any
+    directory structure(s) from the source
+    """
+    if isinstance(toc_element, list):
+        chapter_file = toc_element[0]
+    else:
+        chapter_file = toc_element
+    dir_structure = [p for p in chapter_file.parts
+                     if p not in source_dir.parts]
+    parents = '/'.join(dir_structure[:-1])  # don't double the file stem
+    if parents:
+        return build_dir / parents / (chapter_file.stem + '.html')
+    return build_dir / (chapter_file.stem + '.html')
+
+
+def chapter_output_ids(output_file: Path) -> list:
+    """
+    The IDs in a chapter file we've already written, as process_ids listed
+    them when it was converted
+    """
+    with open(output_file, 'r') as f:
+        soup = BeautifulSoup(f, 'lxml')
+    chapter = soup.body.find(True) if soup.body else None
+    if not chapter:
+        return []
+    return [element['id'] for element in chapter.find_all(id=True)]
+
+
+def _process_code(chapter, ctx: ConversionContext):
+    return process_code(chapter, ctx.options.skip_cell_numbering, ctx)
+
+
+def _features(*names) -> frozenset:
+    return frozenset(names)
+
+
+# the passes a chapter goes through (after it's cleaned up), in order;
+# see passes.Pass for what each declares
+CHAPTER_PASSES = [
+    Pass("process_figures", process_figures,
+         reads=_features("figure")),
+    Pass("process_informal_figs", process_informal_figs,
+         reads=_features("img"), writes=_features("figure", "informal"),
+         # i.e., so its figures aren't treated as formal ones
+         after=("process_figures",)),
+    Pass("process_internal_refs", process_internal_refs,
+         reads=_features("internal"), writes=_features("span"),
+         # i.e., so figure header links are already gone
+         after=("process_figures",)),
+    Pass("process_citations", process_citations,
+         reads=_features("citation"),
+         writes=_features("ul", "li", "author-date")),
+    Pass("process_footnotes", process_footnotes,
+         reads=_features("footnote-reference", "footnotes", "footnote"),
+         writes=_features("span")),
+    Pass("process_admonitions", process_admonitions,
+         reads=_features("admonition"), writes=_features("h1")),
+    Pass("process_math", process_math,
+         reads=_features("math"), writes=_features("div")),
+    Pass("process_code_examples", process_code_examples,
+         reads=_features("tag_example"), writes=_features("h5")),
+    Pass("process_code", _process_code,
+         reads=_features("highlight"),
+         # i.e., so example headers are read before their spans are cleaned
+         after=("process_code_examples",),
+         when=lambda chapter, ctx: not ctx.options.keep_highlighting),
+    Pass("pre_spans_to_code_tags", pre_spans_to_code_tags,
+         reads=_features("highlight"), writes=_features("code"),
+         after=("process_code_examples",),
+         when=lambda chapter, ctx: ctx.options.keep_highlighting),
+    Pass("process_inline_code", process_inline_code,
+         reads=_features("code"),
+         after=("pre_spans_to_code_tags",)),
+    Pass("process_sidebars", process_sidebars,
+         reads=_features("sidebar"), writes=_features("h1")),
+    # (which also moves span ids up to their sections)
+    Pass("process_subsections", process_subsections,
+         reads=_features("section"),
+         after=("process_internal_refs", "process_footnotes")),
+    # i.e., whatever xrefs are left
+    Pass("process_remaining_refs", process_remaining_refs,
+         reads=_features("xref"), writes=_features("a"),
+         after=("process_internal_refs",)),
+    Pass("add_glossary_datatypes", add_glossary_datatypes,
+         reads=_features("dl"), writes=_features("dfn"),
+         when=lambda chapter, ctx: chapter.get("data-type") == "glossary"),
+    # i.e., whatever isn't HTMLBook, once everything else is done
+    Pass("sanitize_chapter", sanitize_chapter),
+]
+
+
+# passes that have been folded into others, by the pass doing their work
+# now; they can still be named as disabled, but that's ignored, since they
+# can't be turned off on their own any more
+MERGED_PASSES = {"move_span_ids_to_sections": "process_subsections"}
+
+
+@lru_cache(maxsize=None)
+def chapter_passes(disabled: tuple = ()) -> PassRegistry:
+    """ the chapter pass registry, less the disabled passes """
+    return PassRegistry(CHAPTER_PASSES,
+                        tuple(name for name in disabled
+                              if name not in MERGED_PASSES))
+
+
+def build_chapter(toc_element: Union[Path, list[Path]],
+                  ctx: Optional[ConversionContext] = None):
+    """
+    Runs a chapter through all of the processing passes except for the
+    book-wide duplicate ID check (which depends on the chapters before it),
+    returning the chapter element
+    """
+    ctx = ctx or ConversionContext()
+
+    chapter, ch_name = process_chapter_soup(toc_element, ctx)
+    ctx.log.info(f"Processing {ch_name}...")
+
+    # perform cleans and processing
+    chapter = clean_chapter(chapter)
+    passes = chapter_passes(tuple(ctx.options.disable_passes))
+    chapter = passes.run(chapter, chapter_features(chapter), ctx)
+
+    return chapter
+
+
 def process_chapter(toc_element,
                     source_dir,
                     build_dir=Path('.'),
-                    book_ids: list = [],
+                    book_ids: Optional[list] = None,
                     skip_cell_numbering: Optional[bool] = False,
-                    keep_highlighting: Optional[bool] = False):
+                    keep_highlighting: Optional[bool] = False,
+                    ctx: Optional[ConversionContext] = None):
     """
     Takes a list of chapter files and chapter lists and then writes the chapter
     to the root directory in which the script is run. Note that this assumes
     that the files are in some /html/ directory or some such
-    """
-
-    chapter, ch_name = process_chapter_soup(toc_element)
-    logging.info(f"Processing {ch_name}...")
 
-    # perform cleans and processing
-    chapter = clean_chapter(chapter)
-    # note: must process figs before xrefs
-    chapter = process_figures(chapter)
-    chapter = process_informal_figs(chapter)
-    chapter = process_internal_refs(chapter)
-    chapter = process_citations(chapter)
-    chapter = process_footnotes(chapter)
-    chapter = process_admonitions(chapter)
-    chapter = process_math(chapter)
-    # note: best to run examples before code processing
-    chapter = process_code_examples(chapter)
-    if not keep_highlighting:
-        chapter = process_code(chapter, skip_cell_numbering)
-    else:
-        chapter = pre_spans_to_code_tags(chapter)
-    chapter = process_inline_code(chapter)
-    chapter = move_span_ids_to_sections(chapter)
-    chapter = process_sidebars(chapter)
-    chapter = process_subsections(chapter)
-    # finally, process any remaining xrefs
-    chapter = process_remaining_refs(chapter)
+    When run with a conversion context, its options and ID registry are used
+    (unless a specific list of `book_ids` to check against is given);
+    otherwise they come from the arguments.
+    """
+    if not ctx:
+        ctx = ConversionContext(options=ConversionOptions(
+            skip_cell_numbering=bool(skip_cell_numbering),
+            keep_highlighting=bool(keep_highlighting)))
+    if book_ids is None:
+        book_ids = ctx.book_ids
 
-    if chapter.get("data-type") == "glossary":
-        add_glossary_datatypes(chapter)
+    chapter = build_chapter(toc_element, ctx)
 
     # ensure we have unique IDs across the book
-    chapter, ids = process_ids(chapter, book_ids)
+    chapter, ids = process_ids(chapter, book_ids, ctx)
+    ctx.metrics["chapters"] += 1
 
     # write the file, preserving any directory structure(s) from source
-    if type(toc_element) is list:
-        dir_structure = [p for p in toc_element[0].parts
-                         if p not in source_dir.parts]
-    else:
-        dir_structure = [p for p in toc_element.parts
-                         if p not in source_dir.parts]
-    parents = '/'.join(dir_structure[:-1])  # don't double the file stem
-    if parents:
-        parent_path = build_dir / parents
-        # required for the write step later
-        parent_path.mkdir(parents=True, exist_ok=True)
-        out = parent_path / (ch_name + '.html')
-    else:
-        out = build_dir / (ch_name + '.html')
+    out = chapter_output_path(toc_element, source_dir, build_dir)
+    # required for the write step
+    out.parent.mkdir(parents=True, exist_ok=True)
 
     out.write_text(str(chapter))
 
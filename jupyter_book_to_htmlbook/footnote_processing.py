@@ -1,11 +1,14 @@
-import logging
+from typing import Optional
+from .context import ConversionContext
+from .helpers import move_nodes
 
 
-def process_footnotes(chapter):
+def process_footnotes(chapter, ctx: Optional[ConversionContext] = None):
     """
     Takes footnote anchors and footnote lists and turns them into
     <span data-type='footnote'> tags.
     """
+    ctx = ctx or ConversionContext()
     footnote_refs = chapter.find_all(class_='footnote-reference')
     # move the contents of the ref to the anchor point
     for ref in footnote_refs:
@@ -13,18 +16,17 @@ def process_footnotes(chapter):
             ref_id = ref.get('href').split('#')[-1]
             # double next_sibling b/c next sibling is a space
             ref_location = chapter.find(id=ref_id).next_sibling.next_sibling
-            footnote_contents = ref_location.find('p').children
+            footnote_contents = ref_location.find('p').contents
             ref.name = 'span'
             ref['data-type'] = 'footnote'
             del ref['href']
             del ref['class']
             del ref['id']
             ref.string = ''
-            for child in footnote_contents:
-                ref.append(child)
+            move_nodes(footnote_contents, ref)
 
         except AttributeError:
-            logging.warning(f'Error converting footnote "{ref}".')
+            ctx.log.warning(f'Error converting footnote "{ref}".')
     # remove the list of footnote contents
     hrs = chapter.find_all('hr', {'class': 'footnotes'})
     for hr in hrs:
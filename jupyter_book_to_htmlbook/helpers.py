@@ -1,6 +1,80 @@
+from bs4 import NavigableString  # type: ignore
+
+
 def base_soup(element):
     try:
         soup = [x for x in element.parents][-1]
     except IndexError:
         soup = element
     return soup
+
+
+# Tree-edit primitives. These move nodes rather than copying or rebuilding
+# them. Since bs4 looks up a node's position in its parent whenever it's
+# removed or replaced, runs of nodes are moved in order (so each is found
+# where the last one was), and a tag's strings are replaced in the same pass
+# that finds them rather than with a lookup per string.
+
+def move_nodes(nodes, target, position=None):
+    """
+    Moves the nodes (from wherever they are, even another soup) into the
+    target, in order, at the end (or starting at `position`)
+    """
+    if position is None:
+        position = len(target.contents)
+    for offset, node in enumerate(list(nodes)):
+        target.insert(position + offset, node)
+    return target
+
+
+def move_children(source, target, position=None):
+    """ moves all of source's children into target, in order """
+    return move_nodes(source.contents, target, position)
+
+
+def wrap_children(tag, wrapper, start=0, end=None):
+    """
+    Wraps a run of the tag's children (contents[start:end], i.e., all of them
+    by default) in wrapper, which takes their place
+    """
+    nodes = tag.contents[start:end]
+    tag.insert(start, wrapper)
+    return move_nodes(nodes, wrapper)
+
+
+def _swap_string(old, new, index):
+    """
+    Puts new in old's place (at index in its parent's contents), relinking
+    its neighbours directly rather than looking old up and re-inserting
+    """
+    parent = old.parent
+    new.parent = parent
+    new.previous_element, new.next_element = \
+        old.previous_element, old.next_element
+    new.previous_sibling, new.next_sibling = \
+        old.previous_sibling, old.next_sibling
+    if new.previous_element is not None:
+        new.previous_element.next_element = new
+    if new.next_element is not None:
+        new.next_element.previous_element = new
+    if new.previous_sibling is not None:
+        new.previous_sibling.next_sibling = new
+    if new.next_sibling is not None:
+        new.next_sibling.previous_sibling = new
+    parent.contents[index] = new
+    old.parent = old.previous_element = old.next_element = None
+    old.previous_sibling = old.next_sibling = None
+
+
+def replace_strings(tag, replace):
+    """
+    Replaces each of the tag's own strings (i.e., its direct children, not
+    comments or the like) with replace(string), in a single pass over its
+    contents
+    """
+    for index, child in enumerate(tag.contents):
+        if type(child) is NavigableString:
+            text = replace(child)
+            if text != child:
+                _swap_string(child, NavigableString(text), index)
+    return tag
@@ -1,17 +1,21 @@
 import logging
-import shutil
+import sys
 import typer
+from enum import Enum
 from pathlib import Path
-from importlib import metadata
-from typing import Optional
-from .toc_processing import get_book_toc
-from .file_processing import process_chapter, process_part
-from .atlas import update_atlas
+from typing import List, Optional
+from .conversion import ConversionOptions, convert_book, __version__
+from .events import open_events
+from .file_processing import chapter_passes
+from .toc_processing import TocError
+from .watch import BookWatcher
 
 
 app = typer.Typer()
 
-__version__ = metadata.version(__package__)
+
+class EventFormat(str, Enum):
+    jsonl = "jsonl"
 
 
 def show_version(value: bool):
@@ -34,6 +38,65 @@ def jupter_book_to_htmlbook(
             "--skip-jb-build",
             help="Skip running `jupyter-book` as a part of this conversion"
             ),
+        auto_jb_build: Optional[bool] = typer.Option(
+            False,
+            "--auto-jb-build",
+            help="Only run `jupyter-book` if the book's sources changed " +
+                 "since its last build",
+            ),
+        split_jb_build: Optional[int] = typer.Option(
+            None,
+            "--split-jb-build",
+            help="Run `jupyter-book` as up to this many concurrent builds " +
+                 "of the book's parts",
+            ),
+        jb_fail_fast: Optional[bool] = typer.Option(
+            False,
+            "--jb-fail-fast",
+            help="Stop `jupyter-book` (and the conversion) as soon as a " +
+                 "notebook fails to execute",
+            ),
+        jb_timeout: Optional[int] = typer.Option(
+            None,
+            "--jb-timeout",
+            help="Stop `jupyter-book` (and the conversion) if it's still " +
+                 "running after this many seconds",
+            ),
+        jb_in_process: Optional[bool] = typer.Option(
+            False,
+            "--jb-in-process",
+            help="Run `jupyter-book` on a worker process that keeps it " +
+                 "imported between builds, rather than as a new command",
+            ),
+        build_cache: Optional[str] = typer.Option(
+            None,
+            "--build-cache",
+            envvar="JB2HTMLBOOK_BUILD_CACHE",
+            help="Directory of cached `jupyter-book` builds to restore " +
+                 "from (and add to), shared between checkouts",
+            ),
+        build_cache_size: Optional[int] = typer.Option(
+            None,
+            "--build-cache-size",
+            help="Size limit of the build cache, in MB (default 2048)",
+            ),
+        pre_execute: Optional[bool] = typer.Option(
+            False,
+            "--pre-execute",
+            help="Execute the book's notebooks in parallel into its " +
+                 "jupyter-cache before running `jupyter-book`",
+            ),
+        execute_jobs: Optional[int] = typer.Option(
+            None,
+            "--execute-jobs",
+            help="Pre-execute this many notebooks at once (defaults to " +
+                 "the CPU count)",
+            ),
+        notebook_timeout: Optional[int] = typer.Option(
+            None,
+            "--notebook-timeout",
+            help="Stop pre-executing a notebook after this many seconds",
+            ),
         skip_cell_numbering: Optional[bool] = typer.Option(
             False,
             "--skip-numbering",
@@ -48,6 +111,69 @@ def jupter_book_to_htmlbook(
             "--keep-highlighting",
             help="Preserve any code highlighting provided by Jupyter Book",
             ),
+        keep_going: Optional[bool] = typer.Option(
+            False,
+            "--keep-going",
+            help="Keep converting past chapters that fail, listing them " +
+                 "in jb2htmlbook-failures.json in the TARGET directory",
+            ),
+        retry_failed: Optional[bool] = typer.Option(
+            False,
+            "--retry-failed",
+            help="Convert only the chapters that failed in the last " +
+                 "--keep-going run, keeping the rest of the output",
+            ),
+        only: Optional[List[str]] = typer.Option(
+            None,
+            "--only",
+            help="Convert only these chapters (file stems or paths) or " +
+                 "parts (numbers); may be repeated or comma-separated",
+            ),
+        disable_pass: Optional[List[str]] = typer.Option(
+            None,
+            "--disable-pass",
+            help="Skip this chapter processing pass (by name); may be " +
+                 "repeated or comma-separated",
+            ),
+        jobs: int = typer.Option(
+            1,
+            "--jobs", "-j",
+            help="Convert chapters on this many worker processes",
+            ),
+        worker_max_chapters: Optional[int] = typer.Option(
+            None,
+            "--worker-max-chapters",
+            help="Replace a chapter worker after this many chapters",
+            ),
+        worker_max_rss: Optional[int] = typer.Option(
+            None,
+            "--worker-max-rss",
+            help="Replace a chapter worker once it uses more than this " +
+                 "much memory (in MB)",
+            ),
+        chapter_memory_budget: Optional[int] = typer.Option(
+            None,
+            "--chapter-memory-budget",
+            help="Flag chapters that need more than this much memory (in " +
+                 "MB), and retry them in a fresh worker",
+            ),
+        watch: Optional[bool] = typer.Option(
+            False,
+            "--watch",
+            help="After converting, watch the jupyter book build for " +
+                 "changes and reconvert the affected chapters",
+            ),
+        events: Optional[EventFormat] = typer.Option(
+            None,
+            "--events",
+            help="Report progress as a stream of events in this format " +
+                 "(written to stdout, or to --events-fd)",
+            ),
+        events_fd: Optional[int] = typer.Option(
+            None,
+            "--events-fd",
+            help="File descriptor to write --events to instead of stdout",
+            ),
         version: Optional[bool] = typer.Option(
             None,
             "--version",
@@ -63,17 +189,61 @@ def jupter_book_to_htmlbook(
     HTMLBook, and places those files in the TARGET directory.
 
     If you for some reason don't want this script to run `jupyter-book` (`jb`),
-    use the SKIP_JB_BUILD option.
+    use the SKIP_JB_BUILD option; with AUTO_JB_BUILD, it's only run if the
+    book's _toc.yml, _config.yml, bibliography or any of the source files in
+    its table of contents changed since the last build. SPLIT_JB_BUILD runs
+    it as several concurrent builds, each of a run of the book's parts. Its
+    output goes to the log as it runs; to give up on a build that won't be
+    usable, use JB_FAIL_FAST (to stop when a notebook fails) or JB_TIMEOUT.
+    JB_IN_PROCESS runs it on a worker process that keeps it imported.
+    To share builds between checkouts, give a BUILD_CACHE directory: builds
+    of the same sources (and jupyter-book version) are restored from it
+    instead of run.
+
+    For books that set `execute_notebooks: cache`, PRE_EXECUTE runs the
+    notebooks whose code changed on EXECUTE_JOBS processes (each for at most
+    NOTEBOOK_TIMEOUT seconds) ahead of `jupyter-book`, which then only has
+    to render them.
 
     If you want to UPDATE_ATLAS_JSON, provide the relative path to the
     atlas.json file (will usually be just "atlas.json")
 
+    Normally a chapter that fails to convert stops the run; with KEEP_GOING,
+    the rest of the book is still converted and the failed chapters are
+    listed in TARGET/jb2htmlbook-failures.json, so that a later run with
+    RETRY_FAILED can convert just those chapters.
+
+    To convert just some of the book, e.g., after fixing a chapter, list
+    those chapters or parts with ONLY; the rest of the book's existing
+    output is left as it is (and atlas.json is only updated if asked).
+
+    Books that don't need some of the chapter processing passes (e.g.,
+    process_math) can turn them off with DISABLE_PASS.
+
+    To convert chapters in parallel, set JOBS; chapter workers can be
+    recycled after WORKER_MAX_CHAPTERS or once they grow past WORKER_MAX_RSS,
+    and chapters going over the CHAPTER_MEMORY_BUDGET are retried in a fresh
+    worker.
+
+    To keep the conversion up to date while you rerun `jb build`, use the
+    WATCH option; only chapters whose built HTML changes are reconverted.
+
+    For orchestration, EVENTS jsonl reports progress (e.g., each chapter as
+    it's written) as JSON lines on stdout, or on the EVENTS_FD file
+    descriptor; when they go to stdout, the list of files isn't printed
+    (and WATCH lists the files it rewrites on stderr instead).
+
     Returns a json list of converted "files" as output for consumption by
     Atlas, O'Reilly's in-house publishing tool. Saves run information to
     jupyter_book_to_htmlbook_run.log
     """
-    # use paths
-    source_dir = Path(source) / '_build/html'
+    disabled_passes = [name.strip() for names in disable_pass or []
+                       for name in names.split(',') if name.strip()]
+    try:
+        chapter_passes(tuple(disabled_passes))
+    except ValueError as error:
+        raise typer.BadParameter(str(error), param_hint="--disable-pass")
+
     output_dir = Path.cwd() / target
 
     # create output_dir (and wiping it is OK)
@@ -85,68 +255,63 @@ def jupter_book_to_htmlbook(
                         encoding='utf-8',
                         format='%(levelname)s: %(message)s',
                         level=logging.DEBUG)
-    logging.info(f'App version: {__version__}')
-    logging.info(f'Source: {source}, Target: {target}')
-
-    # run `jupyter-book` (or log that we didn't)
-    if not skip_jb_build:
-        # NOTE: that we have to run it as a subprocess because it doesn't
-        # seem like they've designed it to be importable.
-        # Bonus is that it keeps the command similar to what an author will be
-        # using locally.
-        import subprocess
-        jb_info = subprocess.run(['jupyter-book',
-                                  'build',
-                                  source,
-                                  # silence warnings, which instead appear to
-                                  # error out inside Atlas; instead we'll rely
-                                  # on Atlas's own missing xref checker
-                                  '-qq'],
-                                 # hide chatty jupyter-book build output
-                                 stdout=subprocess.DEVNULL)
-        # but log any errors
-        logging.info("jupyter-book run errors: " + str(jb_info.stderr))
-    else:
-        logging.info("Skipping jupyter-book run...")
-
-    # setup images directory
-    if Path(f'{source_dir}/_images').exists():
-        image_dir = output_dir / '_images'
-        image_dir.mkdir(parents=True, exist_ok=True)
-        shutil.copytree(f'{source_dir}/_images/', image_dir,
-                        dirs_exist_ok=True)
-    else:
-        logging.info("No images in the source book")
-
-    # get table of contents
-    toc = get_book_toc(Path(source))
-    if not include_root:
-        toc = toc[1:]  # i.e., don't include the root
-
-    # create a list to return as output
-    processed_files = []
-    book_ids: list[str] = []
-
-    # process book files
-    for element in toc:
-        if '/_jb_part' in str(element):  # process part paths
-            file = process_part(element, output_dir)
-            processed_files.append(f'{target}/{file}')
-        else:  # process chapter paths
-            file, chapter_ids = process_chapter(element,
-                                                source_dir,
-                                                output_dir,
-                                                book_ids,
-                                                skip_cell_numbering,
-                                                keep_highlighting)
-            processed_files.append(f'{target}/{file}')
-            book_ids.extend(chapter_ids)
-
-    if atlas_json:
-        atlas_path = Path(atlas_json)
-        update_atlas(atlas_path, processed_files)
-    else:
-        print(", ".join(processed_files))
+
+    options = ConversionOptions(atlas_json=atlas_json,
+                                skip_jb_build=bool(skip_jb_build),
+                                auto_jb_build=bool(auto_jb_build),
+                                split_jb_build=split_jb_build,
+                                jb_fail_fast=bool(jb_fail_fast),
+                                jb_timeout=jb_timeout,
+                                jb_in_process=bool(jb_in_process),
+                                build_cache=build_cache,
+                                build_cache_size=build_cache_size,
+                                pre_execute=bool(pre_execute),
+                                execute_jobs=execute_jobs,
+                                notebook_timeout=notebook_timeout,
+                                skip_cell_numbering=bool(skip_cell_numbering),
+                                include_root=bool(include_root),
+                                keep_highlighting=bool(keep_highlighting),
+                                keep_going=bool(keep_going),
+                                retry_failed=bool(retry_failed),
+                                only=[selector.strip()
+                                      for selectors in only or []
+                                      for selector in selectors.split(',')
+                                      if selector.strip()],
+                                disable_passes=disabled_passes,
+                                jobs=jobs,
+                                worker_max_chapters=worker_max_chapters,
+                                worker_max_rss=worker_max_rss,
+                                chapter_memory_budget=chapter_memory_budget)
+    event_stream = open_events(events_fd) if events else None
+    events_on_stdout = bool(event_stream) and \
+        event_stream.stream is sys.stdout  # type: ignore
+    try:
+        result = convert_book(source, target, options, events=event_stream)
+    except TocError as error:
+        typer.echo(error, err=events_on_stdout)
+        raise typer.Exit(1)
+
+    if not atlas_json and not events_on_stdout:
+        print(", ".join(result.files))
+
+    for notebook in result.notebooks:
+        if notebook["error"]:
+            typer.echo(f"Failed to pre-execute {notebook['file']}: " +
+                       f"{notebook['error']}", err=True)
+
+    for failure in result.failures:
+        typer.echo(f"Failed to convert {failure['file']}: " +
+                   f"{failure['message']}", err=True)
+
+    if watch:
+        try:
+            BookWatcher(Path(source), target, result.options or options,
+                        result).watch(err=events_on_stdout)
+        except KeyboardInterrupt:
+            pass
+
+    if result.failures:
+        raise typer.Exit(1)
 
 
 def main():
@@ -0,0 +1,183 @@
+from dataclasses import dataclass
+from importlib import metadata
+from inspect import signature
+from typing import Callable, Optional
+from .context import ConversionContext
+
+# third-party passes are registered as entry points in this group, each
+# named for (and pointing at) a Pass; they're only imported when a registry
+# is built, and not at all if they're disabled
+ENTRY_POINT_GROUP = "jupyter_book_to_htmlbook.passes"
+
+
+@dataclass(frozen=True)
+class Pass:
+    """
+    A chapter processing pass, declaring what the registry needs to know to
+    schedule it: its function (called with the chapter, and with the
+    conversion context if it takes a `ctx` argument, returning the
+    chapter); the tags and classes it works on
+    (`reads`, None meaning the whole chapter) and any it adds (`writes`);
+    the passes that must run before (`after`) or after (`before`) it; and,
+    optionally, when it applies (`when`, called with the chapter and the
+    context).
+    """
+    name: str
+    process: Callable
+    reads: Optional[frozenset] = None
+    writes: frozenset = frozenset()
+    after: tuple = ()
+    before: tuple = ()
+    when: Optional[Callable] = None
+
+
+def chapter_features(chapter) -> set:
+    """ the tag names and classes in the chapter, found in one walk over it """
+    features = {chapter.name}
+    features.update(chapter.get('class') or [])
+    for tag in chapter.find_all(True):
+        features.add(tag.name)
+        features.update(tag.get('class') or [])
+    return features
+
+
+def _entry_points() -> list:
+    try:
+        return list(metadata.entry_points(group=ENTRY_POINT_GROUP))
+    except TypeError:  # i.e., python 3.9
+        return list(metadata.entry_points().get(  # type: ignore
+                    ENTRY_POINT_GROUP, []))
+
+
+def _order(passes: list) -> list:
+    """
+    The passes in the order they were given, except that those a pass has to
+    run after (per the `after` and `before` declarations) are moved up to
+    just before it; raises a ValueError if the declarations can't all be met
+    """
+    by_name = {step.name: step for step in passes}
+    preceding: dict = {name: [] for name in by_name}
+    for step in passes:
+        preceding[step.name] += [name for name in step.after
+                                 if name in by_name]
+        for name in step.before:
+            if name in by_name:
+                preceding[name].append(step.name)
+
+    ordered: list = []
+    done: set = set()
+
+    def place(name: str, needed_by: list):
+        if name in done:
+            return
+        if name in needed_by:
+            cycle = needed_by[needed_by.index(name):] + [name]
+            raise ValueError("Passes can't be ordered, as their " +
+                             "before/after declarations form a cycle: " +
+                             " -> ".join(cycle))
+        for before in preceding[name]:
+            place(before, needed_by + [name])
+        ordered.append(by_name[name])
+        done.add(name)
+
+    for step in passes:
+        place(step.name, [])
+
+    # a pass shouldn't miss out on what a later pass adds, unless it's
+    # explicitly meant to run first
+    for index, step in enumerate(ordered):
+        if step.reads is None:
+            continue
+        for later in ordered[index + 1:]:
+            overlap = step.reads & later.writes
+            if overlap and step.name not in _required_before(later, ordered):
+                raise ValueError(
+                        f"{step.name} reads {', '.join(sorted(overlap))}, " +
+                        f"which {later.name} (run after it) adds; declare " +
+                        "which of them should run first")
+    return ordered
+
+
+def _required_before(step: Pass, passes: list) -> set:
+    """ the passes that step is declared to run after, directly or not """
+    by_name = {other.name: other for other in passes}
+    required: set = set()
+    pending = [step.name]
+    while pending:
+        name = pending.pop()
+        direct = set(by_name[name].after)
+        direct.update(other.name for other in passes if name in other.before)
+        for before in direct - required:
+            if before in by_name:
+                required.add(before)
+                pending.append(before)
+    return required
+
+
+class PassRegistry:
+    """
+    The passes a chapter goes through, in a checked order: the given
+    (built-in) passes plus any registered through entry points, less any
+    disabled by name
+    """
+
+    def __init__(self,
+                 passes: list,
+                 disabled: tuple = (),
+                 plugins: bool = True):
+        known = [step.name for step in passes]
+        entry_points = _entry_points() if plugins else []
+        unknown = [name for name in disabled if name not in known and
+                   name not in [entry.name for entry in entry_points]]
+        if unknown:
+            raise ValueError(f"Unknown pass(es): {', '.join(unknown)} " +
+                             f"(available: {', '.join(known)})")
+
+        found = []
+        for entry in entry_points:
+            if entry.name in disabled:
+                continue
+            step = entry.load()
+            if not isinstance(step, Pass) or step.name != entry.name:
+                raise ValueError(f"Entry point {entry.name} " +
+                                 f"({entry.value}) isn't a Pass of that name")
+            if step.name in known:
+                raise ValueError(f"There's already a pass named {step.name}")
+            found.append(step)
+
+        self.passes = _order([step for step in passes + found
+                              if step.name not in disabled])
+        self.with_ctx = {step.name for step in self.passes
+                         if "ctx" in signature(step.process).parameters}
+
+    @property
+    def names(self) -> list:
+        return [step.name for step in self.passes]
+
+    def run(self,
+            chapter,
+            features: Optional[set] = None,
+            ctx: Optional[ConversionContext] = None):
+        """
+        Runs the chapter through each pass that applies to it, skipping any
+        whose features (`reads`) the chapter doesn't have, given its features
+        (None if they weren't scanned for); the chapters each pass is skipped
+        for are counted in the run's metrics
+        """
+        ctx = ctx or ConversionContext()
+        for step in self.passes:
+            if step.when and not step.when(chapter, ctx):
+                continue
+            if (
+                    features is not None and step.reads is not None and
+                    features.isdisjoint(step.reads)
+               ):
+                ctx.metrics[f"skipped_{step.name}"] += 1
+                continue
+            if step.name in self.with_ctx:
+                chapter = step.process(chapter, ctx)
+            else:
+                chapter = step.process(chapter)
+            if features is not None:
+                features |= step.writes
+        return chapter
@@ -0,0 +1,130 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+from yaml import load  # type: ignore
+from .build import SOURCE_EXTENSIONS
+from .cache import _toc_element_files
+from .context import ConversionContext
+from .file_processing import chapter_output_path, part_output_file
+from .toc_processing import SafeLoader, TocError
+
+# at most this many files are looked up at once
+PREFLIGHT_THREADS = 16
+
+
+def _existing(paths: list) -> set:
+    """ which of the paths exist, looking them all up at once """
+    paths = list(dict.fromkeys(paths))
+    if not paths:
+        return set()
+    with ThreadPoolExecutor(min(PREFLIGHT_THREADS, len(paths))) as pool:
+        return {path for path, exists in
+                zip(paths, pool.map(Path.exists, paths)) if exists}
+
+
+def _is_part(element) -> bool:
+    return '/_jb_part' in str(element)
+
+
+def source_extensions(source: Path) -> list:
+    """
+    The extensions of the files jupyter-book builds pages from: its own, and
+    any others the book's _config.yml adds (with Sphinx's `source_suffix`,
+    or MyST-NB's `nb_custom_formats`, e.g., for .Rmd or .py notebooks)
+    """
+    try:
+        with open(Path(source) / '_config.yml') as f:
+            config = load(f.read(), SafeLoader) or {}
+    except FileNotFoundError:
+        config = {}
+    sphinx_config = (config.get("sphinx") or {}).get("config") or {}
+    extensions = list(SOURCE_EXTENSIONS)
+    for setting in ["source_suffix", "nb_custom_formats"]:
+        suffixes = sphinx_config.get(setting) or []
+        if isinstance(suffixes, str):
+            suffixes = [suffixes]
+        extensions.extend(suffix for suffix in suffixes
+                          if suffix not in extensions)
+    return extensions
+
+
+def source_files(html_file: Path,
+                 source: Path,
+                 extensions: Optional[list] = None) -> list:
+    """
+    The source files a built page could have come from (it's built from
+    whichever of them exists)
+    """
+    stub = html_file.relative_to(source / '_build/html').with_suffix('')
+    return [source / f'{stub}{extension}'
+            for extension in extensions or SOURCE_EXTENSIONS]
+
+
+def _output_file(element, source: Path, output_dir: Path) -> Path:
+    """ where a chapter or part of the toc is written """
+    if _is_part(element):
+        return output_dir / str(part_output_file(element))
+    return chapter_output_path(element, source / '_build/html', output_dir)
+
+
+def check_toc(source: Path,
+              toc: list,
+              output_dir: Path,
+              check_sources: bool = True,
+              ctx: Optional[ConversionContext] = None):
+    """
+    Checks the book's table of contents before anything expensive is done
+    with it: that each of its files has a source file (when it's going to be
+    built), and that no two of its chapters or parts would be written to the
+    same output file. Raises a TocError listing every problem found.
+    """
+    ctx = ctx or ConversionContext()
+    source = Path(source)
+    problems = []
+
+    if check_sources:
+        extensions = source_extensions(source)
+        pages = [file for element in toc if not _is_part(element)
+                 for file in _toc_element_files(element)]
+        candidates = {page: source_files(page, source, extensions)
+                      for page in pages}
+        existing = _existing([path for paths in candidates.values()
+                              for path in paths])
+        for page, paths in candidates.items():
+            if not existing.intersection(paths):
+                stub = paths[0].with_suffix('').relative_to(source)
+                problems.append(f"No source file for {stub} (looked for " +
+                                f"{', '.join(extensions)})")
+
+    outputs = defaultdict(list)
+    for element in toc:
+        outputs[_output_file(element, source, output_dir)].append(element)
+    for output, elements in outputs.items():
+        if len(elements) > 1:
+            files = [str(_toc_element_files(element)[0].relative_to(source))
+                     for element in elements]
+            problems.append(f"{', '.join(files)} would all be written " +
+                            f"to {output.relative_to(output_dir)}")
+
+    if problems:
+        for problem in problems:
+            ctx.log.error(problem)
+        raise TocError("The table of contents can't be converted:\n" +
+                       "\n".join(problems))
+
+
+def make_output_dirs(source: Path, toc: list, output_dir: Path):
+    """ creates the output directories of the toc's chapters and parts """
+    outputs = {_output_file(element, Path(source), output_dir)
+               for element in toc}
+    for directory in sorted({output.parent for output in outputs}):
+        directory.mkdir(parents=True, exist_ok=True)
+
+
+def missing_pages(toc: list) -> list:
+    """ the built pages of the toc's chapters that don't exist """
+    pages = [file for element in toc if not _is_part(element)
+             for file in _toc_element_files(element)]
+    existing = _existing(pages)
+    return [page for page in pages if page not in existing]
@@ -1,16 +1,16 @@
-import copy
-import logging
-import random
-from .helpers import base_soup
+from typing import Optional
+from .context import ConversionContext
+from .helpers import base_soup, wrap_children
 
 
-def process_internal_refs(chapter):
+def process_internal_refs(chapter, ctx: Optional[ConversionContext] = None):
     """
     Processes internal a tags with "reference internal" classes.
     Converts bib references into spans (to deal with later), and other
     references to valid htmlbook xrefs. Currently opinionated towards CMS
     author-date.
     """
+    ctx = ctx or ConversionContext()
     xrefs = chapter.find_all("a", class_='internal')
     for ref in xrefs:
         # handle bib references
@@ -35,7 +35,7 @@ def process_internal_refs(chapter):
             # remove any id tags on the parent to avoid duplicates
             del parent['id']
         elif ref.get('href').find('htt') > -1:
-            logging.warning(f"External image reference: {ref['href']}")
+            ctx.log.warning(f"External image reference: {ref['href']}")
         else:  # i.e., non reference xrefs
             ref['data-type'] = 'xref'
             uri = ref['href']  # get current uri and fix it if needed
@@ -45,11 +45,12 @@ def process_internal_refs(chapter):
     return chapter
 
 
-def process_remaining_refs(chapter):
+def process_remaining_refs(chapter, ctx: Optional[ConversionContext] = None):
     """
     Processing for any non-internal "xref" classed spans (i.e., those
     that Jupyter can't find targets for)
     """
+    ctx = ctx or ConversionContext()
     xrefs = chapter.find_all("span", class_="xref")
     for ref in xrefs:
         # convert to proper htmlbook cross reference
@@ -59,25 +60,32 @@ def process_remaining_refs(chapter):
             ref["href"] = f"#{ref.string}"
             ref.string = ref.get("href")
         else:  # in the unlikely case of a badly formatted xref
-            logging.warning(
+            ctx.log.warning(
                 f"Failed to apply xref formatting to {ref}.")
 
     return chapter
 
 
-def process_ids(chapter, existing_ids=[]):
+def process_ids(chapter,
+                existing_ids: Optional[list] = None,
+                ctx: Optional[ConversionContext] = None):
     """
     Checks a list of IDs against ids that are already being used in the
     book, and if a match is found, append a random number to the id and
     return the chapter along with the entire list of IDs in the chapter
     (so we can check them against the next chapter and so on)
+
+    Without a list of existing IDs, the context's ID registry is used.
     """
+    ctx = ctx or ConversionContext()
+    if existing_ids is None:
+        existing_ids = ctx.book_ids
     tags_with_id = chapter.find_all(id=True)
 
     for tag in tags_with_id:
         uid = tag["id"]
         if uid in existing_ids:
-            new_id = f"{uid}_{random.randint(1, 123456789)}"
+            new_id = f"{uid}_{ctx.random.randint(1, 123456789)}"
             tag["id"] = new_id
 
             # update any links to the old ID
@@ -86,7 +94,8 @@ def process_ids(chapter, existing_ids=[]):
                 ref['href'] = f"#{new_id}"
 
             # log the change
-            logging.info(f"Duplicate ID \"{uid}\" changed to \"{new_id}\"")
+            ctx.log.info(f"Duplicate ID \"{uid}\" changed to \"{new_id}\"")
+            ctx.metrics["duplicate_ids"] += 1
 
     chapter_ids = [element['id'] for element in chapter.find_all(id=True)]
     return chapter, chapter_ids
@@ -115,19 +124,7 @@ def add_glossary_datatypes(chapter):
                     element.decompose()
 
             # Wrap term string or elements in dfn tags per HTMLBook spec
-            try:
-                term.string.wrap(soup.new_tag("dfn"))
-            except AttributeError:
-                # there's no easy to wrap multiple things in bs4
-                # so this is the workaround
-                rebuilt_term = soup.new_tag("dt")
-                rebuilt_term["data-type"] = "glossterm"
-                rebuilt_term.append(soup.new_tag("dfn"))
-                for child in term.contents:
-                    # due to frustrating subtleties with the way bs4
-                    # handles children, we need to make a copy here
-                    rebuilt_term.dfn.append(copy.copy(child))
-                term.replace_with(rebuilt_term)
+            wrap_children(term, soup.new_tag("dfn"))
 
         defs = gloss.find_all("dd")
         for defn in defs:
@@ -0,0 +1,96 @@
+from typing import Optional
+from .context import ConversionContext
+
+# the elements HTMLBook allows in a chapter; any others (e.g., a theme's
+# buttons or a notebook's <details>) are unwrapped, keeping their contents
+ALLOWED_ELEMENTS = {
+    "section", "div", "aside", "nav", "header", "footer", "figure",
+    "figcaption", "h1", "h2", "h3", "h4", "h5", "h6", "p", "blockquote",
+    "pre", "code", "ol", "ul", "li", "dl", "dt", "dd", "table", "caption",
+    "colgroup", "col", "thead", "tbody", "tfoot", "tr", "th", "td", "a",
+    "em", "strong", "b", "i", "u", "s", "sub", "sup", "span", "br", "wbr",
+    "hr", "img", "dfn", "abbr", "cite", "kbd", "samp", "var", "q", "small",
+    "mark", "time", "del", "ins", "address", "video", "audio", "source",
+    "track", "iframe", "svg", "math",
+}
+# foreign content, which is passed through as is (svgs need their styles,
+# and MathML its own attributes)
+FOREIGN_ELEMENTS = {"svg", "math"}
+# the attributes allowed on any element, including HTMLBook's data-* ones
+GLOBAL_ATTRIBUTES = {
+    "id", "class", "title", "lang", "dir", "xmlns", "data-type",
+    "data-code-language", "data-line-numbering", "data-executable",
+    "data-label", "data-pdf-bookmark", "data-xrefstyle", "data-primary",
+    "data-primary-sortas", "data-secondary", "data-secondary-sortas",
+    "data-tertiary", "data-tertiary-sortas", "data-see", "data-seealso",
+    "data-startref",
+}
+# and those allowed on particular elements
+ELEMENT_ATTRIBUTES = {
+    "a": {"href"},
+    "img": {"src", "alt", "height"},
+    "td": {"colspan", "rowspan"},
+    "th": {"colspan", "rowspan"},
+    "col": {"span"},
+    "colgroup": {"span"},
+    "ol": {"start", "type", "reversed"},
+    "li": {"value"},
+    "blockquote": {"cite"},
+    "q": {"cite"},
+    "time": {"datetime"},
+    "video": {"src", "poster", "controls", "height"},
+    "audio": {"src", "controls"},
+    "source": {"src", "type"},
+    "track": {"src", "kind", "srclang", "label"},
+    "iframe": {"src", "height"},
+}
+# the classes kept, i.e., those Atlas styles (or that are set here); any
+# others are Sphinx or theme classes Atlas ignores
+ALLOWED_CLASSES = {
+    "informal", "author-date", "pagebreak-before", "pagebreak-after",
+    "less_space", "keep-together", "simplelist", "orm:hideurl",
+}
+
+
+def sanitize_chapter(chapter, ctx: Optional[ConversionContext] = None):
+    """
+    Removes whatever isn't in the HTMLBook allowlists above from the chapter
+    (elements, attributes and classes) in one walk over it. When we're
+    keeping Jupyter Book's code highlighting, the classes of the highlighted
+    blocks (i.e., .highlight and everything in it) are kept as well.
+    """
+    ctx = ctx or ConversionContext()
+    keep_highlighting = ctx.options.keep_highlighting
+
+    # tags are found in document order, so each one's parent has been seen;
+    # for each we note whether what's inside it is foreign content (which
+    # is left as is) or in a highlighted block (whose classes are kept)
+    inside: dict = {}
+    for tag in [chapter] + chapter.find_all(True):
+        foreign, highlighted = inside.get(id(tag.parent), (False, False))
+        if foreign or tag.name in FOREIGN_ELEMENTS:
+            inside[id(tag)] = (True, highlighted)
+            continue
+
+        classes = tag.get_attribute_list("class")
+        highlighted = highlighted or (keep_highlighting and
+                                      "highlight" in classes)
+        inside[id(tag)] = (False, highlighted)
+
+        if tag.name not in ALLOWED_ELEMENTS and tag is not chapter:
+            ctx.log.info(f"Unwrapping non-HTMLBook <{tag.name}> element")
+            tag.unwrap()
+            continue
+
+        allowed = ELEMENT_ATTRIBUTES.get(tag.name, set())
+        for attr in list(tag.attrs):
+            if attr not in GLOBAL_ATTRIBUTES and attr not in allowed:
+                del tag[attr]
+
+        if "class" in tag.attrs and not highlighted:
+            kept = [name for name in classes if name in ALLOWED_CLASSES]
+            if kept:
+                tag["class"] = kept
+            else:
+                del tag["class"]
+    return chapter
@@ -0,0 +1,258 @@
+import json
+import logging
+import os
+import socketserver
+import threading
+import time
+import typer
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional
+from .batch import convert_entry, parse_entry
+from .cache import ConversionCache
+from .conversion import __version__
+
+
+app = typer.Typer()
+
+# each worker process keeps its own caches warm between jobs
+_worker_cache: Optional[ConversionCache] = None
+
+
+def _init_worker():
+    global _worker_cache
+    _worker_cache = ConversionCache()
+
+
+def run_job(entry: dict) -> dict:
+    """
+    Runs a conversion job inside a worker process, reporting how the worker's
+    caches fared for the job alongside the usual book report
+    """
+    if _worker_cache is None:  # i.e., not started via the pool initializer
+        _init_worker()
+    before = Counter(_worker_cache.stats)  # type: ignore
+    report = convert_entry(entry, _worker_cache)
+    report["cache"] = dict(
+            Counter(_worker_cache.stats) - before)  # type: ignore
+    return report
+
+
+class ConversionService:
+    """
+    Runs conversion jobs on a pool of warm worker processes (at most
+    `workers` at a time; the rest wait their turn) and keeps the metrics
+    reported by the server's /metrics endpoint.
+    """
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = self._new_pool()
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.metrics: Counter = Counter()
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers,
+                                   initializer=_init_worker)
+
+    def _run(self, entry: dict) -> dict:
+        """
+        Runs a job on the pool, reporting (rather than raising) anything that
+        goes wrong outside the conversion itself. If a worker died, taking
+        the pool down with it, the pool is replaced so later jobs still run.
+        """
+        start = time.perf_counter()
+        pool = self.pool
+        try:
+            return pool.submit(run_job, entry).result()
+        except Exception as error:
+            if isinstance(error, BrokenProcessPool):
+                with self.lock:
+                    if self.pool is pool:  # i.e., not already replaced
+                        self.pool = self._new_pool()
+                        self.metrics["pool_restarts"] += 1
+                pool.shutdown(wait=False)
+            logging.error(f"Failed to run job for {entry['source']}: " +
+                          f"{error!r}")
+            return {
+                "source": entry["source"],
+                "target": entry["target"],
+                "status": "failed",
+                "files": [],
+                "warnings": [],
+                "failures": [],
+                "error": str(error) or type(error).__name__,
+                "seconds": round(time.perf_counter() - start, 3),
+            }
+
+    def convert(self, entry: dict) -> dict:
+        """ run a job (blocking until it's done) and record its metrics """
+        with self.lock:
+            self.metrics["jobs_pending"] += 1
+        try:
+            report = self._run(entry)
+        finally:
+            with self.lock:
+                self.metrics["jobs_pending"] -= 1
+
+        with self.lock:
+            self.metrics["jobs_total"] += 1
+            if report["status"] != "ok":
+                self.metrics["jobs_failed"] += 1
+            self.metrics["conversion_seconds"] += report["seconds"]
+            for key, value in report.get("cache", {}).items():
+                self.metrics[f"cache_{key}"] += value
+        return report
+
+    def health(self) -> dict:
+        return {
+            "status": "ok",
+            "version": __version__,
+            "workers": self.workers,
+            "uptime_seconds": round(time.time() - self.started, 3),
+        }
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            metrics = dict(self.metrics)
+        for key in ["jobs_total", "jobs_failed", "jobs_pending"]:
+            metrics.setdefault(key, 0)
+        metrics["conversion_seconds"] = round(
+                metrics.get("conversion_seconds", 0), 3)
+        return metrics
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+
+class ConversionRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET /health and GET /metrics report on the service; POST /convert takes
+    a JSON job ({"source": ..., "target": ..., "atlas_json": ...,
+    "options": {...}}, as in a batch manifest) and responds with the job's
+    report once the conversion is finished.
+    """
+    server_version = f"jb2htmlbook/{__version__}"
+
+    def _respond(self, status: int, body: dict):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        service = self.server.service  # type: ignore
+        if self.path == "/health":
+            self._respond(200, service.health())
+        elif self.path == "/metrics":
+            self._respond(200, service.snapshot())
+        else:
+            self._respond(404, {"error": f"Unknown endpoint: {self.path}"})
+
+    def do_POST(self):
+        service = self.server.service  # type: ignore
+        if self.path != "/convert":
+            self._respond(404, {"error": f"Unknown endpoint: {self.path}"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            entry = parse_entry(json.loads(self.rfile.read(length)))
+        except ValueError as error:  # includes json decoding errors
+            self._respond(400, {"error": str(error)})
+            return
+
+        report = service.convert(entry)
+        self._respond(200 if report["status"] == "ok" else 500, report)
+
+    def address_string(self):
+        # unix socket clients don't have an address
+        if isinstance(self.client_address, tuple):
+            return super().address_string()
+        return "unix-socket"
+
+    def log_message(self, format, *args):
+        logging.info(f"{self.address_string()} - {format % args}")
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn,
+                     socketserver.UnixStreamServer):
+    """ the HTTP server, but listening on a local unix socket """
+    daemon_threads = True
+
+
+def make_server(service: ConversionService,
+                host: str = "127.0.0.1",
+                port: int = 8000,
+                socket_path: Optional[str] = None):
+    """
+    Creates an HTTP server for the service, listening on the unix socket
+    if one is given, or on host:port otherwise
+    """
+    server: socketserver.BaseServer
+    if socket_path:
+        Path(socket_path).unlink(missing_ok=True)  # i.e., a stale socket
+        server = UnixHTTPServer(socket_path, ConversionRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), ConversionRequestHandler)
+    server.service = service  # type: ignore
+    return server
+
+
+@app.command()  # note that docstring serves as help text
+def serve(
+        host: str = typer.Option(
+            "127.0.0.1",
+            "--host",
+            help="Host to listen on"
+            ),
+        port: int = typer.Option(
+            8000,
+            "--port",
+            help="Port to listen on"
+            ),
+        socket_path: Optional[str] = typer.Option(
+            None,
+            "--socket",
+            help="Listen on this local unix socket instead of a port"
+            ),
+        workers: Optional[int] = typer.Option(
+            None,
+            "--workers",
+            help="Maximum concurrent conversions (defaults to the CPU count)"
+            )
+        ):
+    """
+    Runs a long-lived conversion service.
+
+    Conversion jobs are POSTed as JSON to /convert (with the same `source`,
+    `target`, `atlas_json` and `options` fields as a batch manifest entry) and
+    run on a pool of worker processes that keep imports, tables of contents
+    and chapter fingerprints warm between jobs, so unchanged chapters aren't
+    converted again. GET /health and /metrics report on the service.
+    """
+    logging.basicConfig(format='%(levelname)s: %(message)s',
+                        level=logging.INFO)
+    service = ConversionService(workers)
+    server = make_server(service, host, port, socket_path)
+    logging.info(f"Serving on {socket_path or f'{host}:{port}'} with " +
+                 f"{service.workers} worker(s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+        if socket_path:
+            Path(socket_path).unlink(missing_ok=True)
+
+
+def main():
+    app()
@@ -1,56 +1,77 @@
+from bs4 import Tag  # type: ignore
+
+# tags removed from chapters, along with their contents
+REMOVE_TAGS = {"style", "script"}
+# attributes removed from every tag (although we need to allow styles on
+# svg elements)
+REMOVE_ATTRS = ["style", "valign", "halign", "width"]
+# hidden content, which is also removed: in the web version, hidden cells
+# are hidden by default and users can toggle them on/off, but they take up
+# too much space if rendered into the pdf; and heading links
+HIDDEN_CLASSES = {"tag_hide-cell", "toggle-details", "headerlink"}
+# i.e., the "hide" parts of cells with these classes
+HIDDEN_PARTS_OF = {"tag_hide-input", "tag_hide-output"}
+
+
+def _hidden(tag, classes: list) -> bool:
+    """ whether the tag (with the given classes) is hidden content """
+    if not HIDDEN_CLASSES.isdisjoint(classes):
+        return True
+    if "hide" not in classes or tag.parent is None:
+        return False
+    return not HIDDEN_PARTS_OF.isdisjoint(
+            tag.parent.get_attribute_list("class"))
+
+
 def clean_chapter(chapter, rm_numbering=True):
     """
     "Cleans" the chapter from any script or style tags, removes table borders,
     table valign/width attributes, caption numbering, removes any style attrs,
     and by default removes any section numbering.
+
+    It's done in one walk over the chapter, which keeps track of whether it's
+    inside an <svg> and which tables it's in, and doesn't go into anything it
+    removes.
     """
-    remove_tags = ['style', 'script']
-    remove_attrs = ['style', 'valign', 'halign', 'width']
+    # each entry is a tag to visit, whether it's inside an <svg>, and the
+    # tables it's inside (outermost first), each noting whether it still has
+    # a caption number to remove
+    pending: list = [(child, False, ())
+                     for child in reversed(chapter.contents)]
+    while pending:
+        tag, in_svg, tables = pending.pop()
+        if not isinstance(tag, Tag):
+            continue
+        classes = tag.get_attribute_list("class")
 
-    all_tags = chapter.find_all()
-    for tag in all_tags:
-        if tag.name in remove_tags:
+        if (
+                tag.name in REMOVE_TAGS or
+                (rm_numbering and "section-number" in classes) or
+                _hidden(tag, classes)
+           ):
             tag.decompose()
-        if tag.name == 'table':
-            del tag['border']
-            if tag.find("span", class_="caption-number"):
-                tag.find("span", class_="caption-number").decompose()
-
-    for attr in remove_attrs:
-        for tag in chapter.find_all(attrs={attr: True}):
-            # we need to allow styles on svg elements
-            in_svg = False
-            if attr == "style":
-
-                if tag.name == "svg":
-                    in_svg = True
-
-                for parent in tag.parents:
-                    if parent.name == "svg":
-                        in_svg = True
-            if not in_svg:
+            continue
+
+        # i.e., the first caption number in each table
+        if tag.name == "span" and "caption-number" in classes:
+            table = next((table for table in tables
+                          if table["caption_number"]), None)
+            if table:
+                table["caption_number"] = False
+                tag.decompose()
+                continue
+
+        if tag.name == "table":
+            del tag["border"]
+            tables = tables + ({"caption_number": True},)
+
+        in_svg = in_svg or tag.name == "svg"
+        for attr in REMOVE_ATTRS:
+            if attr in tag.attrs and not (attr == "style" and in_svg):
                 del tag[attr]
 
-    # (optionally) remove numbering
-    if rm_numbering:
-        for span in chapter.find_all(class_="section-number"):
-            span.decompose()
-
-    classes_to_remove = [
-        # remove hidden cells. in the web version, these cells are hidden by
-        # default and users can toggle them on/off. but they take up too much
-        # space if rendered into the pdf.
-        ".tag_hide-input > .hide",
-        ".tag_hide-output > .hide",
-        ".tag_hide-cell",
-        ".toggle-details",
-
-        # remove any heading links
-        ".headerlink",
-    ]
-
-    for el in chapter.select(','.join(classes_to_remove)):
-        el.decompose()
+        pending.extend((child, in_svg, tables)
+                       for child in reversed(tag.contents))
     return chapter
 
 
@@ -60,20 +81,30 @@ def move_span_ids_to_sections(chapter):
     and moves the id to the parent section tag so Atlas can find the cross
     reference.
     """
-    empty_id_spans = chapter.find_all("span", id=True, string=None)
-    for span in empty_id_spans:
-        if (
-                span.parent.name == "section" and
-                span.next_sibling and  # guard in case of no next_sibling
-                span.next_sibling.name in ["h1", "h2", "h3", "h4", "h5"]
-           ):
-            # add span id to section
-            span.parent['id'] = span.get('id')
-            # remove the now unneeded span
-            span.decompose()
+    for span in chapter.find_all("span", id=True):
+        move_span_id_to_section(span)
     return chapter
 
 
+def move_span_id_to_section(span) -> bool:
+    """
+    If it's a span[id] under a section parent with a heading next sibling,
+    moves its id to the section and removes it; returns whether it did
+    """
+    if (
+            span.name == "span" and span.has_attr("id") and
+            span.parent.name == "section" and
+            span.next_sibling and  # guard in case of no next_sibling
+            span.next_sibling.name in ["h1", "h2", "h3", "h4", "h5"]
+       ):
+        # add span id to section
+        span.parent['id'] = span.get('id')
+        # remove the now unneeded span
+        span.decompose()
+        return True
+    return False
+
+
 def process_sidebars(chapter):
     """
     Sidebars should be tagged with appropriate datatype and
@@ -1,11 +1,15 @@
-import logging
-import sys
+import re
 from pathlib import Path
+from typing import Optional
 from yaml import load  # type: ignore
+# libyaml's faster loader (and dumper) where PyYAML has it, for every module
+# that reads or writes yaml
 try:
+    from yaml import CSafeDumper as SafeDumper  # noqa: F401
     from yaml import CSafeLoader as SafeLoader
 except ImportError:
-    from yaml import SafeLoader
+    from yaml import SafeDumper, SafeLoader  # type: ignore # noqa: F401
+from .context import ConversionContext
 
 
 def _path(file_stub, src_dir):
@@ -21,22 +25,27 @@ def _path(file_stub, src_dir):
     return Path(src_dir / f'_build/html/{file_stub}.html')
 
 
-def _log_print_and_exit(message):
+class TocError(Exception):
+    """ the book's _toc.yml can't be used for a conversion """
+
+
+def _log_and_raise(message, ctx: ConversionContext):
     """
-    helper function to log a script-ending error message, print it,
-    and exit with an error code indicating failure
+    helper function to log a conversion-ending error message and raise it
+    as a TocError (the CLI reports it and exits with an error code)
     """
-    logging.error(message)
-    print(message)
-    sys.exit(1)
+    ctx.log.error(message)
+    raise TocError(message)
 
 
-def get_book_toc(src_dir: Path) -> list:
+def get_book_toc(src_dir: Path,
+                 ctx: Optional[ConversionContext] = None) -> list:
     """
     Takes the 'genindex' file from a Jupyter Book HTML site and returns a
     list of chapter URIs and lists of chapter URIs where there is more than one
     file per chapter.
     """
+    ctx = ctx or ConversionContext()
     compiled_toc = []
 
     try:
@@ -48,17 +57,18 @@ def get_book_toc(src_dir: Path) -> list:
                     message = ("Unsupported jupyter book format: " +
                                toc["format"] + ". The only supported" +
                                " format is 'jb-book'.")
-                    _log_print_and_exit(message)
+                    _log_and_raise(message, ctx)
             except KeyError:
                 message = ("Malformed _toc.yml file. Please see " +
                            "jupyterbook.org for correct syntax.")
-                _log_print_and_exit(message)
+                _log_and_raise(message, ctx)
 
             # add "root"
             compiled_toc.append(_path(toc["root"], src_dir))
 
             if "parts" in toc.keys():
-                compiled_toc.extend(process_parts(toc["parts"], src_dir))
+                compiled_toc.extend(process_parts(toc["parts"], src_dir,
+                                                  ctx))
             # check for a preface, and move it ahead of the first part if found
                 prefaces = [i for i in compiled_toc
                             if type(i) != list and  # i.e., not a sub-file
@@ -67,7 +77,7 @@ def get_book_toc(src_dir: Path) -> list:
                             'preface' in str(i.relative_to(src_dir)).lower()]
                 # go backwards through prefaces to preserve ordering
                 for preface in prefaces[::-1]:
-                    logging.info(
+                    ctx.log.info(
                         f"Moving preface ({preface}) ahead of first part..."
                     )
                     compiled_toc.insert(1,  # insert at position one after root
@@ -79,11 +89,11 @@ def get_book_toc(src_dir: Path) -> list:
     except FileNotFoundError:
         message = "Can't find the _toc.yml file. Ensure you're " + \
                   "specifying a valid jupyter book project as the SOURCE."
-        _log_print_and_exit(message)
+        _log_and_raise(message, ctx)
 
-    logging.info("Working with the following table of contents:")
+    ctx.log.info("Working with the following table of contents:")
     for path in compiled_toc:
-        logging.info(path)
+        ctx.log.info(path)
 
     return compiled_toc
 
@@ -111,8 +121,9 @@ def process_chapters(chapter_list, src_dir) -> list:
     return chapters
 
 
-def process_parts(parts, src_dir):
+def process_parts(parts, src_dir, ctx: Optional[ConversionContext] = None):
     """ part processing function"""
+    ctx = ctx or ConversionContext()
     part_number = 0
     part_files = []
     for part in parts:
@@ -120,10 +131,13 @@ def process_parts(parts, src_dir):
         # create a distinct placeholder Path for downstream processing
         try:
             part_title = part["caption"].replace(' ', '-')
-        except TypeError:  # because it's looking for a string, getting an int
+            if not part_title:
+                raise ValueError
+        # i.e., looking for a string caption, but getting an int (or nothing)
+        except (TypeError, KeyError, AttributeError, ValueError):
             message = ("Missing part caption in _toc.yml. " +
                        "Part captions are required.")
-            _log_print_and_exit(message)
+            _log_and_raise(message, ctx)
         part_stub = f'_jb_part-{part_number}-{part_title}'
         part_files.append(_path(part_stub, src_dir))
         # now add the chapters
@@ -131,3 +145,61 @@ def process_parts(parts, src_dir):
             process_chapters(part["chapters"], src_dir)
         )
     return part_files
+
+
+def select_toc_elements(toc: list,
+                        selectors: list,
+                        src_dir: Path,
+                        ctx: Optional[ConversionContext] = None) -> list:
+    """
+    Picks out the table of contents elements matching any of the selectors:
+    chapter file stems ("ch01"), file paths relative to the book ("notebooks/
+    ch01", with or without an extension), or part numbers ("2" or "part-2",
+    selecting the part and its chapters). A chapter's sections select the
+    whole chapter.
+    """
+    ctx = ctx or ConversionContext()
+    html_dir = Path(src_dir) / '_build/html'
+    # map what we look for to the selector that asked for it
+    part_numbers = {}
+    paths = {}
+    for selector in selectors:
+        part = re.fullmatch(r'(?:part-)?([0-9]+)', selector)
+        if part:
+            part_numbers[part.group(1)] = selector
+        else:
+            path = re.sub(r'\.(ipynb|md|rst|html)$', '',
+                          selector.removeprefix('./'))
+            paths[path] = selector
+
+    selected = []
+    matched = set()
+    current_part = None
+    for element in toc:
+        if isinstance(element, list):
+            files = element
+        else:
+            files = [element]
+            part = re.search(r'/_jb_part-([0-9]+)-', str(element))
+            if part:
+                current_part = part.group(1)
+        if current_part in part_numbers:
+            selected.append(element)
+            matched.add(part_numbers[current_part])
+            continue
+        for file in files:
+            relative = str(file.relative_to(html_dir).with_suffix(''))
+            candidates = {file.stem, relative}
+            found = [selector for path, selector in paths.items()
+                     if path in candidates or path.endswith('/' + relative)]
+            if found:
+                selected.append(element)
+                matched.update(found)
+                break
+
+    unmatched = [selector for selector in selectors
+                 if selector not in matched]
+    if unmatched:
+        _log_and_raise("Nothing in the table of contents matches " +
+                       ", ".join(unmatched), ctx)
+    return selected
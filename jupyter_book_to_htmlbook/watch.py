@@ -0,0 +1,266 @@
+import shutil
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+from .atlas import update_atlas
+from .context import ConversionContext, ConversionOptions
+from .conversion import ConversionResult
+from .file_processing import (
+        chapter_output_path,
+        part_output_file,
+        process_chapter,
+        process_part
+    )
+from .toc_processing import get_book_toc, TocError
+
+
+# seconds between checks for changes, and of quiet after a change before
+# we act on it (`jb build` writes many files in bursts)
+POLL_INTERVAL = 0.5
+DEBOUNCE = 1.0
+
+
+def snapshot(source: Path) -> dict:
+    """
+    Modification times and sizes of the files we watch: the _toc.yml file
+    and everything in the jupyter book's _build/html directory
+    """
+    files = {}
+    watched = [source / '_toc.yml']
+    build_dir = source / '_build/html'
+    if build_dir.exists():
+        watched.extend(p for p in build_dir.rglob('*')
+                       if p.suffix == '.html' or '_images' in p.parts)
+    for path in watched:
+        try:
+            stat = path.stat()
+            if path.is_file():
+                files[path] = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:  # i.e., removed as we were looking
+            pass
+    return files
+
+
+def changed_files(before: dict, after: dict) -> set:
+    """ files that were added, removed, or modified between snapshots """
+    return {path for path in before.keys() | after.keys()
+            if before.get(path) != after.get(path)}
+
+
+def wait_for_changes(source: Path,
+                     previous: dict,
+                     poll_interval: float = POLL_INTERVAL,
+                     debounce: float = DEBOUNCE,
+                     timeout: Optional[float] = None) -> tuple:
+    """
+    Polls until something changes, and then until things have been quiet for
+    `debounce` seconds, returning the new snapshot and the set of changed
+    files (empty if we time out first)
+    """
+    start = time.monotonic()
+    current = snapshot(source)
+    while not changed_files(previous, current):
+        if timeout is not None and time.monotonic() - start > timeout:
+            return current, set()
+        time.sleep(poll_interval)
+        current = snapshot(source)
+
+    # wait for the burst of writes to settle
+    last_change = time.monotonic()
+    while time.monotonic() - last_change < debounce:
+        time.sleep(poll_interval)
+        latest = snapshot(source)
+        if changed_files(current, latest):
+            current = latest
+            last_change = time.monotonic()
+
+    return current, changed_files(previous, current)
+
+
+def _toc_files(toc_element) -> list:
+    if isinstance(toc_element, list):
+        return toc_element
+    return [toc_element]
+
+
+class BookWatcher:
+    """
+    Keeps a converted book up to date: given the changed files in the
+    jupyter book build, reconverts only the affected chapters (a chapter with
+    sections is reconverted when any of its files change), and replans from
+    the table of contents when _toc.yml changes.
+
+    IDs are tracked per chapter so duplicate ID handling stays correct for
+    reconverted chapters and any later chapters their new IDs collide with.
+    """
+
+    def __init__(self,
+                 source: Path,
+                 target: str,
+                 options: ConversionOptions,
+                 result: ConversionResult):
+        self.source = Path(source)
+        self.target = target
+        # i.e., as the book was converted, with the passes it turns off
+        options = result.options or options
+        self.options = options
+        self.ctx = ConversionContext(options=options)
+        self.source_dir = self.source / '_build/html'
+        self.output_dir = Path.cwd() / target
+        self.toc = self._plan()
+        # match the result's files up with the toc (chapters that failed
+        # with --keep-going aren't among them)
+        self.files = {}
+        self.ids = {}
+        for element in self.toc:
+            if '/_jb_part' in str(element):
+                file = str(part_output_file(element))
+            else:
+                file = str(chapter_output_path(element, self.source_dir,
+                                               self.output_dir)
+                           .relative_to(self.output_dir))
+            processed = f'{target}/{file}'
+            if processed in result.ids:
+                self.files[str(element)] = processed
+                self.ids[str(element)] = result.ids[processed]
+        self.atlas_outdated = False
+
+    def _plan(self) -> list:
+        toc = get_book_toc(self.source, self.ctx)
+        if not self.options.include_root:
+            toc = toc[1:]  # i.e., don't include the root
+        return toc
+
+    def handle_changes(self, changed: set) -> list:
+        """
+        Updates the conversion for a set of changed files, returning the
+        list of files that were (re)written
+        """
+        written = []
+        pending = set()
+
+        if any('_images' in path.parts for path in changed):
+            image_dir = self.source_dir / '_images'
+            if image_dir.exists():
+                shutil.copytree(image_dir, self.output_dir / '_images',
+                                dirs_exist_ok=True)
+                self.ctx.log.info("Copied updated images")
+
+        if self.source / '_toc.yml' in changed:
+            try:
+                pending, written = self._replan()
+            except TocError as error:
+                # keep the old plan until the toc is fixed
+                self.ctx.log.error(f"Not replanning: {error}")
+
+        for element in self.toc:
+            if '/_jb_part' in str(element):
+                continue
+            if any(path in changed for path in _toc_files(element)):
+                pending.add(str(element))
+
+        written.extend(self._reconvert(pending))
+        return written
+
+    def _replan(self) -> tuple:
+        """
+        Rereads the table of contents, writing parts and returning new
+        chapters (to be converted) along with the written part files
+        """
+        new_toc = self._plan()
+        self.ctx.log.info("Table of contents changed; replanning")
+
+        written = []
+        pending = set()
+        for element in new_toc:
+            key = str(element)
+            if '/_jb_part' in key:  # cheap, so always rewrite
+                file = f'{self.target}/' + \
+                    str(process_part(element, self.output_dir, self.ctx))
+                self.files[key] = file
+                self.ids[key] = []
+                written.append(file)
+            elif key not in self.files:
+                pending.add(key)
+
+        # forget anything no longer in the book
+        keys = {str(element) for element in new_toc}
+        for key in set(self.files) - keys:
+            self.ctx.log.info(f"No longer in the book: {self.files[key]}")
+            del self.files[key]
+            del self.ids[key]
+        self.toc = new_toc
+
+        # atlas.json is updated once the new chapters are converted
+        self.atlas_outdated = True
+        return pending, written
+
+    def _reconvert(self, pending: set) -> list:
+        """
+        Reconverts pending chapters in book order, along with any later
+        chapters that now have an ID collision with a reconverted chapter
+        """
+        written = []
+        book_ids: list[str] = []
+        new_ids: set = set()
+
+        for element in self.toc:
+            key = str(element)
+            if '/_jb_part' in key:
+                continue
+            if key in pending or new_ids.intersection(self.ids.get(key, [])):
+                try:
+                    file, chapter_ids = process_chapter(element,
+                                                        self.source_dir,
+                                                        self.output_dir,
+                                                        book_ids,
+                                                        ctx=self.ctx)
+                except (RuntimeError, FileNotFoundError) as error:
+                    # e.g., jb is still writing, or the chapter is broken;
+                    # keep watching, it'll be retried on the next change
+                    # (its previous IDs still count against later chapters)
+                    self.ctx.log.error(f"Failed to reconvert {key}: {error}")
+                else:
+                    new_ids.update(set(chapter_ids) -
+                                   set(self.ids.get(key, [])))
+                    self.ids[key] = chapter_ids
+                    self.files[key] = f'{self.target}/{file}'
+                    written.append(self.files[key])
+                    self.ctx.log.info(f"Reconverted {self.files[key]}")
+            book_ids.extend(self.ids.get(key, []))
+
+        if self.options.atlas_json and self.atlas_outdated:
+            update_atlas(Path(self.options.atlas_json), self.processed_files,
+                         ctx=self.ctx)
+        self.atlas_outdated = False
+
+        return written
+
+    @property
+    def processed_files(self) -> list:
+        """ the book's files, in order """
+        return [self.files[str(element)] for element in self.toc
+                if str(element) in self.files]
+
+    def watch(self,
+              cycles: Optional[int] = None,
+              poll_interval: float = POLL_INTERVAL,
+              debounce: float = DEBOUNCE,
+              err: bool = False):
+        """
+        Watches for changes until interrupted (or for a number of change
+        `cycles`), printing the files rewritten after each change (to stderr
+        with `err`, e.g., when stdout has the event stream)
+        """
+        current = snapshot(self.source)
+        self.ctx.log.info(f"Watching {self.source} for changes...")
+        while cycles is None or cycles > 0:
+            current, changed = wait_for_changes(self.source, current,
+                                                poll_interval, debounce)
+            written = self.handle_changes(changed)
+            if written:
+                print(", ".join(written),
+                      file=sys.stderr if err else sys.stdout)
+            if cycles is not None:
+                cycles -= 1
@@ -0,0 +1,323 @@
+import logging
+import multiprocessing
+import os
+import sys
+from collections import deque
+from multiprocessing.connection import Connection, wait
+from pathlib import Path
+from typing import Generator, Optional, Union
+from bs4 import BeautifulSoup  # type: ignore
+from .context import ConversionContext, ConversionOptions
+from .file_processing import build_chapter, chapter_output_path
+try:
+    import resource
+except ImportError:  # i.e., on Windows
+    resource = None  # type: ignore
+
+MB = 1024 * 1024
+
+
+def current_rss() -> int:
+    """ the resident set size of this process, in bytes (0 if unknown) """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return peak_rss()
+
+
+def peak_rss() -> int:
+    """
+    the peak resident set size of this process (since the last
+    reset_peak_rss, where supported), in bytes (0 if unknown)
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, but bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def reset_peak_rss():
+    """ start measuring peak memory afresh (linux only) """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+class _RecordCollector(logging.Handler):
+    """ keeps a worker's log messages to send back with its results """
+
+    def __init__(self):
+        super().__init__()
+        self.records: list = []
+
+    def emit(self, record):
+        self.records.append((record.levelno, record.getMessage()))
+
+
+def _work(conn: Connection, options: ConversionOptions):
+    """
+    A chapter worker's loop: builds each chapter it's sent (everything but
+    the book-wide duplicate ID check, which the main process does in book
+    order) and sends back its HTML, IDs, log messages and memory use.
+    """
+    collector = _RecordCollector()
+    logger = logging.getLogger(f"jb2htmlbook.chapter_worker.{os.getpid()}")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(collector)
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        index, toc_element = task
+        collector.records = []
+        ctx = ConversionContext(options=options, logger=logger)
+        reset_peak_rss()
+        result: dict = {"index": index, "pid": os.getpid()}
+        try:
+            chapter = build_chapter(toc_element, ctx)
+            result["html"] = str(chapter)
+            result["ids"] = [element['id']
+                             for element in chapter.find_all(id=True)]
+            del chapter
+        except Exception as error:
+            result["error"] = error
+        result["records"] = collector.records
+        result["metrics"] = dict(ctx.metrics)
+        result["peak_rss"] = peak_rss()
+        result["rss"] = current_rss()
+        try:
+            conn.send(result)
+        except Exception:  # e.g., an exception that can't be pickled
+            result["error"] = RuntimeError(
+                f"{type(result['error']).__name__}: {result['error']}")
+            conn.send(result)
+
+
+class _Worker:
+    """ a chapter worker process and the chapter it's working on """
+
+    def __init__(self, options: ConversionOptions):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_work,
+                                               args=(child_conn, options),
+                                               daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.task: Optional[tuple] = None
+        self.chapters = 0
+
+    def send(self, task: tuple):
+        self.task = task
+        self.conn.send(task)
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.conn.close()
+
+
+class ChapterPool:
+    """
+    Builds chapters on a pool of `jobs` worker processes.
+
+    Workers are replaced by fresh ones after `max_chapters` chapters,
+    once their memory use grows past `max_rss` bytes, or after a chapter
+    fails, so memory (or any other state) held on to by earlier chapters
+    doesn't pile up over a long run. A chapter whose peak memory goes over
+    `memory_budget` bytes, or whose worker dies, is flagged and tried once
+    more in a fresh worker.
+    """
+
+    def __init__(self,
+                 options: ConversionOptions,
+                 jobs: int,
+                 max_chapters: Optional[int] = None,
+                 max_rss: Optional[int] = None,
+                 memory_budget: Optional[int] = None,
+                 ctx: Optional[ConversionContext] = None):
+        self.options = options
+        self.jobs = max(jobs, 1)
+        self.max_chapters = max_chapters
+        self.max_rss = max_rss
+        self.memory_budget = memory_budget
+        self.ctx = ctx or ConversionContext()
+        self.workers_started = 0
+
+    def _start_worker(self) -> _Worker:
+        self.workers_started += 1
+        return _Worker(self.options)
+
+    def _replace(self, workers: list, worker: _Worker, reason: str):
+        self.ctx.log.info(f"Recycling chapter worker {worker.process.pid} " +
+                          f"({reason})")
+        worker.stop()
+        fresh = self._start_worker()
+        workers[workers.index(worker)] = fresh
+        return fresh
+
+    def _finished(self, worker: _Worker) -> dict:
+        """ the result of the worker's task, even if the worker died """
+        try:
+            return worker.conn.recv()
+        except (EOFError, OSError):
+            worker.process.join()
+            index, toc_element = worker.task  # type: ignore
+            return {
+                "index": index,
+                "pid": worker.process.pid,
+                "error": RuntimeError(
+                    "Chapter worker exited unexpectedly (exit code " +
+                    f"{worker.process.exitcode}) converting {toc_element}"),
+                "records": [],
+                "metrics": {},
+                "peak_rss": 0,
+                "rss": 0,
+                "died": True,
+            }
+
+    def run(self, toc_elements: list) -> Generator[dict, None, None]:
+        """
+        Builds the chapters, yielding their results in the order given
+        (each with the chapter's "html" and "ids", or an "error"; its log
+        "records"; "peak_rss" in bytes; and any "flags" raised)
+        """
+        pending = deque(enumerate(toc_elements))
+        results: dict = {}
+        retried: set = set()
+        flags: dict = {}
+        next_index = 0
+        workers = [self._start_worker()
+                   for _ in range(min(self.jobs, len(pending)))]
+        try:
+            while next_index < len(toc_elements):
+                for worker in workers:
+                    if worker.task is None and pending:
+                        worker.send(pending.popleft())
+
+                busy = {worker.conn: worker for worker in workers
+                        if worker.task is not None}
+                for conn in wait(list(busy)):
+                    worker = busy[conn]  # type: ignore
+                    task = worker.task
+                    result = self._finished(worker)
+                    worker.task = None
+                    worker.chapters += 1
+                    index = task[0]  # type: ignore
+
+                    retry = None
+                    if result.get("died"):
+                        retry = "worker_died"
+                    elif (
+                            self.memory_budget and
+                            result["peak_rss"] > self.memory_budget
+                         ):
+                        retry = "over_memory_budget"
+                    if retry:
+                        flags.setdefault(index, []).append(retry)
+                        self.ctx.log.warning(
+                            f"Chapter {task[1]} " +  # type: ignore
+                            f"{retry.replace('_', ' ')} " +
+                            f"(peak memory {result['peak_rss'] // MB} MB)")
+
+                    if retry and index not in retried:
+                        retried.add(index)
+                        fresh = self._replace(workers, worker, retry)
+                        fresh.send(task)  # type: ignore
+                        continue
+
+                    result["flags"] = flags.get(index, [])
+                    results[index] = result
+                    if not pending:  # i.e., no more work for a fresh one
+                        continue
+                    if result.get("died"):
+                        self._replace(workers, worker, "worker died")
+                    elif "error" in result:
+                        # whatever the chapter left behind goes with it
+                        self._replace(workers, worker, "chapter failed")
+                    elif (
+                            self.max_chapters and
+                            worker.chapters >= self.max_chapters
+                         ):
+                        self._replace(workers, worker,
+                                      f"{worker.chapters} chapters")
+                    elif self.max_rss and result["rss"] > self.max_rss:
+                        self._replace(workers, worker,
+                                      f"{result['rss'] // MB} MB resident")
+
+                while next_index in results:
+                    yield results.pop(next_index)
+                    next_index += 1
+        finally:
+            for worker in workers:
+                if worker.task is not None:  # i.e., abandoned mid-chapter
+                    worker.process.terminate()
+                worker.stop()
+
+
+def chapter_pool(ctx: ConversionContext) -> Optional[ChapterPool]:
+    """ the chapter worker pool for a run, if it's asked for one """
+    options = ctx.options
+    if options.jobs <= 1:
+        return None
+    return ChapterPool(options,
+                       options.jobs,
+                       max_chapters=options.worker_max_chapters,
+                       max_rss=_megabytes(options.worker_max_rss),
+                       memory_budget=_megabytes(
+                           options.chapter_memory_budget),
+                       ctx=ctx)
+
+
+def _megabytes(value: Optional[Union[int, float]]) -> Optional[int]:
+    return int(value * MB) if value else None
+
+
+class _AllTags(frozenset):
+    """ a set of tag names that has every tag name in it """
+
+    def __contains__(self, name):
+        return True
+
+
+def parse_built_chapter(html: str):
+    """
+    The chapter a worker built, parsed back from its HTML just as it was:
+    html.parser doesn't restructure it, and whitespace is kept in every tag
+    (rather than collapsed), so str() gives back the same HTML
+    """
+    soup = BeautifulSoup(html, "html.parser",
+                         preserve_whitespace_tags=_AllTags())
+    return soup.find(True)
+
+
+def write_chapter(html: str,
+                  toc_element: Union[Path, list],
+                  source_dir: Path,
+                  output_dir: Path) -> str:
+    """ writes a chapter a worker built, returning its relative path """
+    out = chapter_output_path(toc_element, source_dir, output_dir)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(html)
+    return str(out.relative_to(output_dir))
@@ -75,7 +75,7 @@ class TestUpdateAtlas:
         """ Handle a bad path argument gracefully """
         result = update_atlas(Path('does/not/exist.json'), ['a', 'b'], False)
         assert result is None
-        assert "a, b" in capsys.readouterr().out
+        assert "a, b" in capsys.readouterr().err
         assert "atlas.json" in caplog.text
 
     def test_bad_json(self, tmp_path, caplog, capsys):
@@ -88,5 +88,5 @@ class TestUpdateAtlas:
 
         result = update_atlas(test_env / 'atlas.json', ['a', 'b'])
         assert result is None
-        assert "a, b" in capsys.readouterr().out
+        assert "a, b" in capsys.readouterr().err
         assert "atlas.json" in caplog.text
@@ -0,0 +1,176 @@
+import json
+import logging
+import pytest
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typer.testing import CliRunner
+from jupyter_book_to_htmlbook import batch
+from jupyter_book_to_htmlbook.batch import (
+        MANIFEST_OPTIONS,
+        app,
+        convert_books,
+        logger,
+        convert_entry,
+        load_manifest
+    )
+
+runner = CliRunner()
+
+
+@pytest.fixture
+def two_books(tmp_path, monkeypatch: pytest.MonkeyPatch):
+    """ two copies of the example book, with a manifest to convert both """
+    for name in ["book_a", "book_b"]:
+        shutil.copytree('tests/example_book', tmp_path / name)
+    manifest = tmp_path / 'manifest.yml'
+    manifest.write_text("""
+books:
+  - source: book_a
+    target: out_a
+    options:
+      skip_jb_build: true
+  - source: book_b
+    target: out_b
+    options:
+      skip_jb_build: true
+      skip_numbering: true
+""")
+    monkeypatch.chdir(tmp_path)
+    return manifest
+
+
+class TestBatch:
+    """
+    Tests for converting many books in a single invocation
+    """
+
+    def test_load_manifest(self, two_books):
+        """ manifest entries are normalized for conversion """
+        entries = load_manifest(two_books)
+        assert len(entries) == 2
+        assert entries[0]["atlas_json"] is None
+        assert entries[1]["options"] == {"skip_jb_build": True,
+                                         "skip_numbering": True}
+
+    def test_load_manifest_as_list(self, tmp_path):
+        """ a bare (JSON) list of books is also a valid manifest """
+        manifest = tmp_path / 'manifest.json'
+        manifest.write_text(json.dumps([{"source": "a", "target": "b"}]))
+        assert load_manifest(manifest)[0]["source"] == "a"
+
+    @pytest.mark.parametrize(
+            "manifest", [
+                "source: a",
+                "- source: a",
+                "- source: a\n  target: b\n  options:\n    foo: true",
+                ]
+            )
+    def test_load_manifest_malformed(self, tmp_path, manifest):
+        """ malformed manifests shouldn't get as far as conversion """
+        path = tmp_path / 'manifest.yml'
+        path.write_text(manifest)
+        with pytest.raises(ValueError):
+            load_manifest(path)
+
+    def test_convert_entry_logs_per_book(self, two_books):
+        """ each book gets its own log in its target directory """
+        entries = load_manifest(two_books)
+        reports = [convert_entry(entry) for entry in entries]
+        assert [r["status"] for r in reports] == ["ok", "ok"]
+        assert "out_a/notebooks/ch01.html" in reports[0]["files"]
+        log_a = Path('out_a/jb2htmlbook.log').read_text()
+        log_b = Path('out_b/jb2htmlbook.log').read_text()
+        assert "Source: book_a" in log_a
+        assert "Source: book_b" not in log_a
+        assert "Source: book_b" in log_b
+        with open('out_b/notebooks/ch01.html') as f:
+            assert 'In [' not in f.read()
+
+    def test_concurrent_entries_log_per_book(self, two_books):
+        """
+        books converted at the same time in one process log through the one
+        logger, but still only to their own log files
+        """
+        entries = load_manifest(two_books)
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            reports = list(pool.map(convert_entry, entries))
+        assert [r["status"] for r in reports] == ["ok", "ok"]
+        log_a = Path('out_a/jb2htmlbook.log').read_text()
+        log_b = Path('out_b/jb2htmlbook.log').read_text()
+        assert "Source: book_a" in log_a and "Source: book_b" not in log_a
+        assert "Source: book_b" in log_b and "Source: book_a" not in log_b
+        assert not [handler for handler in logger.handlers if getattr(
+                    handler, "baseFilename", "").endswith("jb2htmlbook.log")]
+        assert not [name for name in logging.Logger.manager.loggerDict
+                    if name.startswith("jb2htmlbook.batch.")]
+
+    def test_convert_entry_failure_is_reported(self, tmp_path,
+                                               monkeypatch):
+        """ a failing book is reported, not raised """
+        monkeypatch.chdir(tmp_path)
+        report = convert_entry({"source": "missing",
+                                "target": "out",
+                                "atlas_json": None,
+                                "options": {"skip_jb_build": True}})
+        assert report["status"] == "failed"
+        assert report["error"]
+        assert report["seconds"] >= 0
+
+    def test_convert_books_in_pool(self, two_books):
+        """ reports come back in manifest order from the worker pool """
+        reports = convert_books(load_manifest(two_books), jobs=2)
+        assert [r["target"] for r in reports] == ["out_a", "out_b"]
+        assert all(r["status"] == "ok" for r in reports)
+
+    def test_convert_books_share_a_cache(self, two_books, monkeypatch):
+        """ the books converted in a process share its ConversionCache """
+        caches = []
+
+        def convert(entry, cache=None):
+            caches.append(cache)
+            return convert_entry(entry, cache)
+
+        monkeypatch.setattr(batch, "convert_entry", convert)
+        entries = load_manifest(two_books)
+        convert_books(entries + entries[:1], jobs=1)
+        assert caches[0] is not None
+        assert all(cache is caches[0] for cache in caches)
+        # i.e., the repeated book was found in the cache
+        assert caches[0].stats["chapter_hits"] > 0
+
+        # and the same goes for each worker in the pool
+        monkeypatch.setattr(batch, "_worker_cache", None)
+        batch._init_worker()
+        batch._convert_in_worker(entries[0])
+        assert batch._worker_cache.stats["toc_hits"] == 0
+        batch._convert_in_worker(entries[0])
+        assert batch._worker_cache.stats["toc_hits"] == 1
+
+    def test_manifest_options_documented(self):
+        """ the README's list of manifest options (which --help points to) """
+        readme = Path(__file__).parent.parent / 'README.md'
+        documented = [line for line in readme.read_text().splitlines()
+                      if line.startswith("An entry's `options`")][0]
+        assert all(f"`{option}`" in documented
+                   for option in MANIFEST_OPTIONS)
+        assert "README" in runner.invoke(app, ["--help"]).output
+
+    def test_batch_cli(self, two_books):
+        """ the command prints a report and optionally saves it """
+        result = runner.invoke(app, [str(two_books), '--jobs', '1',
+                                     '--report', 'report.json'])
+        assert result.exit_code == 0
+        assert "2 books, 0 failed" in result.stdout
+        report = json.loads(Path('report.json').read_text())
+        assert report[1]["source"] == "book_b"
+
+    def test_batch_cli_failure_exit_code(self, tmp_path, monkeypatch):
+        """ any failed book means a failed batch """
+        monkeypatch.chdir(tmp_path)
+        manifest = tmp_path / 'manifest.yml'
+        manifest.write_text("- source: missing\n  target: out\n" +
+                            "  options:\n    skip_jb_build: true")
+        result = runner.invoke(app, [str(manifest), '--jobs', '1'])
+        assert result.exit_code == 1
+        assert "1 failed" in result.stdout
@@ -0,0 +1,434 @@
+import json
+import logging
+import pytest
+import re
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+from jupyter_book_to_htmlbook import conversion
+from jupyter_book_to_htmlbook.build import (
+        BuildCache,
+        _toc_file_stubs,
+        build_cache_key,
+        build_fingerprint,
+        build_inputs,
+        changed_build_inputs,
+        needs_build,
+        save_build_fingerprint,
+        split_build_config,
+        split_toc
+    )
+from jupyter_book_to_htmlbook.conversion import (
+        ConversionOptions,
+        convert_book,
+        run_split_jupyter_book
+    )
+from yaml import safe_load  # type: ignore
+
+
+class TestBuildFreshness:
+    """
+    Tests for deciding whether `jupyter-book build` needs to run
+    """
+
+    def test_build_inputs(self, example_book):
+        inputs = build_inputs(example_book)
+        assert inputs[:3] == ['_toc.yml', '_config.yml', 'references.bib']
+        # toc files without an extension could be any source type
+        assert 'intro.md' in inputs
+        assert 'notebooks/ch02.01.ipynb' in inputs
+        assert 'bibliography.md' in inputs
+
+    def test_changed_inputs(self, example_book):
+        assert changed_build_inputs(example_book) is None  # no record
+        save_build_fingerprint(example_book, build_fingerprint(example_book))
+        assert changed_build_inputs(example_book) == []
+        assert not needs_build(example_book)
+
+        (example_book / 'intro.md').write_text("# Changed")
+        (example_book / 'notebooks').mkdir(exist_ok=True)
+        (example_book / 'notebooks/ch01.ipynb').write_text("{}")  # new
+        assert changed_build_inputs(example_book) == [
+                'intro.md', 'notebooks/ch01.ipynb']
+        assert needs_build(example_book)
+
+    def test_missing_build_output(self, example_book):
+        save_build_fingerprint(example_book, build_fingerprint(example_book))
+        shutil.rmtree(example_book / '_build/html')
+        assert needs_build(example_book)
+
+    def test_auto_jb_build(self, example_book, monkeypatch):
+        """ jupyter-book only runs when something changed """
+        builds = []
+
+        def run_jupyter_book(source, ctx=None):
+            builds.append(source)
+            return subprocess.CompletedProcess([], 0)
+
+        monkeypatch.setattr(conversion, "run_jupyter_book", run_jupyter_book)
+        options = ConversionOptions(auto_jb_build=True)
+        convert_book(example_book, 'build', options)
+        convert_book(example_book, 'build', options)
+        assert len(builds) == 1
+
+        (example_book / '_config.yml').write_text(
+                (example_book / '_config.yml').read_text() + "\n# edit\n")
+        events: list = []
+        convert_book(example_book, 'build', options, events=events.append)
+        assert len(builds) == 2
+        assert "jb_build_started" in [event["event"] for event in events]
+
+    def test_target_in_source(self, example_book, monkeypatch):
+        """ the conversion's own output doesn't count as a change """
+        builds = []
+
+        def run_jupyter_book(source, ctx=None):
+            builds.append(source)
+            return subprocess.CompletedProcess([], 0)
+
+        monkeypatch.setattr(conversion, "run_jupyter_book", run_jupyter_book)
+        options = ConversionOptions(auto_jb_build=True)
+        target = example_book.name + '/out'
+        convert_book(example_book, target, options)
+        (example_book / 'out/jb2htmlbook.log').write_text("a run")
+        convert_book(example_book, target, options)
+        assert len(builds) == 1
+        assert not [path for path in build_fingerprint(
+                        example_book, (example_book / 'out',))
+                    if path.startswith('out/')]
+
+    def test_failed_build_not_recorded(self, example_book, monkeypatch):
+        monkeypatch.setattr(
+            conversion, "run_jupyter_book",
+            lambda source, ctx=None: subprocess.CompletedProcess([], 1))
+        convert_book(example_book, 'build', ConversionOptions())
+        assert changed_build_inputs(example_book) is None
+
+
+class TestBuildCache:
+    """
+    Tests for the shared cache of jupyter-book builds
+    """
+
+    def test_store_and_restore(self, example_book, tmp_path):
+        cache = BuildCache(tmp_path / 'cache')
+        key = build_cache_key(build_fingerprint(example_book))
+        assert not cache.restore(key, example_book)
+        cache.store(key, example_book)
+
+        other = tmp_path / 'other'
+        shutil.copytree(example_book, other)
+        shutil.rmtree(other / '_build/html')
+        # same sources, so same key, wherever the checkout is
+        assert build_cache_key(build_fingerprint(other)) == key
+        assert cache.restore(key, other)
+        assert (other / '_build/html/notebooks/ch01.html').read_text() == \
+            (example_book / '_build/html/notebooks/ch01.html').read_text()
+        assert cache.stats == {"misses": 1, "stores": 1, "hits": 1}
+        # running totals are only written when saved, and only added once
+        assert not (tmp_path / 'cache/stats.json').exists()
+        cache.save_stats()
+        cache.save_stats()
+        with open(tmp_path / 'cache/stats.json') as f:
+            assert json.load(f) == {"misses": 1, "stores": 1, "hits": 1}
+        assert not cache.restore('missing', other)
+        cache.save_stats()
+        with open(tmp_path / 'cache/stats.json') as f:
+            assert json.load(f) == {"misses": 2, "stores": 1, "hits": 1}
+
+    def test_restore_of_evicted_entry(self, example_book, tmp_path,
+                                      monkeypatch):
+        """
+        an entry evicted while it's being restored is a miss, and leaves the
+        book's build as it was
+        """
+        cache = BuildCache(tmp_path / 'cache')
+        cache.store('aa1', example_book)
+        ch01 = example_book / '_build/html/notebooks/ch01.html'
+        ch01.write_text("the current build")
+
+        copytree = shutil.copytree
+
+        def evicting_copytree(src, dst, *args, **kwargs):
+            # the entry's evicted as the first files are copied
+            monkeypatch.setattr(shutil, "copytree", copytree)
+            cache.max_bytes = 0
+            cache.evict()
+            return copytree(src, dst, *args, **kwargs)
+
+        monkeypatch.setattr(shutil, "copytree", evicting_copytree)
+        assert not cache.restore('aa1', example_book)
+        assert cache.stats["misses"] == 1
+        assert ch01.read_text() == "the current build"
+        assert [path.name for path in (example_book / '_build').iterdir()
+                if path.name.startswith('tmp')] == []
+        assert cache.entries() == []
+
+    def test_new_source_files_change_key(self, example_book):
+        """ files the toc doesn't name (e.g., images) are inputs too """
+        key = build_cache_key(build_fingerprint(example_book))
+        (example_book / 'notebooks/figure.png').write_bytes(b"png")
+        assert build_cache_key(build_fingerprint(example_book)) != key
+        new_key = build_cache_key(build_fingerprint(example_book))
+        # but not anything in the build, or hidden files
+        (example_book / '_build/extra.txt').write_text("built")
+        (example_book / '.git').mkdir()
+        (example_book / '.git/HEAD').write_text("ref")
+        assert build_cache_key(build_fingerprint(example_book)) == new_key
+
+    def test_key_changes_with_sources(self, example_book):
+        key = build_cache_key(build_fingerprint(example_book))
+        (example_book / 'intro.md').write_text("# Changed")
+        assert build_cache_key(build_fingerprint(example_book)) != key
+
+    def test_evicts_least_recently_used(self, example_book, tmp_path):
+        cache = BuildCache(tmp_path / 'cache')
+        for key in ['aa1', 'bb2', 'cc3']:
+            cache.store(key, example_book)
+            time.sleep(0.01)
+        assert cache.restore('aa1', example_book)  # now bb2 is the oldest
+        size = cache.entries()[0][1]
+        cache.max_bytes = 2 * size
+        cache.evict()
+        assert cache.stats["evictions"] == 1
+        assert not cache.restore('bb2', example_book)
+        assert cache.restore('cc3', example_book)
+
+    def test_conversion_restores(self, example_book, tmp_path, monkeypatch):
+        builds = []
+
+        def run_jupyter_book(source, ctx=None):
+            builds.append(source)
+            return subprocess.CompletedProcess([], 0)
+
+        monkeypatch.setattr(conversion, "run_jupyter_book", run_jupyter_book)
+        options = ConversionOptions(build_cache=str(tmp_path / 'cache'))
+        first = convert_book(example_book, 'build', options)
+        assert first.metrics["build_cache_misses"] == 1
+
+        other = tmp_path / 'other'
+        shutil.copytree(example_book, other)
+        shutil.rmtree(other / '_build')
+        second = convert_book(other, 'build2', options)
+        assert len(builds) == 1
+        assert second.metrics["build_cache_hits"] == 1
+        assert second.files == [file.replace('build/', 'build2/', 1)
+                                for file in first.files]
+
+
+EXAMPLE_BUILD = Path('tests/example_book/_build/html').resolve()
+
+
+class FakeBuild:
+    """ a finished split build """
+    stopped = None
+
+    def __init__(self, returncode):
+        self.returncode = returncode
+
+    def poll(self):
+        return self.returncode
+
+    def finish(self):
+        return self.returncode
+
+
+def fake_split_build(source, build_dir):
+    """
+    "builds" the files in the split's table of contents by copying them from
+    the example book's existing build
+    """
+    with open(build_dir / '_toc.yml') as f:
+        toc = safe_load(f)
+    built = EXAMPLE_BUILD
+    html_dir = build_dir / '_build/html'
+    for stub in _toc_file_stubs(toc):
+        (html_dir / stub).parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy(built / f'{stub}.html', html_dir / f'{stub}.html')
+    shutil.copytree(built / '_images', html_dir / '_images',
+                    dirs_exist_ok=True)
+    return FakeBuild(0)
+
+
+class TestSplitBuild:
+    """
+    Tests for running jupyter-book as concurrent builds of the book's parts
+    """
+
+    def test_split_toc(self, example_book):
+        with open(example_book / '_toc.yml') as f:
+            toc = safe_load(f)
+        halves = split_toc(toc, 2)
+        assert [[part["caption"] for part in half["parts"]]
+                for half in halves] == [["A First Part", "A second"],
+                                        ["Code", "References"]]
+        assert all(half["root"] == "intro" for half in halves)
+        # no more splits than parts
+        assert len(split_toc(toc, 10)) == 4
+        assert split_toc(toc, 1) == [toc]
+
+        chapters = {"format": "jb-book", "root": "intro",
+                    "chapters": [{"file": "a"}, {"file": "b"},
+                                 {"file": "c"}]}
+        assert [split["chapters"] for split in split_toc(chapters, 3)] == \
+            [[{"file": "a"}], [{"file": "b"}], [{"file": "c"}]]
+
+    def test_split_build_config(self, example_book):
+        config = split_build_config(example_book, 'cache')
+        assert config["only_build_toc_files"]
+        assert config["execute"] == {"execute_notebooks": False,
+                                     "cache": str(Path('cache').resolve())}
+        # since the config is read from the split's build directory
+        assert config["bibtex_bibfiles"] == \
+            [str((example_book / "references.bib").resolve())]
+
+    def test_split_build_config_paths(self, example_book):
+        """ only relative paths of the book's own files are made absolute """
+        with open(example_book / '_config.yml', 'a') as f:
+            f.write("""
+    html_static_path: ["_static", "missing"]
+html:
+  favicon: images/favicon.ico
+  extra_footer: <p>Footer</p>
+""")
+        (example_book / '_static').mkdir()
+        (example_book / 'images').mkdir(exist_ok=True)
+        (example_book / 'images/favicon.ico').touch()
+        config = split_build_config(example_book, 'cache')
+        assert config["sphinx"]["config"]["html_static_path"] == \
+            [str((example_book / "_static").resolve()), "missing"]
+        assert config["html"] == {
+            "favicon": str((example_book / "images/favicon.ico").resolve()),
+            "extra_footer": "<p>Footer</p>"}
+
+    def test_merged_build(self, example_book, monkeypatch):
+        """ the merged build is converted just like a single build """
+        expected = convert_book(example_book, 'expected',
+                                ConversionOptions(skip_jb_build=True))
+        shutil.rmtree(example_book / '_build/html')
+
+        builds = []
+
+        def start(source, build_dir, ctx):
+            builds.append(build_dir)
+            return fake_split_build(source, build_dir)
+
+        monkeypatch.setattr(conversion, "_start_jupyter_book", start)
+        result = convert_book(example_book, 'split',
+                              ConversionOptions(split_jb_build=3))
+        assert len(builds) == 3
+        assert not builds[0].exists()  # i.e., cleaned up
+        assert [file.replace('split/', '') for file in result.files] == \
+            [file.replace('expected/', '') for file in expected.files]
+        for file in expected.files:
+            assert re.sub(r'_[0-9]+"', '"', Path(file).read_text()) == \
+                re.sub(r'_[0-9]+"', '"',
+                       Path(file.replace('expected/', 'split/')).read_text())
+        # it was a successful build
+        assert changed_build_inputs(example_book) == []
+
+    def test_failed_split(self, example_book, monkeypatch):
+        def start(source, build_dir, ctx):
+            fake_split_build(source, build_dir)
+            return FakeBuild(2 if build_dir.name == 'split-2' else 0)
+
+        previous = example_book / '_build/html/previous.html'
+        previous.touch()
+        monkeypatch.setattr(conversion, "_start_jupyter_book", start)
+        completed = run_split_jupyter_book(example_book, 2)
+        assert completed.returncode == 2
+        # the previous build is kept as it was
+        assert previous.exists()
+        assert not list((example_book / '_build').glob('jb2htmlbook-split-*'))
+
+    def test_split_caches(self, example_book, monkeypatch):
+        """ each build uses its own copy of the book's jupyter-cache """
+        config = (example_book / '_config.yml').read_text()
+        (example_book / '_config.yml').write_text(config.replace(
+                "execute_notebooks: false", "execute_notebooks: cache"))
+        (example_book / '_build/.jupyter_cache').mkdir(parents=True)
+        (example_book / '_build/.jupyter_cache/global.db').write_text("db")
+
+        caches = []
+
+        def start(source, build_dir, ctx):
+            with open(build_dir / '_config.yml') as f:
+                cache = Path(safe_load(f)["execute"]["cache"])
+            caches.append(cache)
+            assert (cache / 'global.db').read_text() == "db"
+            return fake_split_build(source, build_dir)
+
+        monkeypatch.setattr(conversion, "_start_jupyter_book", start)
+        completed = run_split_jupyter_book(example_book, 2)
+        assert completed.returncode == 0
+        assert len(set(caches)) == 2
+
+
+def fake_jupyter_book(output):
+    """ a jupyter-book command that writes `output` (then keeps running) """
+    script = f"import time; print({output!r}, flush=True); time.sleep(30)"
+    return lambda source, *options: [sys.executable, '-c', script]
+
+
+class TestJupyterBookRun:
+    """
+    Tests for running jupyter-book and following its output
+    """
+
+    def test_output_forwarded(self, example_book, monkeypatch, caplog):
+        caplog.set_level(logging.DEBUG)
+        output = "\n".join([
+            "Running Sphinx v5.0.2",
+            "Executing: ch01 in: /book/notebooks",
+            "/book/intro.md:3: WARNING: undefined label: 'nope'",
+            "/book/intro.md:9: ERROR: Unknown directive type 'nope'.",
+            "reading sources... [ 50%] notebooks/ERROR_handling",
+            "writing output... [ 90%] WARNING signs",
+        ])
+        monkeypatch.setattr(
+                conversion, "jupyter_book_command",
+                lambda source, *options: [sys.executable, '-c',
+                                          f"print({output!r})"])
+        result = convert_book(example_book, 'build', ConversionOptions())
+        levels = {record.getMessage(): record.levelname
+                  for record in caplog.records
+                  if record.getMessage().startswith("jupyter-book: ")}
+        assert levels == {
+            "jupyter-book: Running Sphinx v5.0.2": "DEBUG",
+            "jupyter-book: Executing: ch01 in: /book/notebooks": "INFO",
+            "jupyter-book: /book/intro.md:3: WARNING: undefined label: " +
+            "'nope'": "WARNING",
+            "jupyter-book: /book/intro.md:9: ERROR: Unknown directive " +
+            "type 'nope'.": "ERROR",
+            # only Sphinx messages' levels count
+            "jupyter-book: reading sources... [ 50%] " +
+            "notebooks/ERROR_handling": "DEBUG",
+            "jupyter-book: writing output... [ 90%] WARNING signs": "DEBUG",
+        }
+        assert result.metrics["jb_warnings"] == 1
+        assert result.metrics["jb_errors"] == 1
+        assert changed_build_inputs(example_book) == []  # i.e., exit code 0
+
+    def test_fail_fast(self, example_book, monkeypatch):
+        monkeypatch.setattr(
+                conversion, "jupyter_book_command",
+                fake_jupyter_book("ERROR: Execution Failed with traces " +
+                                  "saved in /book/_build/html/reports"))
+        start = time.monotonic()
+        with pytest.raises(RuntimeError, match="a notebook failed"):
+            convert_book(example_book, 'build',
+                         ConversionOptions(jb_fail_fast=True))
+        assert time.monotonic() - start < 10
+
+    def test_timeout(self, example_book, monkeypatch):
+        monkeypatch.setattr(conversion, "jupyter_book_command",
+                            fake_jupyter_book("Running Sphinx v5.0.2"))
+        events: list = []
+        with pytest.raises(RuntimeError, match="after 1 seconds"):
+            convert_book(example_book, 'build',
+                         ConversionOptions(jb_timeout=1),
+                         events=events.append)
+        assert events[-1]["status"] == "failed"
+        assert changed_build_inputs(example_book) is None
@@ -0,0 +1,123 @@
+import multiprocessing
+import os
+import pytest
+import shutil
+import sys
+import time
+from jupyter_book_to_htmlbook import build_worker
+from jupyter_book_to_htmlbook.build import wait_for_builds
+from jupyter_book_to_htmlbook.build_worker import (
+        WarmJupyterBookRun,
+        stop_build_workers
+    )
+from jupyter_book_to_htmlbook.context import (
+        ConversionContext,
+        ConversionOptions
+    )
+from jupyter_book_to_htmlbook.conversion import convert_book
+
+
+def fake_run_build(args: list) -> int:
+    """ "builds" the book in this process, printing what it was asked """
+    print(f"Running Sphinx on {args[0]}")
+    print(f"pid {os.getpid()}", file=sys.stderr)
+    if "--fail" in args:
+        return 2
+    if "--crash" in args:
+        os._exit(3)
+    if "--leak" in args:
+        # what a book's conf.py might do
+        directory = args[args.index("--leak") + 1]
+        sys.path.insert(0, directory)
+        os.environ["JB2HTMLBOOK_LEAK"] = "1"
+        __import__("book_extension")
+    print(f"state {os.environ.get('JB2HTMLBOOK_LEAK')} " +
+          f"{'book_extension' in sys.modules} {len(sys.path)}")
+    if "--hang" in args:
+        print("ERROR: Execution Failed with traces saved in /book/reports",
+              flush=True)
+        time.sleep(30)
+    return 0
+
+
+@pytest.fixture
+def fake_builds(monkeypatch):
+    """ build workers "build" with fake_run_build """
+    monkeypatch.setattr(build_worker, "run_build", fake_run_build)
+    # so the workers have the fake, whatever the default start method
+    monkeypatch.setattr(build_worker, "_context",
+                        multiprocessing.get_context("fork"))
+    stop_build_workers()
+    yield
+    stop_build_workers()
+
+
+def build(*args, ctx=None):
+    ctx = ctx or ConversionContext()
+    run = WarmJupyterBookRun(['jupyter-book', 'build', 'book', *args], ctx)
+    return run, wait_for_builds([run], ctx=ctx)[0]
+
+
+def pid_logged(caplog) -> str:
+    return [record.getMessage() for record in caplog.records
+            if "pid" in record.getMessage()][-1]
+
+
+class TestBuildWorker:
+    """
+    Tests for running jupyter-book builds on warm worker processes
+    """
+
+    def test_output_and_exit_code(self, fake_builds, caplog):
+        caplog.set_level("DEBUG")
+        run, returncode = build('--fail')
+        assert returncode == 2
+        assert "jupyter-book: Running Sphinx on book" in caplog.text
+
+    def test_worker_reused(self, fake_builds, caplog):
+        caplog.set_level("DEBUG")
+        build()
+        first = pid_logged(caplog)
+        build()
+        assert pid_logged(caplog) == first
+        assert pid_logged(caplog) != f"jupyter-book: pid {os.getpid()}"
+
+    def test_worker_replaced(self, fake_builds, caplog):
+        caplog.set_level("DEBUG")
+        run, returncode = build('--crash')
+        assert returncode == 3
+        crashed = pid_logged(caplog)
+        build()
+        assert pid_logged(caplog) != crashed
+
+    def test_builds_isolated(self, fake_builds, tmp_path, caplog):
+        """ one build's sys.path, environment and modules don't leak """
+        (tmp_path / 'book_extension.py').write_text("")
+        caplog.set_level("DEBUG")
+        build()
+        clean = [record.getMessage() for record in caplog.records
+                 if "state" in record.getMessage()]
+        build('--leak', str(tmp_path))
+        build()
+        states = [record.getMessage() for record in caplog.records
+                  if "state" in record.getMessage()]
+        assert states[1].startswith("jupyter-book: state 1 True")
+        assert states[2] == clean[0]
+
+    def test_fail_fast(self, fake_builds):
+        ctx = ConversionContext(options=ConversionOptions(jb_fail_fast=True))
+        start = time.monotonic()
+        with pytest.raises(RuntimeError, match="a notebook failed"):
+            build('--hang', ctx=ctx)
+        assert time.monotonic() - start < 10
+        assert not build_worker._idle  # i.e., the stopped worker isn't kept
+
+    def test_conversion(self, fake_builds, tmp_path, monkeypatch, caplog):
+        shutil.copytree('tests/example_book', tmp_path / 'book')
+        monkeypatch.chdir(tmp_path)
+        caplog.set_level("DEBUG")
+        result = convert_book('book', 'build',
+                              ConversionOptions(jb_in_process=True))
+        assert "jupyter-book: Running Sphinx on book" in caplog.text
+        assert "jupyter-book exited with code 0" in caplog.text
+        assert result.files
@@ -0,0 +1,72 @@
+import os
+from jupyter_book_to_htmlbook.cache import ConversionCache, file_digest
+
+
+class TestConversionCache:
+    """
+    Tests for the caches kept warm between conversions
+    """
+
+    def test_file_digest(self, tmp_path):
+        (tmp_path / 'a.html').write_text("a")
+        (tmp_path / 'b.html').write_text("b")
+        digest = file_digest([tmp_path / 'a.html', tmp_path / 'b.html'])
+        assert digest == file_digest([tmp_path / 'a.html',
+                                      tmp_path / 'b.html'])
+        assert digest != file_digest([tmp_path / 'b.html',
+                                      tmp_path / 'a.html'])
+
+    def test_book_toc_is_cached_until_changed(self, tmp_path):
+        toc_file = tmp_path / '_toc.yml'
+        toc_file.write_text("format: jb-book\nroot: intro\n" +
+                            "chapters:\n- file: ch01\n")
+        cache = ConversionCache()
+        first = cache.book_toc(tmp_path)
+        first.pop()  # callers get their own copy
+        assert cache.book_toc(tmp_path) == [
+                tmp_path / '_build/html/intro.html',
+                tmp_path / '_build/html/ch01.html']
+        assert cache.stats["toc_hits"] == 1
+
+        toc_file.write_text("format: jb-book\nroot: intro\n" +
+                            "chapters:\n- file: ch01\n- file: ch02\n")
+        assert len(cache.book_toc(tmp_path)) == 3
+        assert cache.stats["toc_misses"] == 2
+
+    def test_chapter_fingerprints(self, tmp_path):
+        chapter = tmp_path / 'ch01.html'
+        chapter.write_text("<section></section>")
+        cache = ConversionCache()
+        fingerprint = cache.chapter_fingerprint(chapter, ["a"], False)
+        assert fingerprint == cache.chapter_fingerprint(chapter, ["a"],
+                                                        False)
+        # ids from earlier chapters and settings matter
+        assert fingerprint != cache.chapter_fingerprint(chapter, ["b"],
+                                                        False)
+        assert fingerprint != cache.chapter_fingerprint(chapter, ["a"],
+                                                        True)
+        chapter.write_text("<section>changed</section>")
+        assert fingerprint != cache.chapter_fingerprint(chapter, ["a"],
+                                                        False)
+
+    def test_cached_chapter_requires_untouched_output(self, tmp_path):
+        chapter = tmp_path / 'ch01.html'
+        chapter.write_text("<section></section>")
+        out_dir = tmp_path / 'out'
+        out_dir.mkdir()
+        (out_dir / 'ch01.html').write_text("converted")
+        cache = ConversionCache()
+        fingerprint = cache.chapter_fingerprint(chapter, [], False)
+
+        assert cache.cached_chapter(out_dir, chapter, fingerprint) is None
+        cache.store_chapter(out_dir, chapter, fingerprint, 'ch01.html',
+                            ['id1'])
+        assert cache.cached_chapter(out_dir, chapter, fingerprint) == \
+            ('ch01.html', ['id1'])
+        assert cache.cached_chapter(out_dir, chapter, "other") is None
+
+        (out_dir / 'ch01.html').write_text("edited by hand")
+        os.utime(out_dir / 'ch01.html', ns=(1, 1))
+        assert cache.cached_chapter(out_dir, chapter, fingerprint) is None
+        (out_dir / 'ch01.html').unlink()
+        assert cache.cached_chapter(out_dir, chapter, fingerprint) is None
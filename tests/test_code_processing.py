@@ -2,15 +2,20 @@ import logging
 import pytest
 import re
 import shutil
+import time
 from bs4 import BeautifulSoup  # type: ignore
+from jupyter_book_to_htmlbook import code_processing
 from jupyter_book_to_htmlbook.code_processing import (
+        CodeBlock,
         pre_spans_to_code_tags,
         process_code,
         process_inline_code,
         number_codeblock,
         process_code_examples
     )
+from jupyter_book_to_htmlbook.context import ConversionContext
 from jupyter_book_to_htmlbook.file_processing import process_chapter
+from jupyter_book_to_htmlbook.sanitize_processing import sanitize_chapter
 from pathlib import Path
 
 
@@ -166,8 +171,9 @@ class TestCodeProcessing:
 
         NOTE: The classless spans don't seem to affect the Atlas highlighter,
         so best to leave them in to avoid accidentally removing information.
+        (The classes themselves go with the rest in sanitize_chapter.)
         """
-        result = process_code(code_example_python)
+        result = sanitize_chapter(process_code(code_example_python))
         assert not re.search(r'<span class="[a-z]{1,2}"', str(result))
 
     def test_numbering_in_process_code(self, code_example_python):
@@ -316,6 +322,109 @@ class TestNumbering:
         postprocess_indentations = re.findall(r'(\n\s*)', str(in_pre))
         assert postprocess_indentations == expected_indentations
 
+    @pytest.mark.slow
+    def test_numbering_scales_linearly(self):
+        """
+        Numbering a long output cell (e.g., a training log, with a span for
+        each line) should take time in proportion to its length, so that a
+        100,000 line cell takes nowhere near 100 times as long as a 10,000
+        line one
+        """
+        def output_cell(lines):
+            log = "".join(f'<span class="ansi-green-fg">epoch {line}</span>' +
+                          f' loss 0.{line}\n' for line in range(lines))
+            return BeautifulSoup(
+                '<div class="cell docutils container">' +
+                '<div class="cell_output docutils container">' +
+                '<div class="output stream"><div class="highlight">' +
+                f'<pre><span></span>{log}</pre></div></div></div></div>',
+                "lxml")  # i.e., as chapters are parsed
+
+        def seconds(lines):
+            chapter = output_cell(lines)
+            start = time.perf_counter()
+            process_code(chapter)
+            elapsed = time.perf_counter() - start
+            pre = chapter.find("pre")
+            assert str(pre).startswith(
+                '<pre data-type="programlisting">Out[0]: <span>epoch 0')
+            assert pre.get_text().count("\n        epoch") == lines - 1
+            return elapsed
+
+        short = min(seconds(10_000) for _ in range(3))
+        long = seconds(100_000)
+        # i.e., 10x the lines, so ~10x the time (quadratic would be ~100x)
+        assert long < short * 30
+
+
+class TestCodeBlock:
+    """
+    Tests for the snapshot of a <pre> block's spans that the code passes share
+    """
+
+    def test_r_magic_and_header(self, code_example_r,
+                                code_example_data_type):
+        r_block = CodeBlock(code_example_r.find("pre"))
+        assert r_block.starts_with_r_magic()
+        assert r_block.header_comments() is None
+
+        python_block = CodeBlock(code_example_data_type.find("pre"))
+        assert not python_block.starts_with_r_magic()
+        comments = python_block.header_comments()
+        assert [comment.string for comment in comments] == \
+            ["# hello", "# An example example title"]
+
+    def test_strip_spans(self, code_example_r):
+        """
+        Classes and empty spans are removed in the same walk that finds the
+        rpy2 flags
+        """
+        pre = code_example_r.find("pre")
+        r_flags = CodeBlock(pre).strip_spans()
+        assert [span.string for span in r_flags.values()] == ["%%", "R"]
+        assert str(pre) == \
+            "<pre><span>%%</span><span>R</span>\n## R\n5^8\n</pre>"
+
+    def test_spans_to_code(self, code_example_data_type):
+        pre = code_example_data_type.find("pre")
+        CodeBlock(pre).spans_to_code()
+        assert not pre.find("span")
+        assert pre.find("code", class_="c1")
+
+    def test_example_with_too_few_spans(self, caplog):
+        """
+        A block too short to have an R header is reported as a malformed
+        example rather than breaking the conversion
+        """
+        chapter = BeautifulSoup("""<div class="cell tag_example">
+<div class="highlight"><pre><span></span>print("hi")
+</pre></div></div>""", "html.parser")
+        process_code_examples(chapter)
+        assert "Missing first two line comments" in caplog.text
+        assert not chapter.find(attrs={"data-type": "example"})
+
+    def test_shared_with_process_code(self, code_example_data_type,
+                                      monkeypatch):
+        """
+        process_code uses the blocks process_code_examples gathered (less
+        the header comments it removed), rather than gathering them again
+        """
+        gathered = []
+        init = CodeBlock.__init__
+
+        def counting_init(self, pre):
+            gathered.append(pre)
+            init(self, pre)
+
+        monkeypatch.setattr(code_processing.CodeBlock, "__init__",
+                            counting_init)
+        ctx = ConversionContext()
+        process_code_examples(code_example_data_type, ctx)
+        process_code(code_example_data_type, ctx=ctx)
+        assert len(gathered) == 1
+        assert ctx.code_blocks == {}
+        assert "# hello" not in str(code_example_data_type)
+
 
 class TestCodeExamples:
     """
@@ -468,7 +577,7 @@ class TestCodeExamples:
         with open(test_out / 'code_py.html') as f:
             soup = BeautifulSoup(f.read(), "html.parser")
 
-        examples = soup.find_all("div", class_="tag_example")
+        examples = soup.find_all("div", attrs={"data-type": "example"})
         assert len(examples) == 2
         for example_div in examples:
             assert example_div["data-type"] == "example"
@@ -529,12 +638,41 @@ class TestCodeExamples:
         with open(test_out / 'code_r.html') as f:
             soup = BeautifulSoup(f.read(), "html.parser")
 
-        examples = soup.find_all("div", class_="tag_example")
+        examples = soup.find_all("div", attrs={"data-type": "example"})
         assert len(examples) == 1
         assert examples[0]["data-type"] == "example"
         assert examples[0].find("h5")
         assert examples[0].find("pre")["data-code-language"] == "r"
 
+    def test_malformed_example_before_others(self, code_example_data_type,
+                                             caplog):
+        """ a malformed example doesn't stop the examples after it """
+        chapter = BeautifulSoup("""<section>
+<div class="cell tag_example"><div class="highlight"><pre><span></span>\
+print("no header")</pre></div></div>""" + str(code_example_data_type) +
+                                "</section>", "html.parser")
+        process_code_examples(chapter)
+        assert "Missing first two line comments" in caplog.text
+        assert chapter.find("div", id="hello")["data-type"] == "example"
+
+    def test_example_in_r_with_whitespace(self):
+        """
+        The R code is read from after the `R` flag, wherever that is in the
+        block
+        """
+        chapter = BeautifulSoup("""<div class="cell tag_example">
+<div class="highlight"><pre><span></span>
+<span class="o">%%</span><span class="k">R</span>
+# example_r
+# A formal R example
+## R
+5^8
+</pre></div></div>""", "html.parser")
+        process_code_examples(chapter)
+        example = chapter.find("div", id="example_r")
+        assert example.h5.string == "A formal R example"
+        assert "# example_r" not in str(example.pre)
+
     def test_examples_malformed_r(self, caplog):
         """
         What do we do if an example R block doesn't have the correct
@@ -0,0 +1,96 @@
+import logging
+import pytest
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from random import Random
+from bs4 import BeautifulSoup  # type: ignore
+from jupyter_book_to_htmlbook.context import (
+        ConversionContext,
+        ConversionOptions
+    )
+from jupyter_book_to_htmlbook.conversion import convert_book
+from jupyter_book_to_htmlbook.file_processing import process_chapter
+from jupyter_book_to_htmlbook.reference_processing import process_ids
+
+
+class TestConversionContext:
+    """
+    Tests for keeping conversion state in a per-run context
+    """
+
+    def test_warnings_are_kept_per_context(self, caplog):
+        """ warnings go to the run's logger and its own warning list """
+        caplog.set_level(logging.DEBUG)
+        ctx = ConversionContext(logger=logging.getLogger("run"))
+        other = ConversionContext()
+        ctx.log.info("just info")
+        ctx.log.warning("Something %s", "odd")
+        assert ctx.warnings == ["Something odd"]
+        assert other.warnings == []
+        assert any(r.name == "run" and r.getMessage() == "Something odd"
+                   for r in caplog.records)
+
+    def test_id_registry(self):
+        """ process_ids checks against (only) the context's registry """
+        chapter = BeautifulSoup('<h1 id="foo">Hello</h1>', "html.parser")
+        ctx = ConversionContext(book_ids=["foo"], random=Random(1))
+        _, ids = process_ids(chapter, ctx=ctx)
+        assert ids[0] == f"foo_{Random(1).randint(1, 123456789)}"
+        assert ctx.metrics["duplicate_ids"] == 1
+
+        # no state leaks between calls without a context
+        fresh = BeautifulSoup('<h1 id="bar">Hello</h1>', "html.parser")
+        assert process_ids(fresh)[1] == ["bar"]
+        assert process_ids(fresh)[1] == ["bar"]
+
+    def test_seeded_runs_are_reproducible(self):
+        """ with our own random generators, duplicate IDs are repeatable """
+        first, second = [
+            process_ids(BeautifulSoup('<p id="a"></p>', "html.parser"),
+                        ctx=ConversionContext(book_ids=["a"],
+                                              random=Random(7)))[1]
+            for _ in range(2)]
+        assert first == second
+
+    def test_concurrent_conversions(self, tmp_path, monkeypatch):
+        """
+        several conversions can run at once in the same interpreter without
+        sharing IDs, warnings or log messages
+        """
+        shutil.copytree('tests/example_book', tmp_path / 'book')
+        monkeypatch.chdir(tmp_path)
+        options = ConversionOptions(skip_jb_build=True)
+        expected = convert_book(tmp_path / 'book', 'serial', options)
+
+        def convert(number):
+            logger = logging.getLogger(f"concurrent.{number}")
+            return convert_book(tmp_path / 'book', f'out_{number}',
+                                options, logger)
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(convert, range(4)))
+
+        for number, result in enumerate(results):
+            assert result.warnings == expected.warnings
+            assert result.metrics == expected.metrics
+            assert [len(ids) for ids in result.ids.values()] == \
+                [len(ids) for ids in expected.ids.values()]
+            assert result.files == [
+                    file.replace('serial/', f'out_{number}/')
+                    for file in expected.files]
+            assert Path(f'out_{number}/notebooks/ch01.html').read_text() == \
+                Path('serial/notebooks/ch01.html').read_text()
+
+    @pytest.mark.parametrize("option", ["skip_cell_numbering",
+                                        "keep_highlighting"])
+    def test_context_options_are_used(self, tmp_book_path, option):
+        """ process_chapter takes its options from the context """
+        out = tmp_book_path / 'out'
+        out.mkdir()
+        ctx = ConversionContext(
+                options=ConversionOptions(**{option: True}))
+        process_chapter(tmp_book_path / 'notebooks/code_py.html',
+                        tmp_book_path, out, ctx=ctx)
+        text = (out / 'notebooks/code_py.html').read_text()
+        assert 'In [' not in text
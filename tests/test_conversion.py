@@ -0,0 +1,160 @@
+import json
+import logging
+import pytest
+from jupyter_book_to_htmlbook.conversion import (
+        FAILURES_FILE,
+        ConversionOptions,
+        ConversionResult,
+        convert_book
+    )
+from jupyter_book_to_htmlbook.toc_processing import TocError
+
+
+class TestConvertBook:
+    """
+    Tests for the importable library API (the CLI is tested in test_main)
+    """
+
+    def test_convert_book_result(self, example_book, tmp_path):
+        """ happy path: the result describes what was converted """
+        result = convert_book(example_book, 'build',
+                              ConversionOptions(skip_jb_build=True))
+        assert isinstance(result, ConversionResult)
+        assert 'build/notebooks/ch01.html' in result.files
+        assert (tmp_path / 'build/notebooks/ch01.html').exists()
+        assert 'build/intro.html' not in result.files
+        assert 'example-table' in result.ids['build/notebooks/markup.html']
+        assert result.ids['build/part-1.html'] == []
+        assert set(result.chapter_timings) == set(result.files)
+        for phase in ["jupyter_book", "images", "chapters", "total"]:
+            assert result.timings[phase] >= 0
+
+    def test_convert_book_warnings(self, example_book):
+        """ warnings logged during the conversion are returned """
+        result = convert_book(example_book, 'build',
+                              ConversionOptions(skip_jb_build=True))
+        assert any("will not be processed" in warning
+                   for warning in result.warnings)
+
+    def test_convert_book_injected_logger(self, example_book, caplog):
+        """ run information goes to the provided logger """
+        caplog.set_level(logging.DEBUG)
+        logger = logging.getLogger("test_build_service")
+        convert_book(example_book, 'build',
+                     ConversionOptions(skip_jb_build=True), logger=logger)
+        records = [r for r in caplog.records
+                   if r.name == "test_build_service"]
+        assert any("Source:" in r.getMessage() for r in records)
+
+    def test_convert_book_repeatedly(self, example_book):
+        """ calling twice in the same process works the same both times """
+        options = ConversionOptions(skip_jb_build=True, include_root=True)
+        first = convert_book(example_book, 'build', options)
+        second = convert_book(example_book, 'build', options)
+        assert first.files == second.files
+        assert first.ids.keys() == second.ids.keys()
+
+    def test_convert_book_raises_instead_of_exiting(self, example_book):
+        """ toc problems raise a TocError rather than exiting """
+        (example_book / '_toc.yml').write_text("format: jb-article")
+        with pytest.raises(TocError):
+            convert_book(example_book, 'build',
+                         ConversionOptions(skip_jb_build=True))
+
+
+class TestKeepGoing:
+    """
+    Tests for converting past failed chapters (--keep-going) and converting
+    just those chapters later (--retry-failed)
+    """
+
+    @pytest.fixture
+    def broken_book(self, example_book):
+        """ the example book, with a chapter that fails to convert """
+        ch01 = example_book / '_build/html/notebooks/ch01.html'
+        (example_book / 'ch01.html.orig').write_text(ch01.read_text())
+        ch01.write_text("<html><body><p>Oops</p></body></html>")
+        return example_book
+
+    def test_failure_stops_run_by_default(self, broken_book):
+        with pytest.raises(RuntimeError):
+            convert_book(broken_book, 'build',
+                         ConversionOptions(skip_jb_build=True))
+
+    def test_keep_going(self, broken_book, tmp_path):
+        """ the rest of the book is converted and the failure recorded """
+        result = convert_book(broken_book, 'build',
+                              ConversionOptions(skip_jb_build=True,
+                                                keep_going=True))
+        assert 'build/notebooks/ch01.html' not in result.files
+        assert 'build/notebooks/markup.html' in result.files
+        assert (tmp_path / 'build/notebooks/code_py.html').exists()
+        assert [f["file"] for f in result.failures] == ['notebooks/ch01.html']
+        assert result.failures[0]["error"] == "RuntimeError"
+
+        with open(tmp_path / 'build' / FAILURES_FILE) as f:
+            summary = json.load(f)
+        assert summary["failures"] == result.failures
+
+    def test_retry_failed(self, broken_book, tmp_path):
+        """ only the failed chapter is converted again """
+        options = ConversionOptions(skip_jb_build=True, keep_going=True)
+        convert_book(broken_book, 'build', options)
+        markup = tmp_path / 'build/notebooks/markup.html'
+        markup.write_text(markup.read_text() + "<!-- untouched -->")
+
+        # fix the chapter and retry
+        (broken_book / '_build/html/notebooks/ch01.html').write_text(
+                (broken_book / 'ch01.html.orig').read_text())
+        result = convert_book(broken_book, 'build',
+                              ConversionOptions(skip_jb_build=True,
+                                                retry_failed=True))
+        assert result.failures == []
+        assert result.metrics["chapters"] == 1
+        assert (tmp_path / 'build/notebooks/ch01.html').exists()
+        assert markup.read_text().endswith("<!-- untouched -->")
+        # IDs of kept chapters are still known to the book
+        assert 'example-table' in result.ids['build/notebooks/markup.html']
+        assert 'build/notebooks/ch01.html' in result.files
+        assert not (tmp_path / 'build' / FAILURES_FILE).exists()
+
+
+class TestOnly:
+    """ Tests for converting selected chapters and parts """
+
+    def test_only_selected_chapters(self, example_book, tmp_path):
+        options = ConversionOptions(skip_jb_build=True)
+        full = convert_book(example_book, 'build', options)
+        markup = tmp_path / 'build/notebooks/markup.html'
+        markup.write_text(markup.read_text() + "<!-- untouched -->")
+
+        result = convert_book(example_book, 'build',
+                              ConversionOptions(skip_jb_build=True,
+                                                only=['ch01', 'part-3']))
+        assert result.metrics["chapters"] == 3  # ch01, code_py, code_r
+        assert markup.read_text().endswith("<!-- untouched -->")
+        assert result.files == full.files
+        assert result.ids.keys() == full.ids.keys()
+
+    def test_only_respects_book_ids(self, example_book, tmp_path):
+        """ IDs in chapters we didn't convert still count as duplicates """
+        convert_book(example_book, 'build',
+                     ConversionOptions(skip_jb_build=True))
+        # give the (earlier) markup chapter an ID used in the glossary
+        markup = tmp_path / 'build/notebooks/markup.html'
+        markup.write_text(markup.read_text().replace(
+            'id="example-table"', 'id="term-Gloss-Term"', 1))
+
+        result = convert_book(example_book, 'build', ConversionOptions(
+            skip_jb_build=True, only=['glossary']))
+        glossary_ids = result.ids['build/notebooks/glossary.html']
+        assert result.metrics["duplicate_ids"] == 1
+        assert "term-Gloss-Term" not in glossary_ids
+        assert "term-Gloss-Term-2" in glossary_ids
+
+    def test_only_leaves_atlas_alone(self, example_book, tmp_path):
+        atlas = tmp_path / 'atlas.json'
+        atlas.write_text('{"files": []}')
+        convert_book(example_book, 'build',
+                     ConversionOptions(skip_jb_build=True, only=['ch01']))
+        assert atlas.read_text() == '{"files": []}'
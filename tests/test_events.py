@@ -0,0 +1,53 @@
+import io
+import json
+import pytest
+from jupyter_book_to_htmlbook.conversion import ConversionOptions, convert_book
+from jupyter_book_to_htmlbook.events import JsonLinesEvents
+
+
+class TestEvents:
+    """ Tests for the progress event stream """
+
+    def test_json_lines(self):
+        stream = io.StringIO()
+        JsonLinesEvents(stream)({"event": "run_started", "time": 1.0})
+        JsonLinesEvents(stream)({"event": "run_finished", "time": 2.0})
+        lines = stream.getvalue().splitlines()
+        assert [json.loads(line)["event"] for line in lines] == [
+                "run_started", "run_finished"]
+
+    def test_conversion_events(self, example_book, tmp_path):
+        """ events follow the conversion, from start to finish """
+        events: list = []
+        result = convert_book(example_book, 'build',
+                              ConversionOptions(skip_jb_build=True),
+                              events=events.append)
+        names = [event["event"] for event in events]
+        assert names[:3] == ["run_started", "jb_build_skipped",
+                             "images_copied"]
+        assert names[-1] == "run_finished"
+        assert events[-1]["status"] == "ok"
+        assert events[-1]["files"] == result.files
+        assert "warning" in names
+
+        finished = [event for event in events
+                    if event["event"] in ["chapter_finished",
+                                          "part_finished"]]
+        assert [event["file"] for event in finished] == result.files
+        ch01 = next(event for event in finished
+                    if event["file"] == 'build/notebooks/ch01.html')
+        assert len(ch01["sha256"]) == 64
+        assert names.index("chapter_started") < names.index(
+                "chapter_finished")
+
+    def test_failed_run_event(self, example_book):
+        (example_book / '_build/html/notebooks/ch01.html').write_text(
+                "<html><body><p>Oops</p></body></html>")
+        events: list = []
+        with pytest.raises(RuntimeError):
+            convert_book(example_book, 'build',
+                         ConversionOptions(skip_jb_build=True),
+                         events=events.append)
+        assert events[-2]["event"] == "chapter_failed"
+        assert events[-1]["status"] == "failed"
+        assert "RuntimeError" in events[-1]["error"]
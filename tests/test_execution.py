@@ -0,0 +1,119 @@
+import pytest
+import subprocess
+import time
+from jupyter_book_to_htmlbook import conversion, execution
+from jupyter_book_to_htmlbook.conversion import ConversionOptions, convert_book
+from jupyter_book_to_htmlbook.execution import (
+        execution_config,
+        pre_execute_notebooks,
+        toc_notebooks
+    )
+
+
+class FakeNotebookCache:
+    """ stands in for jupyter-cache, keyed by notebook path """
+    cached: set = set()
+    stored: dict = {}
+
+    def __init__(self, path):
+        self.path = path
+
+    def is_cached(self, path):
+        return path.name in self.cached
+
+    def store(self, path, executed, seconds):
+        self.stored[path.name] = executed
+
+
+def fake_execute_notebook(path, cell_timeout=None, allow_errors=False):
+    if path.name == 'code_r.ipynb':
+        raise RuntimeError("R kernel not found")
+    if path.name == 'markup.ipynb':
+        time.sleep(30)
+    return f"executed {path.name}"
+
+
+@pytest.fixture
+def example_book(example_book, monkeypatch: pytest.MonkeyPatch):
+    """ the example book, set up to cache notebook execution """
+    config = (example_book / '_config.yml').read_text()
+    (example_book / '_config.yml').write_text(
+            config.replace("execute_notebooks: false",
+                           "execute_notebooks: cache"))
+    FakeNotebookCache.cached = {'preface.ipynb', 'ch01.ipynb'}
+    FakeNotebookCache.stored = {}
+    monkeypatch.setattr(execution, "NotebookCache", FakeNotebookCache)
+    monkeypatch.setattr(execution, "execute_notebook", fake_execute_notebook)
+    return example_book
+
+
+class TestPreExecution:
+    """
+    Tests for executing notebooks ahead of jupyter-book
+    """
+
+    def test_execution_config(self, example_book):
+        config = execution_config(example_book)
+        assert config["execute_notebooks"] == "cache"
+        assert config["cache"] == str(example_book / '_build/.jupyter_cache')
+        assert config["timeout"] == 30
+        assert not config["allow_errors"]
+
+    def test_toc_notebooks(self, example_book):
+        notebooks = toc_notebooks(example_book)
+        assert notebooks[:2] == ['notebooks/preface.ipynb',
+                                 'notebooks/ch01.ipynb']
+        assert 'bibliography.md' not in notebooks
+        # ch02.02 is in the toc, but doesn't exist
+        assert 'notebooks/ch02.02.ipynb' not in notebooks
+
+        config = execution_config(example_book)
+        config["exclude_patterns"] = ['notebooks/code_*']
+        assert 'notebooks/code_py.ipynb' not in toc_notebooks(example_book,
+                                                              config)
+
+    def test_reports(self, example_book):
+        reports = pre_execute_notebooks(example_book, jobs=3, timeout=2)
+        statuses = {report["file"]: report["status"] for report in reports}
+        assert statuses == {
+            'notebooks/preface.ipynb': 'cached',
+            'notebooks/ch01.ipynb': 'cached',
+            'notebooks/ch02.00.ipynb': 'executed',
+            'notebooks/ch02.01.ipynb': 'executed',
+            'notebooks/code_py.ipynb': 'executed',
+            'notebooks/code_r.ipynb': 'failed',
+            'notebooks/markup.ipynb': 'timed_out',
+            'notebooks/footnotes.ipynb': 'executed',
+            'notebooks/glossary.ipynb': 'executed',
+        }
+        assert reports[5]["error"] == "RuntimeError: R kernel not found"
+        assert 2 <= reports[6]["seconds"] < 10
+        # only the executed notebooks are added to the cache
+        assert FakeNotebookCache.stored['code_py.ipynb'] == \
+            "executed code_py.ipynb"
+        assert len(FakeNotebookCache.stored) == 5
+
+    def test_not_caching(self, example_book, caplog):
+        (example_book / '_config.yml').write_text(
+                "execute:\n  execute_notebooks: force\n")
+        assert pre_execute_notebooks(example_book) == []
+        assert "Not pre-executing notebooks" in caplog.text
+
+    def test_conversion(self, example_book, monkeypatch):
+        monkeypatch.setattr(
+            conversion, "run_jupyter_book",
+            lambda source, ctx=None: subprocess.CompletedProcess([], 0))
+        FakeNotebookCache.cached |= {'code_r.ipynb', 'markup.ipynb'}
+        events: list = []
+        result = convert_book(example_book, 'build',
+                              ConversionOptions(pre_execute=True),
+                              events=events.append)
+        assert [notebook["status"] for notebook in result.notebooks] == \
+            ['cached'] * 2 + ['executed'] * 3 + ['cached'] * 2 + \
+            ['executed'] * 2
+        assert result.metrics["notebooks_executed"] == 5
+        assert "notebooks" in result.timings
+        names = [event["event"] for event in events]
+        assert names.count("notebook_finished") == 9
+        assert names.index("notebook_finished") < \
+            names.index("jb_build_started")
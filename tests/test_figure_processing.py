@@ -4,6 +4,7 @@ from jupyter_book_to_htmlbook.figure_processing import (
         process_figures,
         process_informal_figs
 )
+from jupyter_book_to_htmlbook.sanitize_processing import sanitize_chapter
 
 
 @pytest.fixture()
@@ -87,7 +88,7 @@ style="width: 200px; height: 200px;" /></a>
                'e-class align-center" src="_images/flower.png" style="' + \
                'width: 249px; height: 150px;" /></a>'
         chapter = Soup(text, 'html.parser')
-        result = process_informal_figs(chapter)
+        result = sanitize_chapter(process_informal_figs(chapter))
         assert str(result) == (
             '<figure class="informal"><img alt="flower" ' +
             'src="_images/flower.png"/></figure>')
@@ -2,9 +2,13 @@ import logging
 import os
 import pytest
 import shutil
+from bs4 import BeautifulSoup  # type: ignore
 from jupyter_book_to_htmlbook.file_processing import (
+        chapter_output_ids,
+        chapter_output_path,
         process_chapter,
-        process_chapter_soup
+        process_chapter_soup,
+        process_subsections
 )
 
 
@@ -196,6 +200,28 @@ id="this-is-another-subheading">
 </h1>
 <p>Finally, a summary.</p></section></section>"""
 
+    def test_process_subsections(self):
+        """
+        Subsections are typed by the highest heading directly under them or
+        any section inside them, and heading span ids are moved up to them
+        """
+        chapter = BeautifulSoup("""<section data-type="chapter">
+<span id="chp"></span><h1>Chapter</h1>
+<section id="a"><span id="sec-a"></span><h2>A</h2>
+<section id="b"><h3>B</h3><p><span id="stays"></span>Text</p></section>
+<div><section id="c"><h1>C</h1></section></div>
+</section>
+<section id="d"><aside><h1>Sidebar</h1></aside><p>No heading</p></section>
+</section>""", "html.parser").section
+        process_subsections(chapter)
+        assert chapter["id"] == "chp"
+        sections = chapter.find_all("section")
+        assert [(section["id"], section.get("data-type"))
+                for section in sections] == [
+            ("sec-a", "sect1"), ("b", "sect3"), ("c", "sect1"), ("d", None)]
+        assert chapter.find("span", id="stays")
+        assert not chapter.find("span", id="chp")
+
     def test_process_chapter_filepaths(self, tmp_book_path):
         """
         ensure the returned/written filepath is correct
@@ -443,3 +469,19 @@ id="this-is-another-subheading">
         assert text.find('data-code-language="') == -1
         # spans should be converted to code tags for highlighting in Atlas
         assert text.find('<code class="nb"') > 0
+
+    def test_chapter_output_path_and_ids(self, tmp_book_path):
+        """
+        We can tell where a chapter will be written, and read its IDs back
+        from the written file
+        """
+        test_out = tmp_book_path / "output"
+        test_out.mkdir()
+        toc_element = [tmp_book_path / 'notebooks/ch02.00.html',
+                       tmp_book_path / 'notebooks/ch02.01.html']
+        expected = chapter_output_path(toc_element, tmp_book_path, test_out)
+        assert expected == test_out / "notebooks/ch02.00.html"
+
+        file, ids = process_chapter(toc_element, tmp_book_path, test_out)
+        assert test_out / file == expected
+        assert chapter_output_ids(expected) == ids
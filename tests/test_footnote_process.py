@@ -3,6 +3,7 @@ import pytest
 from bs4 import BeautifulSoup  # type: ignore
 
 from jupyter_book_to_htmlbook.footnote_processing import process_footnotes
+from jupyter_book_to_htmlbook.sanitize_processing import sanitize_chapter
 
 
 @pytest.fixture()
@@ -55,3 +56,18 @@ def test_prcoess_footnotes_poorly_formed(caplog):
     caplog.set_level(logging.DEBUG)
     expected_issue = '"<a class="footnote-reference" href="na" id="id1"></a>".'
     assert expected_issue in caplog.text
+
+
+def test_process_footnotes_with_markup():
+    """
+    Footnotes with inline markup keep all of their contents, in order
+    """
+    chapter = BeautifulSoup("""<div><p>Text<a class="footnote-reference
+    brackets" href="#id2" id="id1">1</a></p></div><hr class="footnotes" />
+    <dl class="footnote brackets"><dt class="label" id="id2">1</dt>
+    <dd><p>A <em>marked up</em> note with <code>code</code>.</p></dd></dl>""",
+                            'html.parser')
+    result = sanitize_chapter(process_footnotes(chapter))
+    footnote = result.find("span", attrs={"data-type": "footnote"})
+    assert str(footnote) == '<span data-type="footnote">A <em>marked ' + \
+        'up</em> note with <code>code</code>.</span>'
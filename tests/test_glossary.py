@@ -37,6 +37,9 @@ class TestGlossary:
         assert not result.find("a", class_="headerlink")
         # ensures that any extra tags are preserved in the <dfn> tag
         assert len(result.find("dfn").contents) == 4
+        # and that the term itself is left as it was
+        assert result.find("dt")["id"] == "term-Gloss-Term"
+        assert result.find("dt").dfn.em.string == "Term"
 
     def test_chapter_for_glossary_data_type(self, tmp_path):
         """
@@ -69,7 +72,7 @@ class TestGlossary:
         with open(test_out / 'glossary.html') as f:
             text = f.read()
             assert '<section data-type="glossary"' in text
-            # ensure we get the jupyter book-style glossaries
-            assert '<dl class="glossary simple" data-type="glossary"' in text
-            # ensure we also tag the regular definition list-based glossaries
-            assert '<dl class="simple myst" data-type="glossary"' in text
+            # ensure we get the jupyter book-style glossaries, and also tag
+            # the regular definition list-based ones (their classes are
+            # sanitized away)
+            assert text.count('<dl data-type="glossary"') == 2
@@ -1,5 +1,11 @@
 from bs4 import BeautifulSoup  # type: ignore
-from jupyter_book_to_htmlbook.helpers import base_soup
+from jupyter_book_to_htmlbook.helpers import (
+        base_soup,
+        move_children,
+        move_nodes,
+        replace_strings,
+        wrap_children
+    )
 
 
 def test_get_base_soup_happy_path():
@@ -28,3 +34,86 @@ def test_get_base_soup_no_parents():
     element = soup.find("div", id="root")
     base = base_soup(element)
     assert base == soup
+
+
+def test_move_children_between_soups():
+    """
+    Children are moved (not copied) in order, even into another soup, and
+    the trees stay consistent for searching
+    """
+    source = BeautifulSoup("<div>a <em>b</em> c <code>d</code></div>",
+                           "html.parser")
+    target = BeautifulSoup("<p>start</p>", "html.parser")
+    em = source.em
+    move_children(source.div, target.p)
+    assert str(target) == "<p>starta <em>b</em> c <code>d</code></p>"
+    assert target.em is em
+    assert str(source) == "<div></div>"
+    assert [tag.name for tag in target.find_all(True)] == ["p", "em", "code"]
+    assert source.find("em") is None
+
+
+def test_move_nodes_at_position():
+    soup = BeautifulSoup("<div><i>1</i><i>4</i></div><p><i>2</i><i>3</i></p>",
+                         "html.parser")
+    move_nodes(soup.p.find_all("i"), soup.div, 1)
+    assert str(soup) == "<div><i>1</i><i>2</i><i>3</i><i>4</i></div><p></p>"
+
+
+def test_wrap_children():
+    soup = BeautifulSoup("<dt id='term'>Gloss <em>Term</em><b>x</b></dt>",
+                         "html.parser")
+    wrap_children(soup.dt, soup.new_tag("dfn"), end=2)
+    assert str(soup) == \
+        '<dt id="term"><dfn>Gloss <em>Term</em></dfn><b>x</b></dt>'
+    wrap_children(soup.dt, soup.new_tag("span"))
+    assert str(soup) == '<dt id="term"><span><dfn>Gloss <em>Term</em>' + \
+        '</dfn><b>x</b></span></dt>'
+
+
+def test_replace_strings():
+    """
+    Only the tag's own strings are replaced, and the rest of the tree is
+    left in place
+    """
+    soup = BeautifulSoup("<pre>a\nb<span>c\nd</span>\ne</pre>",
+                         "html.parser")
+    span = soup.span
+    replace_strings(soup.pre, lambda text: text.replace("\n", "\n  "))
+    assert str(soup) == "<pre>a\n  b<span>c\nd</span>\n  e</pre>"
+    assert soup.span is span
+    assert soup.find(string="c\nd") is not None
+    # the replacements are linked into the tree where the strings were
+    assert [str(string) for string in soup.pre.strings] == \
+        ["a\n  b", "c\nd", "\n  e"]
+    assert span.previous_sibling.next_sibling is span
+    assert span.next_element.next_element.parent is soup.pre
+
+
+def test_replace_strings_tree_links():
+    """
+    The tree is linked up exactly as if it had been parsed with the new
+    strings, in whatever version of Beautiful Soup we're running with
+    """
+    html = "<div><pre>a\nb<span>c\nd</span>\ne<!--x-->f\n</pre>\n</div>"
+    soup = BeautifulSoup(html, "html.parser")
+    replace_strings(soup.pre, lambda text: text.replace("\n", "\n  "))
+    expected = BeautifulSoup(str(soup), "html.parser")
+
+    def links(soup):
+        nodes = list(soup.descendants)
+        return [(str(node),
+                 nodes.index(node.parent) if node.parent in nodes else None,
+                 *[str(neighbour) for neighbour in (
+                     node.previous_element, node.next_element,
+                     node.previous_sibling, node.next_sibling)])
+                for node in nodes]
+
+    assert links(soup) == links(expected)
+    # and the chain of elements runs the same both ways
+    last = list(soup.descendants)[-1]
+    backwards = []
+    while last is not None and last is not soup:
+        backwards.append(last)
+        last = last.previous_element
+    assert backwards[::-1] == list(soup.descendants)
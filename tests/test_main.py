@@ -1,3 +1,4 @@
+import json
 import logging
 import os
 import pytest
@@ -97,6 +98,69 @@ class TestMain:
         with atlas.open() as f:
             assert 'build/notebooks/preface.html' in f.read()
 
+    def test_toc_error_exits(self,
+                             tmp_path,
+                             monkeypatch: pytest.MonkeyPatch):
+        """ toc problems are reported and the CLI exits with an error """
+        test_env = tmp_path / 'tmp'
+        test_env.mkdir()
+        (test_env / '_toc.yml').write_text("format: jb-article")
+        monkeypatch.chdir(tmp_path)  # patch for our build target
+
+        result = runner.invoke(app, [str(test_env), 'build',
+                                     '--skip-jb-build'])
+        assert result.exit_code == 1
+        assert "jb-book" in result.stdout
+
+    def test_keep_going_exits_with_failures(self,
+                                            tmp_path,
+                                            monkeypatch: pytest.MonkeyPatch):
+        """ failed chapters are reported, but the rest are converted """
+        test_env = tmp_path / 'tmp'
+        shutil.copytree('tests/example_book', test_env)
+        (test_env / '_build/html/notebooks/ch01.html').write_text(
+                "<html><body><p>Oops</p></body></html>")
+        monkeypatch.chdir(tmp_path)  # patch for our build target
+
+        result = runner.invoke(app, [str(test_env), 'build',
+                                     '--skip-jb-build', '--keep-going'])
+        assert result.exit_code == 1
+        assert "build/notebooks/markup.html" in result.stdout
+        assert "Failed to convert notebooks/ch01.html" in result.stderr
+        assert (tmp_path / 'build/jb2htmlbook-failures.json').exists()
+
+    def test_only(self, tmp_path, monkeypatch: pytest.MonkeyPatch):
+        """ selected chapters are converted; unknown ones are an error """
+        test_env = tmp_path / 'tmp'
+        shutil.copytree('tests/example_book', test_env)
+        monkeypatch.chdir(tmp_path)  # patch for our build target
+
+        result = runner.invoke(app, [str(test_env), 'build',
+                                     '--skip-jb-build',
+                                     '--only', 'ch01,code_py'])
+        assert result.exit_code == 0
+        assert (tmp_path / 'build/notebooks/ch01.html').exists()
+        assert (tmp_path / 'build/notebooks/code_py.html').exists()
+
+        result = runner.invoke(app, [str(test_env), 'build',
+                                     '--skip-jb-build', '--only', 'ch99'])
+        assert result.exit_code == 1
+        assert "ch99" in result.stdout
+
+    def test_events_on_stdout(self, tmp_path, monkeypatch: pytest.MonkeyPatch):
+        """ events replace the comma-joined list of files on stdout """
+        test_env = tmp_path / 'tmp'
+        shutil.copytree('tests/example_book', test_env)
+        monkeypatch.chdir(tmp_path)  # patch for our build target
+
+        result = runner.invoke(app, [str(test_env), 'build',
+                                     '--skip-jb-build', '--events', 'jsonl'])
+        assert result.exit_code == 0
+        events = [json.loads(line) for line in result.stdout.splitlines()]
+        assert events[0]["event"] == "run_started"
+        assert events[-1]["event"] == "run_finished"
+        assert "build/notebooks/ch01.html" in events[-1]["files"]
+
     @pytest.mark.jb
     @pytest.mark.slow
     def test_with_jb_run(self,
@@ -0,0 +1,250 @@
+import pytest
+import re
+from bs4 import BeautifulSoup  # type: ignore
+from pathlib import Path
+from typer.testing import CliRunner
+from jupyter_book_to_htmlbook import file_processing, passes
+from jupyter_book_to_htmlbook.context import ConversionContext
+from jupyter_book_to_htmlbook.conversion import ConversionOptions, convert_book
+from jupyter_book_to_htmlbook.file_processing import (
+        CHAPTER_PASSES,
+        chapter_passes
+    )
+from jupyter_book_to_htmlbook.main import app
+from jupyter_book_to_htmlbook.passes import (
+        Pass,
+        PassRegistry,
+        chapter_features
+    )
+
+
+def converted(target: Path) -> dict:
+    """ the text of each converted file, with random ID suffixes removed """
+    return {str(file.relative_to(target)):
+            re.sub(r'_[0-9]+"', '"', file.read_text())
+            for file in sorted(target.rglob('*.html'))}
+
+
+def mark(name):
+    """ a pass that notes it ran on the chapter """
+    def process(chapter, ctx):
+        chapter["data-passes"] = chapter.get("data-passes", "") + f" {name}"
+        return chapter
+    return process
+
+
+class FakeEntryPoint:
+    """ stands in for an installed package's entry point """
+
+    def __init__(self, name, step):
+        self.name = name
+        self.value = f"plugin:{name}"
+        self.step = step
+        self.loaded = False
+
+    def load(self):
+        self.loaded = True
+        return self.step
+
+
+class TestFeatures:
+    """
+    Tests for skipping the passes a chapter has nothing for
+    """
+
+    def test_chapter_features(self):
+        chapter = BeautifulSoup("""<section class="intro">
+<p>See <span class="math notranslate">x</span>.</p>
+<aside class="sidebar"><p class="sidebar-title">Title</p></aside>
+</section>""", "html.parser").section
+        assert chapter_features(chapter) == {
+            "section", "intro", "p", "span", "math", "notranslate", "aside",
+            "sidebar", "sidebar-title"}
+
+    def test_skipped_passes(self):
+        """
+        Passes are skipped when the chapter has none of what they read,
+        unless an earlier pass added it
+        """
+        registry = PassRegistry([
+            Pass("always", mark("always")),
+            Pass("math", mark("math"), reads=frozenset({"math"})),
+            Pass("adds_code", mark("adds_code"), reads=frozenset({"p"}),
+                 writes=frozenset({"code"})),
+            Pass("code", mark("code"), reads=frozenset({"code"}),
+                 after=("adds_code",)),
+            Pass("never", mark("never"),
+                 when=lambda chapter, ctx: False),
+        ], plugins=False)
+        chapter = BeautifulSoup("<section><p>Hi</p></section>",
+                                "html.parser").section
+        ctx = ConversionContext()
+        registry.run(chapter, chapter_features(chapter), ctx)
+        assert chapter["data-passes"] == " always adds_code code"
+        assert ctx.metrics == {"skipped_math": 1}
+
+        # without a scan, every pass that applies runs
+        chapter = BeautifulSoup("<section></section>", "html.parser").section
+        registry.run(chapter, None, ctx)
+        assert chapter["data-passes"] == " always math adds_code code"
+
+    @pytest.mark.parametrize("keep_highlighting", [False, True])
+    def test_same_output(self, example_book, monkeypatch, keep_highlighting):
+        """
+        Skipping passes shouldn't change the output at all, compared with
+        running every pass over every chapter
+        """
+        options = ConversionOptions(skip_jb_build=True,
+                                    keep_highlighting=keep_highlighting)
+        scanned = convert_book(example_book, 'scanned', options)
+        assert scanned.metrics["skipped_process_math"] > 0
+
+        monkeypatch.setattr(file_processing, "chapter_features",
+                            lambda chapter: None)
+        unscanned = convert_book(example_book, 'unscanned', options)
+        assert not [metric for metric in unscanned.metrics
+                    if metric.startswith("skipped_")]
+
+        assert converted(Path('scanned')) == converted(Path('unscanned'))
+        assert len(converted(Path('scanned'))) == len(scanned.files)
+
+
+class TestPassRegistry:
+    """
+    Tests for declaring, ordering and disabling chapter passes
+    """
+
+    def test_builtin_order(self):
+        """ the built-in passes are checked, and kept in the order given """
+        assert chapter_passes().names == [step.name for step in
+                                          CHAPTER_PASSES]
+
+    def test_declared_order(self):
+        registry = PassRegistry([
+            Pass("c", mark("c"), after=("b",)),
+            Pass("a", mark("a")),
+            Pass("b", mark("b")),
+            Pass("d", mark("d"), before=("a",)),
+        ], plugins=False)
+        # i.e., passes are pulled forward just before those that need them
+        assert registry.names == ["b", "c", "d", "a"]
+
+    def test_cycle(self):
+        with pytest.raises(ValueError, match="cycle: a -> b -> a"):
+            PassRegistry([Pass("a", mark("a"), after=("b",)),
+                          Pass("b", mark("b"), after=("a",))],
+                         plugins=False)
+
+    def test_reads_what_later_pass_writes(self):
+        """
+        A pass running before one that adds what it reads is an error,
+        unless that's the declared order
+        """
+        reader = Pass("reader", mark("reader"), reads=frozenset({"code"}))
+        writer = Pass("writer", mark("writer"), writes=frozenset({"code"}))
+        with pytest.raises(ValueError, match="reader reads code, which " +
+                                             "writer"):
+            PassRegistry([reader, writer], plugins=False)
+        declared = Pass("writer", mark("writer"), writes=frozenset({"code"}),
+                        after=("reader",))
+        assert PassRegistry([reader, declared],
+                            plugins=False).names == ["reader", "writer"]
+
+    def test_disabled(self):
+        registry = chapter_passes(("process_math", "process_sidebars"))
+        assert "process_math" not in registry.names
+        assert "process_sidebars" not in registry.names
+        # those that had to run after a disabled pass still run
+        assert "process_informal_figs" in chapter_passes(
+                ("process_figures",)).names
+        with pytest.raises(ValueError, match="Unknown pass"):
+            chapter_passes(("process_maths",))
+
+    def test_entry_points(self, monkeypatch):
+        """
+        Passes from entry points are ordered along with the rest, and not
+        loaded at all when disabled
+        """
+        plugin = FakeEntryPoint("add_index", Pass(
+                "add_index", mark("add_index"),
+                before=("process_remaining_refs",)))
+        unused = FakeEntryPoint("unused", Pass("unused", mark("unused")))
+        monkeypatch.setattr(passes, "_entry_points",
+                            lambda: [plugin, unused])
+        registry = PassRegistry(CHAPTER_PASSES, ("unused",))
+        assert registry.names[-4:] == ["add_index", "process_remaining_refs",
+                                       "add_glossary_datatypes",
+                                       "sanitize_chapter"]
+        assert plugin.loaded and not unused.loaded
+
+        misnamed = FakeEntryPoint("other", Pass("add_index", mark("x")))
+        monkeypatch.setattr(passes, "_entry_points", lambda: [misnamed])
+        with pytest.raises(ValueError, match="isn't a Pass of that name"):
+            PassRegistry(CHAPTER_PASSES)
+
+    def test_disabled_in_conversion(self, example_book):
+        options = ConversionOptions(skip_jb_build=True,
+                                    disable_passes=["process_admonitions"])
+        convert_book(example_book, 'build', options)
+        # i.e., its title is still there
+        assert '<div>\n<p>Note</p>' in \
+            Path('build/notebooks/preface.html').read_text()
+        with pytest.raises(ValueError, match="Unknown pass"):
+            convert_book(example_book, 'build', ConversionOptions(
+                    skip_jb_build=True, disable_passes=["nope"]))
+
+    def test_disabled_in_book_config(self, example_book, caplog):
+        """ a book's _config.yml can turn passes off as well """
+        with open(example_book / '_config.yml', 'a') as f:
+            f.write("\njb2htmlbook:\n  disable_passes:\n" +
+                    "    - process_admonitions\n")
+        caplog.set_level("INFO")
+        convert_book(example_book, 'build',
+                     ConversionOptions(skip_jb_build=True))
+        assert '<div>\n<p>Note</p>' in \
+            Path('build/notebooks/preface.html').read_text()
+        assert "disabled by the book's _config.yml: process_admonitions" in \
+            caplog.text
+
+        with open(example_book / '_config.yml', 'a') as f:
+            f.write("    - nope\n")
+        with pytest.raises(ValueError, match="Unknown pass"):
+            convert_book(example_book, 'build',
+                         ConversionOptions(skip_jb_build=True))
+
+    def test_code_classes_without_sanitizer(self, example_book):
+        """
+        Code blocks lose their highlighting classes in process_code, whether
+        or not the sanitizer runs
+        """
+        convert_book(example_book, 'build', ConversionOptions(
+                skip_jb_build=True, disable_passes=["sanitize_chapter"]))
+        for chapter in ["code_py", "code_r"]:
+            soup = BeautifulSoup(
+                    Path(f'build/notebooks/{chapter}.html').read_text(),
+                    "html.parser")
+            blocks = soup.find_all("pre",
+                                   attrs={"data-type": "programlisting"})
+            assert blocks
+            assert not any(span.get("class") for block in blocks
+                           for span in block.find_all("span"))
+        r_block = soup.find("pre", attrs={"data-code-language": "r"})
+        assert not r_block.parent.parent.get("class")
+
+    def test_merged_pass(self, example_book):
+        """ passes folded into others can still be named, with a warning """
+        result = convert_book(example_book, 'build', ConversionOptions(
+                skip_jb_build=True,
+                disable_passes=["move_span_ids_to_sections"]))
+        assert "move_span_ids_to_sections is now part of " + \
+            "process_subsections and can't be disabled on its own" in \
+            result.warnings
+        assert "process_subsections" in chapter_passes(
+                ("move_span_ids_to_sections",)).names
+
+    def test_cli(self, example_book):
+        result = CliRunner().invoke(app, [str(example_book), 'build',
+                                          '--skip-jb-build',
+                                          '--disable-pass', 'nope'])
+        assert result.exit_code == 2
+        assert "Unknown pass(es): nope" in result.output
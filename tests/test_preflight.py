@@ -0,0 +1,99 @@
+import pytest
+import shutil
+import subprocess
+from pathlib import Path
+from jupyter_book_to_htmlbook import conversion
+from jupyter_book_to_htmlbook.conversion import ConversionOptions, convert_book
+from jupyter_book_to_htmlbook.preflight import (
+        check_toc,
+        missing_pages,
+        source_extensions
+    )
+from jupyter_book_to_htmlbook.toc_processing import TocError, get_book_toc
+
+
+class TestPreflight:
+    """
+    Tests for checking the table of contents before converting anything
+    """
+
+    def test_book_passes(self, example_book, tmp_path):
+        toc = get_book_toc(example_book)
+        check_toc(example_book, toc, tmp_path / 'out')
+        # output directories are only made once the book is built
+        assert not (tmp_path / 'out').exists()
+        assert missing_pages(toc) == []
+
+    def test_output_dirs(self, example_book, monkeypatch):
+        """ output directories are made after the build """
+        made = []
+
+        def build(source, ctx=None):
+            made.append(Path('build/notebooks').exists())
+            return subprocess.CompletedProcess([], 0)
+
+        monkeypatch.setattr(conversion, "run_jupyter_book", build)
+        convert_book(example_book, 'build', ConversionOptions())
+        assert made == [False]
+        assert Path('build/notebooks/ch01.html').exists()
+
+    def test_custom_source_suffixes(self, example_book, tmp_path):
+        """ sources with the extensions the book's config adds are found """
+        with open(example_book / '_config.yml', 'a') as f:
+            f.write("""
+    nb_custom_formats:
+      .Rmd:
+        - jupytext.reads
+        - fmt: Rmd
+""")
+        assert source_extensions(example_book) == \
+            ['.ipynb', '.md', '.rst', '.Rmd']
+        (example_book / 'notebooks/code_r.ipynb').rename(
+                example_book / 'notebooks/code_r.Rmd')
+        check_toc(example_book, get_book_toc(example_book), tmp_path / 'out')
+
+    def test_missing_sources(self, example_book, tmp_path, monkeypatch):
+        """ missing sources are reported before jupyter-book runs """
+        (example_book / 'notebooks/ch01.ipynb').unlink()
+        (example_book / 'notebooks/ch02.02.md').unlink()
+        builds = []
+        monkeypatch.setattr(conversion, "run_jupyter_book",
+                            lambda source, ctx=None: builds.append(source))
+        with pytest.raises(TocError) as error:
+            convert_book(example_book, 'build', ConversionOptions())
+        assert "No source file for notebooks/ch01 " in str(error.value)
+        assert "No source file for notebooks/ch02.02 " in str(error.value)
+        assert not builds
+        # sources aren't needed when we're not building
+        convert_book(example_book, 'build',
+                     ConversionOptions(skip_jb_build=True))
+
+    def test_duplicate_outputs(self, example_book, tmp_path):
+        html = example_book / '_build/html'
+        (html / 'notebooks/html').mkdir()
+        shutil.copy(html / 'notebooks/ch01.html', html / 'notebooks/html')
+        toc = get_book_toc(example_book)
+        toc.append(html / 'notebooks/html/ch01.html')
+        with pytest.raises(TocError) as error:
+            check_toc(example_book, toc, tmp_path / 'out',
+                      check_sources=False)
+        assert "_build/html/notebooks/ch01.html, " + \
+            "_build/html/notebooks/html/ch01.html would all be written to " + \
+            "notebooks/ch01.html" in str(error.value)
+        assert not (tmp_path / 'out/notebooks').exists()
+
+    def test_missing_pages(self, example_book, tmp_path):
+        (example_book / '_build/html/notebooks/code_r.html').unlink()
+        with pytest.raises(TocError, match="code_r.html"):
+            convert_book(example_book, 'build',
+                         ConversionOptions(skip_jb_build=True))
+        assert not (tmp_path / 'build/_images').exists()
+
+        result = convert_book(example_book, 'build',
+                              ConversionOptions(skip_jb_build=True,
+                                                keep_going=True))
+        assert [failure["file"] for failure in result.failures] == \
+            ['notebooks/code_r.html']
+        assert any("Missing jupyter-book output" in warning
+                   for warning in result.warnings)
+        assert Path('build/notebooks/code_py.html').exists()
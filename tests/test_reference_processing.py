@@ -110,7 +110,7 @@ Note that the cell has an “example” tag added to its metadata.</p>""",
         with open(test_out / 'code_py.html') as f:
             soup = BeautifulSoup(f.read(), "html.parser")
 
-        xref = soup.find("a", class_="xref")
+        xref = soup.find("a", attrs={"data-type": "xref"})
         assert xref
         assert xref.get("href") == "#hello_tim"
         assert xref.get("data-type") == "xref"
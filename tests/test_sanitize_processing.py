@@ -0,0 +1,66 @@
+from bs4 import BeautifulSoup  # type: ignore
+from jupyter_book_to_htmlbook.context import (
+        ConversionContext,
+        ConversionOptions
+    )
+from jupyter_book_to_htmlbook.sanitize_processing import sanitize_chapter
+
+
+class TestSanitizeChapter:
+    """
+    Tests for removing whatever isn't HTMLBook from chapters
+    """
+
+    def test_classes_and_attributes(self):
+        chapter = BeautifulSoup("""<section class="tex2jax_ignore" \
+data-type="chapter" id="ch" xmlns="http://www.w3.org/1999/xhtml">
+<p aria-level="2" class="caption" role="heading">Caption</p>
+<section class="pagebreak-before section less_space" data-type="sect1">
+<p>A <span class="keep-together">kept</span> span and a \
+<a class="reference external" href="http://example.com" \
+target="_blank">link</a>.</p>
+<figure class="informal align-default"><img alt="A" \
+class="align-center" src="a.png"/></figure>
+</section></section>""", "html.parser").section
+        result = sanitize_chapter(chapter)
+        assert str(result) == """<section data-type="chapter" id="ch" \
+xmlns="http://www.w3.org/1999/xhtml">
+<p>Caption</p>
+<section class="pagebreak-before less_space" data-type="sect1">
+<p>A <span class="keep-together">kept</span> span and a \
+<a href="http://example.com">link</a>.</p>
+<figure class="informal"><img alt="A" src="a.png"/></figure>
+</section></section>"""
+
+    def test_elements(self, caplog):
+        """
+        Elements that aren't HTMLBook are unwrapped, and foreign content is
+        left as it is
+        """
+        chapter = BeautifulSoup("""<section><details><summary>Sum</summary>
+<p>Hidden</p></details>
+<svg class="plot" height="10" style="fill: red"><g class="x">\
+<rect width="1"></rect></g></svg></section>""", "html.parser").section
+        caplog.set_level("INFO")
+        result = sanitize_chapter(chapter)
+        assert str(result) == """<section>Sum
+<p>Hidden</p>
+<svg class="plot" height="10" style="fill: red"><g class="x">\
+<rect width="1"></rect></g></svg></section>"""
+        assert "Unwrapping non-HTMLBook <details> element" in caplog.text
+
+    def test_keep_highlighting(self):
+        """ highlighted blocks keep their classes, if we're keeping those """
+        text = """<section><div class="cell docutils container">\
+<div class="highlight"><pre data-type="programlisting"><code class="k">def\
+</code> <code class="nf">f</code>():</pre></div></div></section>"""
+        kept = sanitize_chapter(
+                BeautifulSoup(text, "html.parser").section,
+                ConversionContext(options=ConversionOptions(
+                    keep_highlighting=True)))
+        assert str(kept) == """<section><div><div class="highlight">\
+<pre data-type="programlisting"><code class="k">def</code> \
+<code class="nf">f</code>():</pre></div></div></section>"""
+
+        removed = sanitize_chapter(BeautifulSoup(text, "html.parser").section)
+        assert "class=" not in str(removed)
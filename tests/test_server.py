@@ -0,0 +1,139 @@
+import http.client
+import json
+import os
+import pytest
+import socket
+import threading
+from jupyter_book_to_htmlbook.server import (
+        ConversionService,
+        make_server,
+        run_job
+    )
+
+
+@pytest.fixture
+def running_server():
+    """ a server on a free port, run in the background """
+    service = ConversionService(workers=1)
+    server = make_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    service.shutdown()
+
+
+def request(server, method, path, body=None):
+    """ make a request, returning the status and decoded json response """
+    connection = http.client.HTTPConnection(*server.server_address)
+    payload = json.dumps(body) if body is not None else None
+    connection.request(method, path, body=payload)
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+
+class TestServer:
+    """
+    Tests for the long-running conversion service
+    """
+
+    def test_run_job_reuses_warm_caches(self, example_book):
+        """ a second run of the same job hits the worker's caches """
+        job = {"source": str(example_book), "target": "build",
+               "atlas_json": None, "options": {"skip_jb_build": True}}
+        first = run_job(job)
+        second = run_job(job)
+        assert first["status"] == second["status"] == "ok"
+        assert first["cache"].get("chapter_hits", 0) == 0
+        assert second["cache"]["toc_hits"] == 1
+        assert second["cache"]["chapter_hits"] == len(
+                [f for f in second["files"] if "part-" not in f])
+        assert second["files"] == first["files"]
+
+    def test_health(self, running_server):
+        status, body = request(running_server, "GET", "/health")
+        assert status == 200
+        assert body["status"] == "ok"
+        assert body["workers"] == 1
+
+    def test_convert_and_metrics(self, running_server, example_book):
+        """ jobs are converted and counted """
+        # workers resolve relative targets against the server's directory
+        target = example_book.parent / "build"
+        status, body = request(running_server, "POST", "/convert",
+                               {"source": str(example_book),
+                                "target": str(target),
+                                "options": {"skip_jb_build": True}})
+        assert status == 200
+        assert f"{target}/notebooks/ch01.html" in body["files"]
+        assert (target / "notebooks/ch01.html").exists()
+
+        status, metrics = request(running_server, "GET", "/metrics")
+        assert metrics["jobs_total"] == 1
+        assert metrics["jobs_failed"] == 0
+        assert metrics["jobs_pending"] == 0
+        assert metrics["cache_toc_misses"] == 1
+
+    def test_failed_conversion(self, running_server, tmp_path):
+        status, body = request(running_server, "POST", "/convert",
+                               {"source": str(tmp_path / "missing"),
+                                "target": str(tmp_path / "build"),
+                                "options": {"skip_jb_build": True}})
+        assert status == 500
+        assert body["status"] == "failed"
+        assert request(running_server, "GET",
+                       "/metrics")[1]["jobs_failed"] == 1
+
+    def test_broken_pool(self, running_server, example_book):
+        """
+        A worker dying is reported as a failed job, and the pool is replaced
+        """
+        service = running_server.service
+        with pytest.raises(Exception):  # the worker exits, breaking the pool
+            service.pool.submit(os._exit, 1).result()
+
+        job = {"source": str(example_book),
+               "target": str(example_book.parent / "build"),
+               "options": {"skip_jb_build": True}}
+        status, body = request(running_server, "POST", "/convert", job)
+        assert status == 500
+        assert body["status"] == "failed"
+        assert body["error"]
+
+        status, body = request(running_server, "POST", "/convert", job)
+        assert status == 200
+        metrics = request(running_server, "GET", "/metrics")[1]
+        assert metrics["pool_restarts"] == 1
+        assert metrics["jobs_failed"] == 1
+
+    @pytest.mark.parametrize("body", [{"source": "only"}, "not a job"])
+    def test_bad_request(self, running_server, body):
+        status, response = request(running_server, "POST", "/convert", body)
+        assert status == 400
+        assert "error" in response
+
+    def test_unknown_endpoint(self, running_server):
+        assert request(running_server, "GET", "/nope")[0] == 404
+
+    def test_unix_socket(self, tmp_path):
+        """ the service can listen on a local unix socket """
+        socket_path = str(tmp_path / "jb2htmlbook.sock")
+        service = ConversionService(workers=1)
+        server = make_server(service, socket_path=socket_path)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(socket_path)
+            client.sendall(b"GET /health HTTP/1.0\r\n\r\n")
+            response = b""
+            while chunk := client.recv(4096):
+                response += chunk
+            client.close()
+            assert b"200 OK" in response
+            assert b'"status": "ok"' in response
+        finally:
+            server.shutdown()
+            server.server_close()
+            service.shutdown()
@@ -228,3 +228,30 @@ def test_svg_retains_attrs():
     clean_chapter(svg_ch, False)
     assert "stroke" in svg_ch.find("line").get('style')  # type:ignore
     assert "blue" in svg_ch.find("svg").get('style')  # type:ignore
+
+
+def test_clean_chapter_tracks_svgs_and_tables():
+    """
+    Styles are kept throughout an SVG (but not after it), each table loses
+    only its first caption number, and only the hidden parts of hidden cells
+    are removed
+    """
+    chapter = BeautifulSoup("""<div>
+<svg style="a"><g><g><path style="fill:red"/></g></g></svg>
+<p style="b">After</p>
+<table border="1"><caption><span class="caption-number">Table 1 </span>
+</caption><tr><td><table><caption>
+<span class="caption-number">Table 2 </span>
+<span class="caption-number">Table 3 </span>
+</caption></table></td></tr></table>
+<div class="tag_hide-input"><div class="hide">Hidden</div><p>Shown</p></div>
+</div>""", "html.parser")
+    clean_chapter(chapter)
+    assert chapter.find("path")["style"] == "fill:red"  # type: ignore
+    assert not chapter.find("p").get("style")  # type: ignore
+    assert not chapter.find("table").get("border")  # type: ignore
+    assert [span.string for span in
+            chapter.find_all("span", class_="caption-number")] == \
+        ["Table 3 "]
+    assert "Hidden" not in str(chapter)
+    assert "Shown" in str(chapter)
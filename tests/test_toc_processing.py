@@ -1,6 +1,10 @@
 import pytest
 from pathlib import Path
-from jupyter_book_to_htmlbook.toc_processing import get_book_toc
+from jupyter_book_to_htmlbook.toc_processing import (
+        get_book_toc,
+        select_toc_elements,
+        TocError
+    )
 
 
 class TestGetBookToc:
@@ -221,7 +225,7 @@ parts:
                 tmp_path / '_build/html/example.html'
                ]
 
-    def test_toc_with_parts_no_captions(self, tmp_path, caplog, capsys):
+    def test_toc_with_parts_no_captions(self, tmp_path, caplog):
         """
         Error out if parts don't have captions, and inform the user why
         """
@@ -239,33 +243,49 @@ parts:
     - file: part2/chapter2
       sections:
       - file: part2/section2-1""")
-        with pytest.raises(SystemExit):
+        with pytest.raises(TocError) as error:
             get_book_toc(tmp_path)
         assert "missing part caption" in caplog.text.lower()
-        assert "missing part caption" in \
-            capsys.readouterr().out.lower()
+        assert "missing part caption" in str(error.value).lower()
+
+    def test_toc_with_a_part_missing_its_caption(self, tmp_path, caplog):
+        """ Every part needs a caption, not just the first """
+        with open(tmp_path / '_toc.yml', 'wt') as f:
+            f.write("""format: jb-book
+root: intro
+parts:
+  - caption: Part 1
+    chapters:
+    - file: part1/chapter1
+  - chapters:
+    - file: part2/chapter1
+  - caption: ""
+    chapters:
+    - file: part3/chapter1""")
+        with pytest.raises(TocError, match="Missing part caption"):
+            get_book_toc(tmp_path)
 
     # edge cases
-    def test_no_book_toc(self, caplog, capsys):
+    def test_no_book_toc(self, caplog):
         """ Edge case: what if there's no _toc file? Don't continue. """
-        with pytest.raises(SystemExit):
+        with pytest.raises(TocError) as error:
             get_book_toc(Path())
         assert "Can't find" in caplog.text
-        assert "Can't find" in capsys.readouterr().out
+        assert "Can't find" in str(error.value)
 
-    def test_non_jb_book_format(self, tmp_path, caplog, capsys):
+    def test_non_jb_book_format(self, tmp_path, caplog):
         """ We should only support the "jb-book" format """
 
         with open(tmp_path / '_toc.yml', 'wt') as f:
             f.write("format: jb-article")
 
-        with pytest.raises(SystemExit):
+        with pytest.raises(TocError) as error:
             get_book_toc(tmp_path)
 
         assert "jb-book" in caplog.text
-        assert "jb-book" in capsys.readouterr().out.lower()
+        assert "jb-book" in str(error.value).lower()
 
-    def test_bad_yaml(self, tmp_path, caplog, capsys):
+    def test_bad_yaml(self, tmp_path, caplog):
         """
         YAML should be formatted as expected, or at least there
         ought to be a format defined
@@ -273,8 +293,46 @@ parts:
         with open(tmp_path / '_toc.yml', 'wt') as f:
             f.write("not-format: article")
 
-        with pytest.raises(SystemExit):
+        with pytest.raises(TocError) as error:
             get_book_toc(tmp_path)
 
         assert "malformed" in caplog.text.lower()
-        assert "malformed" in capsys.readouterr().out.lower()
+        assert "malformed" in str(error.value).lower()
+
+
+class TestSelectTocElements:
+    """
+    Tests for picking out chapters and parts of the table of contents
+    (for `--only` conversions)
+    """
+    book = Path('tests/example_book')
+
+    def toc(self):
+        return get_book_toc(self.book)
+
+    def test_select_by_stem_and_path(self):
+        html = self.book / '_build/html'
+        result = select_toc_elements(self.toc(),
+                                     ['ch01', 'notebooks/markup.ipynb'],
+                                     self.book)
+        assert result == [html / 'notebooks/ch01.html',
+                          html / 'notebooks/markup.html']
+
+    def test_section_selects_chapter(self):
+        result = select_toc_elements(self.toc(), ['ch02.01'], self.book)
+        assert len(result) == 1
+        assert isinstance(result[0], list)
+        assert result[0][0].name == 'ch02.00.html'
+
+    def test_select_part(self):
+        """ a part number selects the part and its chapters """
+        result = select_toc_elements(self.toc(), ['part-3'], self.book)
+        assert [Path(e).name for e in result] == [
+            '_jb_part-3-Code.html', 'code_py.html', 'code_r.html']
+        assert select_toc_elements(self.toc(), ['3'], self.book) == result
+
+    def test_unmatched_selector(self):
+        with pytest.raises(TocError) as error:
+            select_toc_elements(self.toc(), ['ch01', 'ch99'], self.book)
+        assert "ch99" in str(error.value)
+        assert "ch01" not in str(error.value)
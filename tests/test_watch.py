@@ -0,0 +1,224 @@
+import os
+import pytest
+import shutil
+import threading
+import time
+from pathlib import Path
+from jupyter_book_to_htmlbook import watch
+from jupyter_book_to_htmlbook.conversion import (
+        ConversionOptions,
+        convert_book
+    )
+from jupyter_book_to_htmlbook.watch import (
+        BookWatcher,
+        changed_files,
+        snapshot,
+        wait_for_changes
+    )
+
+
+@pytest.fixture
+def watched_book(tmp_path, monkeypatch: pytest.MonkeyPatch):
+    """ a converted copy of the example book, with a watcher for it """
+    source = tmp_path / 'book'
+    shutil.copytree('tests/example_book', source)
+    monkeypatch.chdir(tmp_path)
+    options = ConversionOptions(skip_jb_build=True)
+    result = convert_book(source, 'build', options)
+    return BookWatcher(source, 'build', options, result)
+
+
+def touch(path: Path, text: str = ""):
+    """ simulate `jb build` rewriting a file """
+    path.write_text(path.read_text() + text)
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+class TestWatch:
+    """
+    Tests for watch mode, i.e., incremental reconversion
+    """
+
+    def test_snapshot_and_changes(self, tmp_path):
+        (tmp_path / '_toc.yml').write_text("format: jb-book")
+        html = tmp_path / '_build/html'
+        html.mkdir(parents=True)
+        (html / 'ch01.html').write_text("a")
+        (html / 'ignored.js').write_text("a")
+        before = snapshot(tmp_path)
+        assert set(before) == {tmp_path / '_toc.yml', html / 'ch01.html'}
+
+        touch(html / 'ch01.html', "b")
+        (html / 'ch02.html').write_text("a")
+        assert changed_files(before, snapshot(tmp_path)) == {
+                html / 'ch01.html', html / 'ch02.html'}
+
+    def test_wait_for_changes_debounces(self, tmp_path):
+        """ a burst of writes is reported as one change """
+        html = tmp_path / '_build/html'
+        html.mkdir(parents=True)
+        before = snapshot(tmp_path)
+
+        def burst():
+            for number in range(3):
+                (html / f'ch0{number}.html').write_text("a")
+                time.sleep(0.05)
+
+        writer = threading.Timer(0.1, burst)
+        writer.start()
+        _, changed = wait_for_changes(tmp_path, before, poll_interval=0.02,
+                                      debounce=0.3, timeout=5)
+        writer.join()
+        assert len(changed) == 3
+
+    def test_wait_for_changes_timeout(self, tmp_path):
+        current, changed = wait_for_changes(tmp_path, snapshot(tmp_path),
+                                            poll_interval=0.01, timeout=0.05)
+        assert changed == set()
+
+    def test_only_affected_chapters_reconverted(self, watched_book):
+        html = watched_book.source_dir
+        touch(html / 'notebooks/ch01.html')
+        assert watched_book.handle_changes({html / 'notebooks/ch01.html'}) \
+            == ['build/notebooks/ch01.html']
+
+    def test_section_change_reconverts_parent(self, watched_book):
+        html = watched_book.source_dir
+        written = watched_book.handle_changes(
+                {html / 'notebooks/ch02.01.html'})
+        assert written == ['build/notebooks/ch02.00.html']
+
+    def test_failed_chapter_fixed(self, tmp_path, monkeypatch):
+        """ a chapter that failed with --keep-going is picked up once fixed """
+        source = tmp_path / 'book'
+        shutil.copytree('tests/example_book', source)
+        monkeypatch.chdir(tmp_path)
+        ch01 = source / '_build/html/notebooks/ch01.html'
+        original = ch01.read_text()
+        ch01.write_text("<html><body><p>Oops</p></body></html>")
+        options = ConversionOptions(skip_jb_build=True, keep_going=True)
+        result = convert_book(source, 'build', options)
+        watcher = BookWatcher(source, 'build', options, result)
+        assert watcher.processed_files == result.files
+
+        ch01.write_text(original)
+        assert watcher.handle_changes({ch01}) == ['build/notebooks/ch01.html']
+        assert watcher.processed_files.index('build/notebooks/ch01.html') == \
+            watcher.processed_files.index('build/part-1.html') + 1
+
+    def test_unrelated_change_does_nothing(self, watched_book):
+        html = watched_book.source_dir
+        assert watched_book.handle_changes({html / 'genindex.html'}) == []
+
+    def test_new_id_collisions_reconvert_later_chapters(self, watched_book):
+        """
+        if a changed chapter picks up an ID used by a later chapter, the
+        later chapter is reconverted so IDs stay unique across the book
+        """
+        html = watched_book.source_dir
+        ch01 = html / 'notebooks/ch01.html'
+        ch01.write_text(ch01.read_text().replace(
+                        '<p>', '<p id="example-table">', 1))
+        written = watched_book.handle_changes({ch01})
+        assert written[0] == 'build/notebooks/ch01.html'
+        assert 'build/notebooks/markup.html' in written
+        markup_ids = watched_book.ids[str(html / 'notebooks/markup.html')]
+        assert 'example-table' not in markup_ids
+
+    def test_failed_reconversion_keeps_ids(self, watched_book, monkeypatch):
+        """
+        a chapter that fails to reconvert keeps its IDs, so later chapters
+        are still checked against them
+        """
+        html = watched_book.source_dir
+        code_py = html / 'notebooks/code_py.html'
+        markup = html / 'notebooks/markup.html'
+        taken = watched_book.ids[str(code_py)][0]
+        markup.write_text(markup.read_text().replace(
+                          '<p>', f'<p id="{taken}">', 1))
+
+        process_chapter = watch.process_chapter
+
+        def failing_code_py(element, *args, **kwargs):
+            if element == code_py:
+                raise FileNotFoundError("still being written")
+            return process_chapter(element, *args, **kwargs)
+
+        monkeypatch.setattr(watch, "process_chapter", failing_code_py)
+        written = watched_book.handle_changes({code_py, markup})
+        assert written == ['build/notebooks/markup.html']
+        assert taken in watched_book.ids[str(code_py)]
+        assert taken not in watched_book.ids[str(markup)]
+
+    def test_toc_change_replans(self, watched_book):
+        """ a toc change converts new chapters and forgets removed ones """
+        toc = watched_book.source / '_toc.yml'
+        toc.write_text("""format: jb-book
+root: intro
+parts:
+  - caption: Only Part
+    chapters:
+    - file: notebooks/ch01
+    - file: notebooks/new_chapter
+""")
+        html = watched_book.source_dir
+        shutil.copy(html / 'notebooks/markup.html',
+                    html / 'notebooks/new_chapter.html')
+        written = watched_book.handle_changes({toc})
+        assert written == ['build/part-1.html',
+                           'build/notebooks/new_chapter.html']
+        assert watched_book.processed_files == [
+                'build/part-1.html',
+                'build/notebooks/ch01.html',
+                'build/notebooks/new_chapter.html']
+
+    def test_bad_toc_keeps_plan(self, watched_book, caplog):
+        toc = watched_book.source / '_toc.yml'
+        files = watched_book.processed_files
+        toc.write_text("format: jb-article")
+        assert watched_book.handle_changes({toc}) == []
+        assert watched_book.processed_files == files
+        assert "Not replanning" in caplog.text
+
+    def test_book_disabled_passes(self, tmp_path, monkeypatch):
+        """ reconversions skip the passes the book's _config.yml turns off """
+        source = tmp_path / 'book'
+        shutil.copytree('tests/example_book', source)
+        monkeypatch.chdir(tmp_path)
+        with open(source / '_config.yml', 'a') as f:
+            f.write("\njb2htmlbook:\n  disable_passes:\n" +
+                    "    - process_admonitions\n")
+        options = ConversionOptions(skip_jb_build=True)
+        result = convert_book(source, 'build', options)
+        watcher = BookWatcher(source, 'build', options, result)
+        preface = source / '_build/html/notebooks/preface.html'
+        touch(preface)
+        assert watcher.handle_changes({preface}) == \
+            ['build/notebooks/preface.html']
+        # i.e., the admonition's title is still there
+        assert '<div>\n<p>Note</p>' in \
+            Path('build/notebooks/preface.html').read_text()
+
+    def test_watch_cycle(self, watched_book, capsys):
+        """ the watch loop reconverts and reports after a change """
+        html = watched_book.source_dir
+        writer = threading.Timer(
+                0.1, touch, [html / 'notebooks/ch01.html', " "])
+        writer.start()
+        watched_book.watch(cycles=1, poll_interval=0.02, debounce=0.1)
+        writer.join()
+        assert 'build/notebooks/ch01.html' in capsys.readouterr().out
+
+    def test_watch_cycle_on_stderr(self, watched_book, capsys):
+        """ rewritten files can be reported on stderr instead """
+        html = watched_book.source_dir
+        writer = threading.Timer(
+                0.1, touch, [html / 'notebooks/ch01.html', " "])
+        writer.start()
+        watched_book.watch(cycles=1, poll_interval=0.02, debounce=0.1,
+                           err=True)
+        writer.join()
+        output = capsys.readouterr()
+        assert output.out == ""
+        assert 'build/notebooks/ch01.html' in output.err
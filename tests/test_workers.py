@@ -0,0 +1,113 @@
+import os
+import pytest
+import re
+from pathlib import Path
+from jupyter_book_to_htmlbook import workers
+from jupyter_book_to_htmlbook.conversion import ConversionOptions, convert_book
+from jupyter_book_to_htmlbook.workers import (
+        ChapterPool,
+        MB,
+        parse_built_chapter,
+        peak_rss
+    )
+
+
+def chapters(book: Path) -> list:
+    html = book / '_build/html/notebooks'
+    return [html / 'ch01.html', html / 'code_py.html', html / 'markup.html',
+            html / 'glossary.html']
+
+
+class TestChapterPool:
+    """ Tests for building chapters on recycled worker processes """
+
+    def test_results_in_order(self, example_book):
+        pool = ChapterPool(ConversionOptions(), jobs=2)
+        results = list(pool.run(chapters(example_book)))
+        assert [result["index"] for result in results] == [0, 1, 2, 3]
+        assert 'example-table' in results[2]["ids"]
+        assert all(result["peak_rss"] > 0 for result in results)
+        assert all(result["flags"] == [] for result in results)
+
+    def test_recycle_after_chapters(self, example_book):
+        pool = ChapterPool(ConversionOptions(), jobs=1, max_chapters=1)
+        list(pool.run(chapters(example_book)))
+        assert pool.workers_started == 4
+
+    def test_memory_budget_retries(self, example_book):
+        """ chapters over budget are flagged and retried in a fresh worker """
+        pool = ChapterPool(ConversionOptions(), jobs=1, memory_budget=1)
+        results = list(pool.run(chapters(example_book)[:2]))
+        assert [result["flags"] for result in results] == [
+            ["over_memory_budget", "over_memory_budget"]] * 2
+        assert all("html" in result for result in results)
+        assert pool.workers_started == 3
+
+    def test_recycle_after_failure(self, example_book):
+        """ a worker whose chapter raised isn't given another one """
+        book = chapters(example_book)
+        book[0].write_text("<html><body><p>Oops</p></body></html>")
+        pool = ChapterPool(ConversionOptions(), jobs=1)
+        results = list(pool.run(book[:2]))
+        assert "error" in results[0] and "html" in results[1]
+        assert pool.workers_started == 2
+
+    def test_worker_dies(self, example_book, monkeypatch):
+        """ a chapter that takes its worker down is retried, then fails """
+        if workers.multiprocessing.get_start_method() != "fork":
+            pytest.skip("patching the worker needs forked processes")
+
+        def crash(toc_element, ctx):
+            os._exit(1)
+
+        monkeypatch.setattr(workers, "build_chapter", crash)
+        pool = ChapterPool(ConversionOptions(), jobs=2)
+        results = list(pool.run(chapters(example_book)[:1]))
+        assert results[0]["flags"] == ["worker_died", "worker_died"]
+        assert isinstance(results[0]["error"], RuntimeError)
+
+
+class TestParallelConversion:
+    """ converting with --jobs gives the same book as converting serially """
+
+    def test_same_output(self, example_book, tmp_path):
+        serial = convert_book(example_book, 'serial',
+                              ConversionOptions(skip_jb_build=True))
+        parallel = convert_book(example_book, 'parallel',
+                                ConversionOptions(skip_jb_build=True, jobs=3,
+                                                  worker_max_chapters=2))
+        assert parallel.metrics == serial.metrics
+        assert set(parallel.chapter_memory) == {
+            f"parallel/{file.removeprefix('serial/')}"
+            for file in serial.chapter_memory}
+        for file in serial.files:
+            # duplicate IDs get random suffixes
+            def text(path):
+                return re.sub(r'_[0-9]+"', '"', path.read_text())
+            assert text(tmp_path / file) == text(
+                tmp_path / file.replace('serial', 'parallel', 1))
+
+    def test_failure_in_worker(self, example_book):
+        (example_book / '_build/html/notebooks/ch01.html').write_text(
+                "<html><body><p>Oops</p></body></html>")
+        with pytest.raises(RuntimeError):
+            convert_book(example_book, 'build',
+                         ConversionOptions(skip_jb_build=True, jobs=2))
+        result = convert_book(example_book, 'build',
+                              ConversionOptions(skip_jb_build=True, jobs=2,
+                                                keep_going=True))
+        assert [f["file"] for f in result.failures] == ['notebooks/ch01.html']
+        assert 'build/notebooks/markup.html' in result.files
+
+
+def test_parse_built_chapter():
+    """ a worker's chapter is parsed back without losing any whitespace """
+    html = """<section data-type="chapter" id="a">\n\n<h1>A</h1>\n\n\
+<p>Some <a href="#a">text</a><br/>\n</p>\n  \n</section>"""
+    chapter = parse_built_chapter(html)
+    assert chapter.name == "section"
+    assert str(chapter) == html
+
+
+def test_peak_rss():
+    assert peak_rss() > MB